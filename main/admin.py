@@ -1,6 +1,23 @@
 from django.contrib import admin
-from main.models import Author
+from main.models import Author, QueryFingerprint
 
 class AuthorAdmin(admin.ModelAdmin):
     pass
 admin.site.register(Author)
+
+class QueryFingerprintAdmin(admin.ModelAdmin):
+    list_display = ('short_sql', 'view', 'template', 'count', 'total_time',
+                    'mean_time', 'p95', 'last_seen')
+    list_filter = ('view', 'template')
+    search_fields = ('sql', 'view', 'template')
+    readonly_fields = ('fingerprint', 'view', 'template', 'sql', 'example',
+                       'count', 'total_time', 'p95', 'first_seen',
+                       'last_seen')
+
+    def short_sql(self, obj):
+        return obj.sql[:120]
+    short_sql.short_description = "SQL"
+
+    def has_add_permission(self, request):
+        return False
+admin.site.register(QueryFingerprint, QueryFingerprintAdmin)
@@ -0,0 +1,241 @@
+"""
+Bundled, minified and content-hashed static assets.
+
+``ASSET_BUNDLES`` maps a bundle name (ending in ``.css`` or ``.js``) to the
+static files it is made of. ``buildassets`` concatenates and minifies each
+bundle into ``STATIC_ROOT/bundles/<name>.<hash>.<ext>`` and records the
+names in ``bundles/manifest.json``; since a file's name changes whenever
+its content does, the web server can send ``bundles/`` with an immutable,
+year-long ``Cache-Control``.
+
+Templates use ``{% bundle "prime.css" %}`` (``main.templatetags.assets``),
+which links the built file when the manifest lists it and, with ``DEBUG``
+on or before a build, each source file as it is. Stylesheet bundles and
+their ``fonts()`` are also announced as preloads (see ``main.hints``).
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+BUNDLE_DIRECTORY = 'bundles'
+MANIFEST_NAME = 'manifest.json'
+
+CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.DOTALL)
+CSS_STRING = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+CSS_SPACE_AROUND = re.compile(r'\s*([{};,>])\s*')
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_IMPORT = re.compile(r'@import\s[^;]+;\s*')
+CSS_CHARSET = re.compile(r'@charset\s[^;]+;\s*')
+CSS_FONT_FACE = re.compile(r'@font-face\s*{[^}]*}')
+
+# preferred font formats; every browser that preloads reads WOFF
+FONT_FORMATS = ('.woff2', '.woff')
+
+# a "/" after one of these (or at the start) opens a regular expression
+REGEX_PRECEDERS = '(,=:[!&|?{};+-*%~^<>'
+
+
+class AssetError(Exception):
+    pass
+
+
+def bundles():
+    return getattr(settings, 'ASSET_BUNDLES', {})
+
+def sourcePath(name):
+    path = finders.find(name)
+    if path is None:
+        raise AssetError("Static file %s (in ASSET_BUNDLES) not found." %
+                         name)
+    return path
+
+
+# minification
+
+def minifyCSS(source):
+    source = CSS_COMMENT.sub('', source)
+    # leave quoted strings alone; every odd part is one
+    parts = CSS_STRING.split(source)
+    for index in xrange(0, len(parts), 2):
+        code = re.sub(r'\s+', ' ', parts[index])
+        code = CSS_SPACE_AROUND.sub(r'\1', code)
+        parts[index] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+def minifyJS(source):
+    """
+    Removes comments (except ``/*! ... */``), indentation and blank lines.
+    Line breaks are kept, so automatic semicolon insertion is unaffected.
+    """
+    out = []
+    index, length = 0, len(source)
+    while index < length:
+        char = source[index]
+        following = source[index + 1] if index + 1 < length else ''
+        if char in '"\'':
+            end = index + 1
+            while end < length and source[end] != char:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[index:end + 1])
+            index = end + 1
+        elif char == '/' and following == '*' and \
+                source[index + 2:index + 3] != '!':
+            end = source.find('*/', index + 2)
+            end = length if end < 0 else end + 2
+            out.append('\n' if '\n' in source[index:end] else ' ')
+            index = end
+        elif char == '/' and following == '/':
+            end = source.find('\n', index)
+            index = length if end < 0 else end
+        elif char == '/' and isRegexStart(out):
+            end, in_class = index + 1, False
+            while end < length and source[end] != '\n':
+                if source[end] == '\\':
+                    end += 1
+                elif source[end] == '[':
+                    in_class = True
+                elif source[end] == ']':
+                    in_class = False
+                elif source[end] == '/' and not in_class:
+                    break
+                end += 1
+            out.append(source[index:end + 1])
+            index = end + 1
+        else:
+            out.append(char)
+            index += 1
+    lines = (line.strip() for line in ''.join(out).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def isRegexStart(out):
+    code = ''.join(out[-20:]).rstrip()
+    return not code or code[-1] in REGEX_PRECEDERS or \
+        re.search(r'\b(return|typeof|case|do|else|in)$', code) is not None
+
+
+# building
+
+def rewriteURLs(css, name):
+    """
+    Makes relative ``url()`` references in the static file ``name`` absolute,
+    since the bundle is served from another directory.
+    """
+    directory = posixpath.dirname(name)
+
+    def rewrite(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        path = posixpath.normpath(posixpath.join(directory, path))
+        return 'url(%s%s%s%s)' % (quote, settings.STATIC_URL, path + suffix,
+                                  quote)
+    return CSS_URL.sub(rewrite, css)
+
+def buildBundle(name, sources):
+    parts = []
+    for source in sources:
+        with open(sourcePath(source)) as f:
+            text = f.read()
+        if name.endswith('.css'):
+            parts.append(minifyCSS(rewriteURLs(CSS_CHARSET.sub('', text),
+                                               source)))
+        elif source.endswith('.min.js'):
+            parts.append(text.strip())
+        else:
+            parts.append(minifyJS(text))
+    if name.endswith('.css'):
+        # @import is ignored anywhere but the top of a stylesheet
+        css = '\n'.join(parts)
+        imports = CSS_IMPORT.findall(css)
+        return ''.join(imports) + CSS_IMPORT.sub('', css) + '\n'
+    return ';\n'.join(parts) + '\n'
+
+def hashedName(name, content):
+    base, extension = posixpath.splitext(name)
+    return '%s/%s.%s%s' % (BUNDLE_DIRECTORY, base,
+                           hashlib.md5(content).hexdigest()[:12], extension)
+
+def build(root=None):
+    """
+    Writes every bundle under ``root`` (``STATIC_ROOT``) and the manifest.
+    Returns {name: (hashed name, source bytes, bundle bytes)}.
+    """
+    root = root or settings.STATIC_ROOT
+    directory = os.path.join(root, BUNDLE_DIRECTORY)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest, report = {}, {}
+    for name, sources in sorted(bundles().iteritems()):
+        content = buildBundle(name, sources)
+        hashed = hashedName(name, content)
+        with open(os.path.join(root, hashed), 'w') as f:
+            f.write(content)
+        manifest[name] = hashed
+        report[name] = (hashed, sum(os.path.getsize(sourcePath(source))
+                                    for source in sources), len(content))
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+    loadManifest(reload=True)
+    return report
+
+
+# lookup
+
+_manifest = None
+
+def loadManifest(reload=False):
+    global _manifest
+    if _manifest is None or reload:
+        path = os.path.join(settings.STATIC_ROOT or '', BUNDLE_DIRECTORY,
+                            MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                _manifest = json.load(f)
+        except (IOError, ValueError):
+            _manifest = {}
+    return _manifest
+
+def urls(name):
+    """
+    URLs to load bundle ``name`` from: the built file, or each source.
+    """
+    if name not in bundles():
+        raise AssetError("No bundle named %s in ASSET_BUNDLES." % name)
+    built = None if settings.DEBUG else loadManifest().get(name)
+    if built:
+        return [settings.STATIC_URL + built]
+    return [settings.STATIC_URL + source for source in bundles()[name]]
+
+_fonts = {}
+
+def fonts(name):
+    """
+    URLs of the font files the ``@font-face`` rules of stylesheet bundle
+    ``name`` load, one per rule in the first format of ``FONT_FORMATS``
+    it offers.
+    """
+    if name not in _fonts:
+        found = []
+        for source in bundles().get(name, ()) if name.endswith('.css') \
+                else ():
+            with open(sourcePath(source)) as f:
+                css = rewriteURLs(CSS_COMMENT.sub('', f.read()), source)
+            for rule in CSS_FONT_FACE.findall(css):
+                offered = [url for _, url in CSS_URL.findall(rule)]
+                for extension in FONT_FORMATS:
+                    url = next((url for url in offered if
+                                re.match(r'[^?#]*', url).group(0)
+                                .endswith(extension)), None)
+                    if url:
+                        found.append(url)
+                        break
+        _fonts[name] = found
+    return _fonts[name]
@@ -0,0 +1,198 @@
+"""
+Latency, query count and memory benchmark over every prime and music URL
+pattern, run in-process through the test client.
+
+Each named pattern has a sampler that turns rows in the database into
+concrete URLs; patterns without one are reported as skipped so new views
+are noticed. Results are plain dicts, saved as JSON by ``benchurls`` so two
+commits can be compared.
+"""
+import os
+import random
+import resource
+import subprocess
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.importlib import import_module
+
+from music.models import Album
+from prime.models import Issue, Article, Recipe, DIYarticle, RecipeTag, \
+    DIYTag, Neighborhood
+
+
+def rows(queryset, count, rng):
+    values = list(queryset)
+    return rng.sample(values, min(count, len(values)))
+
+def slugs(model, count, rng):
+    return rows(model.objects.values_list('slug', flat=True), count, rng)
+
+def names(model, count, rng):
+    return rows(model.objects.values_list('name', flat=True), count, rng)
+
+def pages(name, count, rng):
+    return [reverse(name)] + ['%s?page=%d' % (reverse(name), page)
+                              for page in xrange(2, count + 1)]
+
+# pattern name: (count, rng) -> [url]
+SAMPLERS = {
+    'root': lambda n, rng: pages('root', n, rng),
+    'prime_recipe': lambda n, rng: pages('prime_recipe', n, rng),
+    'prime_diy': lambda n, rng: pages('prime_diy', n, rng),
+    'prime_recipes': lambda n, rng: [
+        reverse('prime_recipes', args=[slug])
+        for slug in slugs(Recipe, n, rng)],
+    'prime_diys': lambda n, rng: [
+        reverse('prime_diys', args=[slug])
+        for slug in slugs(DIYarticle, n, rng)],
+    'prime_recipe_tag': lambda n, rng: [
+        reverse('prime_recipe_tag', args=[name])
+        for name in names(RecipeTag, n, rng)],
+    'prime_diy_tag': lambda n, rng: [
+        reverse('prime_diy_tag', args=[name])
+        for name in names(DIYTag, n, rng)],
+    'cityguides_view': lambda n, rng: [reverse('cityguides_view')],
+    'cityguide_view': lambda n, rng: [
+        reverse('cityguide_view', args=[slug])
+        for slug in slugs(Neighborhood, n, rng)],
+    'prime_issue': lambda n, rng: [
+        reverse('prime_issue', args=[slug])
+        for slug in slugs(Issue, n, rng)],
+    'prime_article': lambda n, rng: [
+        reverse('prime_article', args=pair) for pair in
+        rows(Article.objects.filter(issue__isnull=False)
+             .values_list('issue__slug', 'slug'), n, rng)],
+    'prime_past_issues': lambda n, rng: [reverse('prime_past_issues')],
+    'prime_search': lambda n, rng: [
+        '%s?q=%s' % (reverse('prime_search'), title.split()[0])
+        for title in rows(Article.objects.values_list('title', flat=True),
+                          n, rng)],
+    'prime_suggest': lambda n, rng: [
+        '%s?q=%s' % (reverse('prime_suggest'), title[:3])
+        for title in rows(Article.objects.values_list('title', flat=True),
+                          n, rng)],
+    'main_page': lambda n, rng: [reverse('main_page')],
+}
+
+# patterns that would call out to other servers
+SKIPPED = {'music_reviews': 'fetches reviews from an external server'}
+
+
+def patternNames(urlconfs=('prime.urls', 'music.urls')):
+    """
+    Name of every pattern in ``urlconfs`` (the regex if unnamed).
+    """
+    found = []
+    for urlconf in urlconfs:
+        for pattern in import_module(urlconf).urlpatterns:
+            found.append(pattern.name or pattern.regex.pattern)
+    return found
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1,
+                int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def peakRSS():
+    """
+    Peak resident set size of this process in kilobytes (Linux units).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def gitCommit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(samples=5, repeat=10, seed=0, log=None):
+    """
+    Requests ``samples`` URLs per pattern ``repeat`` times each, after one
+    untimed warm-up request that also counts queries.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    client = Client(HTTP_HOST='localhost')
+    results = {}
+    for name in patternNames():
+        if name in SKIPPED or name not in SAMPLERS:
+            results[name] = {'skipped': SKIPPED.get(name, 'no sampler')}
+            log("%-20s skipped: %s" % (name, results[name]['skipped']))
+            continue
+        urls = SAMPLERS[name](samples, rng)
+        timings, queries, statuses = [], [], set()
+        for url in urls:
+            with CaptureQueriesContext(connection) as captured:
+                statuses.add(client.get(url).status_code)
+            queries.append(len(captured))
+            for _ in xrange(repeat):
+                start = time.time()
+                client.get(url)
+                timings.append((time.time() - start) * 1000)
+        timings.sort()
+        results[name] = {
+            'urls': len(urls),
+            'requests': len(timings),
+            'p50': percentile(timings, 0.50),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99),
+            'mean': sum(timings) / len(timings) if timings else 0,
+            'queries_min': min(queries) if queries else 0,
+            'queries_max': max(queries) if queries else 0,
+            'statuses': sorted(statuses),
+            'peak_rss_kb': peakRSS(),
+        }
+        log("%-20s p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  queries %d-%d" % (
+            name, results[name]['p50'], results[name]['p95'],
+            results[name]['p99'], results[name]['queries_min'],
+            results[name]['queries_max']))
+    return {
+        'commit': gitCommit(),
+        'date': datetime.now().isoformat(),
+        'rows': dict((model._meta.model_name, model.objects.count())
+                     for model in (Issue, Article, Recipe, DIYarticle,
+                                   Neighborhood, Album)),
+        'samples': samples,
+        'repeat': repeat,
+        'peak_rss_kb': peakRSS(),
+        'results': results,
+    }
+
+
+def compare(old, new):
+    """
+    Lines comparing two ``run()`` results pattern by pattern.
+    """
+    lines = ['%-20s %21s %21s %9s' % ('pattern', 'p50 ms', 'p95 ms',
+                                      'queries')]
+    for name in sorted(set(old['results']) | set(new['results'])):
+        before = old['results'].get(name, {})
+        after = new['results'].get(name, {})
+        if 'p50' not in before or 'p50' not in after:
+            lines.append('%-20s (only measured in one run)' % name)
+            continue
+        cells = []
+        for key in ('p50', 'p95'):
+            change = (after[key] - before[key]) / before[key] * 100 \
+                if before[key] else 0
+            cells.append('%7.1f -> %6.1f %+4.0f%%' % (before[key], after[key],
+                                                      change))
+        lines.append('%-20s %s %s %4d -> %d' % (
+            name, cells[0], cells[1], before['queries_max'],
+            after['queries_max']))
+    lines.append('peak RSS: %d -> %d KB' % (old['peak_rss_kb'],
+                                          new['peak_rss_kb']))
+    return lines
@@ -0,0 +1,137 @@
+"""
+Brotli and gzip response compression.
+
+``CompressionMiddleware`` (see ``main.middleware``) compresses text
+responses of the lean paths, streaming or not, with the best encoding the
+client accepts.
+``prime.caching.cachedPage`` stores each encoding of a cached page next to
+it, so a cache hit is served without compressing again; an issue's warm-up
+stores them again at the highest level. ``compressstatic``
+writes ``.br`` and ``.gz`` siblings of collected static files for the web
+server to send as they are.
+
+Brotli needs the optional ``brotli`` package; without it only gzip is used.
+"""
+import gzip
+import re
+import zlib
+from StringIO import StringIO
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# smaller bodies are not worth the bytes of the encoding headers
+MIN_LENGTH = 200
+
+# while a reader waits, then offline: cache warm-ups and static files
+LEVELS = {'gzip': 6, 'br': 5}
+BEST_LEVELS = {'gzip': 9, 'br': 11}
+
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/|application/(json|javascript|x-javascript|xml|atom\+xml|'
+    r'rss\+xml)|image/svg\+xml)')
+ACCEPT_PART = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def enabled():
+    return getattr(settings, 'RESPONSE_COMPRESSION', False)
+
+def available():
+    """
+    Supported encodings, most preferred first.
+    """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate(accept_encoding):
+    """
+    The encoding to use for an ``Accept-Encoding`` header value, or None.
+    The highest quality wins; ties go to the order of ``available()``.
+    """
+    qualities = {}
+    for part in accept_encoding.split(','):
+        match = ACCEPT_PART.match(part)
+        if not match:
+            continue
+        try:
+            qualities[match.group(1).lower()] = float(match.group(2) or 1)
+        except ValueError:
+            continue
+    best, best_quality = None, 0
+    for encoding in available():
+        quality = qualities.get(encoding, qualities.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compressible(response):
+    return not response.has_header('Content-Encoding') and \
+        response.status_code == 200 and \
+        bool(COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')))
+
+
+def compress(data, encoding, best=False):
+    level = (BEST_LEVELS if best else LEVELS)[encoding]
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    buffer = StringIO()
+    with gzip.GzipFile(mode='wb', compresslevel=level, fileobj=buffer,
+                       mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+def compressSequence(chunks, encoding):
+    """
+    Compresses an iterable of strings, flushing after every chunk so a
+    streaming response still reaches the client as it is produced.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=LEVELS['br'])
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(LEVELS['gzip'], zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def markEncoded(response, encoding):
+    response['Content-Encoding'] = encoding
+    if response.has_header('ETag'):
+        response['ETag'] = re.sub(r'"$', ';%s"' % encoding, response['ETag'])
+
+def compressResponse(response, encoding, best=False):
+    """
+    Compresses ``response`` in place. Returns False, leaving it untouched,
+    if it is too short or compression would not make it smaller.
+    """
+    if response.streaming:
+        response.streaming_content = compressSequence(
+            response.streaming_content, encoding)
+        del response['Content-Length']
+        markEncoded(response, encoding)
+        return True
+    if len(response.content) < MIN_LENGTH:
+        return False
+    data = compress(response.content, encoding, best)
+    if len(data) >= len(response.content):
+        return False
+    response.content = data
+    response['Content-Length'] = str(len(data))
+    markEncoded(response, encoding)
+    return True
+
+def varyOnEncoding(response):
+    if COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+        patch_vary_headers(response, ('Accept-Encoding',))
@@ -0,0 +1,183 @@
+"""
+Click-to-load facades for YouTube and Spotify embeds.
+
+A facade is a link to the video or track showing its thumbnail, title and a
+play button; ``embeds.js`` (in the prime and music script bundles) swaps in
+the player iframe when it is clicked, so no third-party script loads before
+the reader asks for it. Without JavaScript the link simply opens the page.
+
+Thumbnail and title come from the provider's oEmbed endpoint
+(``OEMBED_ENDPOINTS``), fetched once by ``fetchembeds`` (or, with
+``EMBED_FETCH_ON_SAVE``, when content using the embed is saved); until then
+the facade is a plain link with a play button. The thumbnail is stored under
+``MEDIA_ROOT/embeds/<provider>/`` with the metadata beside it as JSON;
+rendering only reads the cache and those files, never the network.
+"""
+import hashlib
+import httplib
+import json
+import logging
+import os
+import posixpath
+import time
+import urllib
+import urllib2
+import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
+
+from main import metrics
+
+logger = logging.getLogger('main.embeds')
+
+DIRECTORY = 'embeds'
+THUMBNAIL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+PROVIDERS = {
+    'youtube': {
+        'page': lambda key: 'https://www.youtube.com/watch?v=%s' % key,
+        'player': lambda key: '//www.youtube.com/embed/%s?autoplay=1' % key,
+    },
+    'spotify': {
+        # keys are URIs such as spotify:track:<id>
+        'page': lambda key: 'https://open.spotify.com/%s' %
+        '/'.join(key.split(':')[1:]),
+        'player': lambda key: 'https://embed.spotify.com/?uri=%s' % key,
+    },
+}
+
+
+def cacheKey(provider, key):
+    return 'embed:%s' % hashlib.md5('%s:%s' % (provider, key)).hexdigest()
+
+def storedName(provider, key, extension='.json'):
+    """
+    Path of a stored file for the embed, relative to ``MEDIA_ROOT``.
+    """
+    return posixpath.join(DIRECTORY, provider,
+                          hashlib.md5(key).hexdigest()[:16] + extension)
+
+def read(provider, key):
+    try:
+        with open(os.path.join(settings.MEDIA_ROOT,
+                               storedName(provider, key))) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def lookup(embeds):
+    """
+    {(provider, key): metadata dict or None} for ``embeds``, a list of
+    (provider, key) pairs, from the cache or, failing that, the stored
+    files. Makes no network requests.
+    """
+    keys = dict((cacheKey(provider, key), (provider, key))
+                for provider, key in embeds)
+    if not keys:
+        return {}
+    found = cache.get_many(keys.keys())
+    missing = {}
+    for cache_key, embed in keys.iteritems():
+        if cache_key not in found:
+            # {} remembers there is nothing stored yet
+            found[cache_key] = missing[cache_key] = read(*embed) or {}
+    if missing:
+        cache.set_many(missing)
+    return dict((embed, found[cache_key] or None)
+                for cache_key, embed in keys.iteritems())
+
+
+# fetching
+
+def endpoint(provider):
+    return getattr(settings, 'OEMBED_ENDPOINTS', {})[provider]
+
+def download(url, timeout):
+    response = urllib2.urlopen(url, timeout=timeout)
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+def fetch(provider, key):
+    """
+    Fetches and stores the metadata and thumbnail of one embed. Returns the
+    metadata, or None if the provider could not be reached.
+    """
+    timeout = getattr(settings, 'EMBED_FETCH_TIMEOUT', 5)
+    url = '%s?%s' % (endpoint(provider), urllib.urlencode({
+        'url': PROVIDERS[provider]['page'](key), 'format': 'json'}))
+    try:
+        data = json.loads(download(url, timeout))
+        thumbnail = None
+        if data.get('thumbnail_url'):
+            extension = posixpath.splitext(
+                urlparse.urlparse(data['thumbnail_url']).path)[1].lower()
+            if extension not in THUMBNAIL_EXTENSIONS:
+                extension = '.jpg'
+            thumbnail = storedName(provider, key, extension)
+            write(thumbnail, download(data['thumbnail_url'], timeout))
+    except (IOError, ValueError, httplib.HTTPException) as error:
+        logger.warning("Fetching %s embed %s failed: %s", provider, key,
+                       error)
+        metrics.inc('embed_fetches_total', provider=provider, result='error')
+        return None
+    metadata = {
+        'title': data.get('title') or '',
+        'thumbnail': thumbnail,
+        'fetched': int(time.time()),
+    }
+    write(storedName(provider, key), json.dumps(metadata))
+    cache.set(cacheKey(provider, key), metadata)
+    metrics.inc('embed_fetches_total', provider=provider, result='ok')
+    return metadata
+
+def write(name, data):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.rename(path + '.tmp', path)
+
+def ensure(embeds, force=False):
+    """
+    Fetches every embed in ``embeds`` that has nothing stored yet (or all
+    of them, with ``force``). Returns the number fetched successfully.
+    """
+    fetched = 0
+    for embed in set(embeds):
+        if force or read(*embed) is None:
+            if fetch(*embed) is not None:
+                fetched += 1
+    return fetched
+
+
+# rendering
+
+def facade(provider, key, metadata, width, height, css_class=''):
+    """
+    HTML of the click-to-load link standing in for a ``width`` by
+    ``height`` player; ``css_class`` is given to both.
+    """
+    metadata = metadata or {}
+    title = escape(metadata.get('title') or '')
+    classes = ' '.join(filter(None, ('embed-facade', 'embed-' + provider,
+                                     css_class)))
+    parts = ['<a class="%s" href="%s" data-embed="%s" '
+             'data-width="%d" data-height="%d" data-class="%s" '
+             'style="width: %dpx; height: %dpx"%s>' % (
+                 classes, escape(PROVIDERS[provider]['page'](key)),
+                 escape(PROVIDERS[provider]['player'](key)), width, height,
+                 css_class, width, height,
+                 ' title="%s"' % title if title else '')]
+    if metadata.get('thumbnail'):
+        parts.append('<img src="%s%s" alt="" loading="lazy" '
+                     'decoding="async">' % (settings.MEDIA_URL,
+                                            escape(metadata['thumbnail'])))
+    if title:
+        parts.append('<span class="embed-title">%s</span>' % title)
+    parts.append('<span class="embed-play" aria-label="Play"></span></a>')
+    return ''.join(parts)
@@ -0,0 +1,78 @@
+"""
+``Link: rel=preload`` headers for a page's critical resources.
+
+While a page renders, ``{% bundle %}`` adds each stylesheet bundle and the
+fonts its ``@font-face`` rules load, and ``{% preload %}`` adds anything
+else the template knows is needed early, such as an issue's header image or
+a district's lead photo (``main.templatetags.assets``). ``PreloadMiddleware``
+(see ``main.middleware``) sends what was collected with the response, so the
+browser starts fetching before it has parsed the HTML.
+
+WSGI cannot send ``103 Early Hints``, but a CDN in front of the site can
+turn these headers into one. ``prime.caching.cachedPage`` adds the header
+before caching a page, so hits keep it.
+"""
+import threading
+
+# a few critical resources; preloading everything only delays the rest
+MAX_HINTS = 8
+
+# fetched in this order whatever order templates add them in
+PRIORITY = ('style', 'font', 'image', 'script')
+
+FONT_TYPES = {
+    '.woff2': 'font/woff2',
+    '.woff': 'font/woff',
+    '.ttf': 'font/ttf',
+}
+
+_state = threading.local()
+
+
+def start():
+    _state.hints = []
+
+def stop():
+    """
+    The hints collected since ``start()``; collecting stops.
+    """
+    hints = current()
+    _state.hints = None
+    return hints
+
+def current():
+    return list(getattr(_state, 'hints', None) or [])
+
+def add(url, kind, type=None, crossorigin=False):
+    """
+    Asks for ``url`` to be preloaded ``as=kind``. Does nothing outside a
+    request, or if ``url`` was already added.
+    """
+    hints = getattr(_state, 'hints', None)
+    if hints is None or not url:
+        return
+    if url not in [hint[0] for hint in hints]:
+        hints.append((url, kind, type, crossorigin))
+
+
+def header(hints):
+    ordered = sorted(hints, key=lambda hint: PRIORITY.index(hint[1])
+                     if hint[1] in PRIORITY else len(PRIORITY))
+    values = []
+    for url, kind, type, crossorigin in ordered[:MAX_HINTS]:
+        value = '<%s>; rel=preload; as=%s' % (url, kind)
+        if type:
+            value += '; type="%s"' % type
+        if crossorigin:
+            value += '; crossorigin'
+        values.append(value)
+    return ', '.join(values)
+
+def apply(response, hints):
+    """
+    Sets ``Link`` on a successful HTML response that has none yet.
+    """
+    if hints and response.status_code == 200 and \
+            not response.has_header('Link') and \
+            response.get('Content-Type', '').startswith('text/html'):
+        response['Link'] = header(hints)
@@ -0,0 +1,53 @@
+import time
+from optparse import make_option
+
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+
+def runMiddleware(handler, request):
+    for process_request in handler._request_middleware:
+        process_request(request)
+    for process_view in handler._view_middleware:
+        process_view(request, runMiddleware, (), {})
+    response = HttpResponse('ok')
+    for process_response in handler._response_middleware:
+        response = process_response(request, response)
+    return response
+
+
+class Command(BaseCommand):
+    help = ("Times the MIDDLEWARE_CLASSES stack for a public path with and "
+            "without the lean path enabled.")
+    option_list = BaseCommand.option_list + (
+        make_option('--path', default='/prime/',
+                    help='Request path to benchmark (default: /prime/).'),
+        make_option('--requests', type='int', default=20000,
+                    help='Number of requests per run (default: 20000).'),
+    )
+
+    def timeStack(self, path, count):
+        handler = BaseHandler()
+        handler.load_middleware()
+        factory = RequestFactory()
+        start = time.time()
+        for _ in xrange(count):
+            runMiddleware(handler, factory.get(path, HTTP_HOST='localhost'))
+        elapsed = time.time() - start
+        return elapsed / count * 1e6
+
+    def handle(self, *args, **options):
+        path, count = options['path'], options['requests']
+
+        with override_settings(LEAN_PATH_PREFIXES=()):
+            full = self.timeStack(path, count)
+        lean = self.timeStack(path, count)
+
+        self.stdout.write("%s, %d requests" % (path, count))
+        self.stdout.write("  full stack: %8.1f us/request" % full)
+        self.stdout.write("  lean path:  %8.1f us/request" % lean)
+        self.stdout.write("  saving:     %8.1f us/request (%.0f%%)" %
+                          (full - lean, (full - lean) / full * 100))
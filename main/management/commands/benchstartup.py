@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+SCRIPT = ("import json, sys; from main.startup import measure; "
+          "print json.dumps(measure(sys.argv[1], int(sys.argv[2])))")
+
+
+class Command(NoArgsCommand):
+    help = ("Starts fresh interpreters that import project.wsgi with and "
+            "without WSGI_PRELOAD, fork workers that each serve one request, "
+            "and reports import time, first-request latency and resident "
+            "memory per worker.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--path', default='/prime/',
+                    help='Path each worker requests (default: /prime/).'),
+        make_option('--workers', type='int', default=4,
+                    help='Workers forked per run (default: 4).'),
+        make_option('--runs', type='int', default=3,
+                    help='Interpreters started per mode; the fastest import '
+                         'is reported (default: 3).'),
+    )
+
+    def run(self, preload, path, workers):
+        environ = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        environ.pop('WSGI_PRELOAD', None)
+        if preload:
+            environ['WSGI_PRELOAD'] = '1'
+        process = subprocess.Popen(
+            [sys.executable, '-c', SCRIPT, path, str(workers)],
+            stdout=subprocess.PIPE, env=environ)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise CommandError("Measuring startup failed.")
+        return json.loads(output.splitlines()[-1])
+
+    def handle_noargs(self, **options):
+        for preload in (False, True):
+            result = min((self.run(preload, options['path'],
+                                   options['workers'])
+                          for _ in xrange(options['runs'])),
+                         key=lambda result: result['import_ms'])
+            workers = result['workers']
+            self.stdout.write("%s:" % ("preloaded" if preload else "lazy"))
+            self.stdout.write("  import:        %7.1f ms, %d modules, "
+                              "master RSS %d KB" % (
+                                  result['import_ms'], result['modules'],
+                                  result['master_rss_kb']))
+            self.stdout.write("  heavy modules: %s" % (
+                ', '.join(result['heavy_modules']) or 'none'))
+            self.stdout.write("  first request: %7.1f ms (status %s)" % (
+                sum(w['first_request_ms'] for w in workers) / len(workers),
+                ', '.join(sorted(set(str(w['status']) for w in workers)))))
+            private = [w['private_kb'] for w in workers
+                       if w['private_kb'] is not None]
+            self.stdout.write("  per worker:    RSS %d KB, private %s" % (
+                sum(w['rss_kb'] for w in workers) / len(workers),
+                '%d KB' % (sum(private) / len(private)) if private
+                else 'unknown'))
@@ -0,0 +1,45 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.test.utils import override_settings
+
+from main import benchmark
+
+
+class Command(NoArgsCommand):
+    help = ("Requests every prime and music URL pattern through the test "
+            "client and reports p50/p95/p99 latency, query counts and peak "
+            "memory. Use --output to save JSON and --compare to diff "
+            "against an earlier run.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--samples', type='int', default=5,
+                    help='URLs sampled per pattern (default: 5).'),
+        make_option('--repeat', type='int', default=10,
+                    help='Timed requests per URL (default: 10).'),
+        make_option('--seed', type='int', default=0,
+                    help='Seed for sampling URLs (default: 0).'),
+        make_option('--cache', action='store_true', default=False,
+                    help='Keep the prime page cache on (default: off, so '
+                         'rendering is measured).'),
+        make_option('--output', help='Write the results to this JSON file.'),
+        make_option('--compare', help='JSON file of an earlier run to '
+                                      'compare with.'),
+    )
+
+    def handle_noargs(self, **options):
+        settings = {} if options['cache'] else {'PRIME_CACHE_TIMEOUT': 0}
+        with override_settings(**settings):
+            result = benchmark.run(options['samples'], options['repeat'],
+                                   options['seed'], log=self.stdout.write)
+        result['cache'] = options['cache']
+        self.stdout.write("peak RSS: %d KB" % result['peak_rss_kb'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as f:
+                old = json.load(f)
+            for line in benchmark.compare(old, result):
+                self.stdout.write(line)
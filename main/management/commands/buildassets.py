@@ -0,0 +1,19 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+from main import assets
+
+
+class Command(NoArgsCommand):
+    help = ("Concatenates and minifies each ASSET_BUNDLES entry into "
+            "STATIC_ROOT/bundles/ under a content-hashed name and writes "
+            "the manifest templates read. Run after collectstatic, and "
+            "before compressstatic.")
+
+    def handle_noargs(self, **options):
+        try:
+            report = assets.build()
+        except assets.AssetError as error:
+            raise CommandError(error)
+        for name, (hashed, before, after) in sorted(report.iteritems()):
+            self.stdout.write("%-22s %-40s %7d -> %7d bytes" % (
+                name, hashed, before, after))
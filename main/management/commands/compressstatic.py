@@ -0,0 +1,58 @@
+import os
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+from main import compression
+
+EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml',
+              '.map', '.ttf', '.eot', '.ico')
+
+
+class Command(NoArgsCommand):
+    help = ("Writes .gz (and, with the brotli package, .br) siblings of the "
+            "text files in STATIC_ROOT at maximum compression, for the web "
+            "server to send as they are. Run after collectstatic.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--force', action='store_true', default=False,
+                    help='Rewrite siblings that are already up to date.'),
+    )
+
+    def handle_noargs(self, **options):
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise CommandError("STATIC_ROOT does not exist; run "
+                               "collectstatic first.")
+        suffixes = dict((encoding, '.gz' if encoding == 'gzip' else '.br')
+                        for encoding in compression.available())
+        written = skipped = before = after = 0
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not name.endswith(EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if len(data) < compression.MIN_LENGTH:
+                    continue
+                for encoding, suffix in suffixes.iteritems():
+                    target = path + suffix
+                    if not options['force'] and os.path.exists(target) and \
+                            os.path.getmtime(target) >= \
+                            os.path.getmtime(path):
+                        skipped += 1
+                        continue
+                    encoded = compression.compress(data, encoding, best=True)
+                    if len(encoded) >= len(data):
+                        continue
+                    with open(target, 'wb') as f:
+                        f.write(encoded)
+                    written += 1
+                    before += len(data)
+                    after += len(encoded)
+        self.stdout.write("Wrote %d compressed files (%d up to date), "
+                          "%d KB -> %d KB." % (written, skipped,
+                                               before / 1024, after / 1024))
+        if 'br' not in suffixes:
+            self.stdout.write("brotli is not installed; wrote gzip only.")
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from main import embeds
+from music.models import Album
+from prime import caching
+from prime.models import Article, Recipe, DIYarticle, CityGuideArticle, \
+    Neighborhood
+from prime.templatetags.shortcodes import embedsIn
+
+
+class Command(NoArgsCommand):
+    help = ("Fetches the oEmbed thumbnail and title of every YouTube and "
+            "Spotify embed in prime content and music albums that has none "
+            "stored yet.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--force', action='store_true', default=False,
+                    help='Fetch embeds again even if already stored.'),
+    )
+
+    def handle_noargs(self, **options):
+        found = []
+        for model in (Article, Recipe, DIYarticle, CityGuideArticle):
+            for body in model.objects.values_list('body', flat=True):
+                found += embedsIn(body)
+        for body in Neighborhood.objects.values_list('intro_body', flat=True):
+            found += embedsIn(body)
+        found += [('spotify', uri) for uri in
+                  Album.objects.exclude(spotify_url='')
+                  .values_list('spotify_url', flat=True)]
+        fetched = embeds.ensure(found, force=options['force'])
+        if fetched:
+            # fetch() has replaced their entries in the lookup cache, but
+            # cached pages and fragments still hold bare facades
+            caching.bumpGeneration()
+        self.stdout.write("Fetched %d embeds (%d in content)." % (
+            fetched, len(set(found))))
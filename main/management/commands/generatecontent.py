@@ -0,0 +1,37 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from main.synthetic import Generator
+
+COUNTS = (
+    ('authors', 50), ('issues', 10), ('images', 200), ('tags', 20),
+    ('articles', 200), ('recipes', 50), ('diys', 50), ('neighborhoods', 5),
+    ('guides', 30), ('albums', 50),
+)
+
+
+class Command(NoArgsCommand):
+    help = ("Bulk-generates synthetic prime and music content for "
+            "benchmarks, e.g. --issues 100 --articles 50000 --images 10000. "
+            "--scale multiplies every count.")
+    option_list = NoArgsCommand.option_list + tuple(
+        make_option('--%s' % name, type='int', default=default,
+                    help='Number of %s (default: %d).' % (name, default))
+        for name, default in COUNTS) + (
+        make_option('--scale', type='float', default=1,
+                    help='Multiplier applied to every count (default: 1).'),
+        make_option('--seed', type='int', default=0,
+                    help='Random seed, for repeatable data (default: 0).'),
+    )
+
+    def handle_noargs(self, **options):
+        counts = dict((name, int(options[name] * options['scale']))
+                      for name, _ in COUNTS)
+        if counts['issues'] < 1 or counts['authors'] < 1:
+            raise CommandError("At least one issue and one author are "
+                               "needed.")
+        start = time.time()
+        Generator(options['seed'], log=self.stdout.write).run(**counts)
+        self.stdout.write("Generated in %.1fs." % (time.time() - start))
@@ -0,0 +1,95 @@
+import itertools
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import replay
+
+
+class Command(BaseCommand):
+    args = '<access log>'
+    help = ("Replays the GET requests of an access log (Common or Combined "
+            "Log Format, optionally gzipped) against a running instance and "
+            "reports latency percentiles and error rates per URL pattern. "
+            "Use --anonymize to write a shareable copy of the log instead.")
+    option_list = BaseCommand.option_list + (
+        make_option('--base-url', default='http://127.0.0.1:8000',
+                    help='Instance to send requests to '
+                         '(default: http://127.0.0.1:8000).'),
+        make_option('--concurrency', type='int', default=8,
+                    help='Requests in flight at once (default: 8).'),
+        make_option('--speedup', type='float', default=1.0,
+                    help='Divide the logged spacing between requests by '
+                         'this; 0 sends them as fast as possible '
+                         '(default: 1).'),
+        make_option('--sample', type='float', default=1.0,
+                    help='Fraction of requests to keep (default: 1).'),
+        make_option('--seed', type='int', default=0,
+                    help='Seed for sampling (default: 0).'),
+        make_option('--limit', type='int', default=0,
+                    help='Stop after this many requests (default: all).'),
+        make_option('--timeout', type='float', default=30,
+                    help='Seconds to wait for a response (default: 30).'),
+        make_option('--output', help='Write the results to this JSON file.'),
+        make_option('--compare', help='JSON file of an earlier run to '
+                                      'compare with.'),
+        make_option('--anonymize', metavar='PATH',
+                    help='Write the sampled log without client details to '
+                         'PATH and exit.'),
+        make_option('--keep-queries', action='store_true', default=False,
+                    help='Keep search text in the --anonymize output '
+                         'instead of replacing it with tokens.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the path of one access log.")
+        with replay.openLog(args[0]) as lines:
+            if options['anonymize']:
+                self.anonymize(lines, options)
+                return
+            requests = replay.parse(lines, options['sample'],
+                                    options['seed'])
+            if options['limit']:
+                requests = itertools.islice(requests, options['limit'])
+            records = replay.replay(requests, options['base_url'],
+                                    options['concurrency'],
+                                    options['speedup'], options['timeout'],
+                                    log=self.stdout.write)
+
+        results = replay.summarize(records)
+        for name in sorted(results):
+            stats = results[name]
+            self.stdout.write(
+                "%-24s %6d req  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  "
+                "errors %5.1f%%" % (name, stats['requests'], stats['p50'],
+                                    stats['p95'], stats['p99'],
+                                    stats['error_rate'] * 100))
+        late = max([stats['max_late'] for stats in results.values()] or [0])
+        if late > 1000:
+            self.stdout.write("Requests fell up to %.1fs behind the log; "
+                              "raise --concurrency for a faithful replay."
+                              % (late / 1000))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as f:
+                old = json.load(f)
+            for line in replay.compare(old, results):
+                self.stdout.write(line)
+
+    def anonymize(self, lines, options):
+        written = 0
+        with open(options['anonymize'], 'w') as output:
+            for line in replay.anonymizeLog(lines, options['sample'],
+                                            options['seed'],
+                                            options['keep_queries']):
+                output.write(line)
+                written += 1
+                if written == options['limit']:
+                    break
+        self.stdout.write("Wrote %d lines to %s." % (written,
+                                                     options['anonymize']))
@@ -0,0 +1,231 @@
+"""
+Process-local counters and histograms, summed across workers.
+
+Each worker process keeps its samples in memory and writes them to
+``METRICS_DIR/metrics-<pid>-<start>.json`` at most every ``FLUSH_INTERVAL``
+seconds. ``render()`` adds up every file in the directory and returns the
+Prometheus text exposition format.
+
+Files of workers that have exited are folded into ``metrics-retired.json``
+and removed, so counters never go backwards and the directory does not grow
+with every restart. The start time in the name keeps a worker that is handed
+a recycled pid from overwriting its predecessor's file; it folds that file
+instead.
+"""
+import errno
+import fcntl
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+FLUSH_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Requests by resolved URL name, method and status.', None),
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency by resolved URL name.',
+        LATENCY_BUCKETS),
+    'db_queries_per_request': (
+        'histogram', 'Database queries per request by resolved URL name.',
+        QUERY_BUCKETS),
+    'cache_requests_total': (
+        'counter', 'Prime page and fragment cache lookups by result.', None),
+    'review_fetch_duration_seconds': (
+        'histogram', 'Latency of outbound music review fetches.',
+        LATENCY_BUCKETS),
+    'review_fetch_errors_total': (
+        'counter', 'Outbound music review fetches that failed.', None),
+    'embed_fetches_total': (
+        'counter', 'oEmbed metadata fetches by provider and result.', None),
+}
+
+_lock = threading.Lock()
+_samples = {}
+_pid = None
+_started = None
+_last_flush = 0
+
+RETIRED = 'metrics-retired.json'
+WORKER_FILE = re.compile(r'metrics-(\d+)(?:-(\d+))?\.json$')
+
+
+def enabled():
+    return bool(getattr(settings, 'METRICS_DIR', None))
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+def _current():
+    # a forked worker must not report its parent's samples as its own
+    global _samples, _pid, _started
+    if _pid != os.getpid():
+        _samples, _pid = {}, os.getpid()
+        _started = int(time.time() * 1000000)
+    return _samples
+
+def inc(name, amount=1, **labels):
+    if not enabled():
+        return
+    with _lock:
+        samples = _current()
+        key = _key(name, labels)
+        samples[key] = samples.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """
+    Adds ``value`` to histogram ``name``: stored as one count per bucket
+    (non-cumulative, plus +Inf), then the sum and the total count.
+    """
+    if not enabled():
+        return
+    buckets = METRICS[name][2]
+    with _lock:
+        samples = _current()
+        key = _key(name, labels)
+        histogram = samples.setdefault(key, [0] * (len(buckets) + 3))
+        index = len(buckets)
+        for position, bound in enumerate(buckets):
+            if value <= bound:
+                index = position
+                break
+        histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def flush(force=False):
+    global _last_flush
+    if not enabled():
+        return
+    now = time.time()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with _lock:
+        data = json.dumps(_current())
+        name = 'metrics-%d-%d.json' % (_pid, _started)
+        _last_flush = now
+    path = os.path.join(directory, name)
+    with open(path + '.tmp', 'w') as f:
+        f.write(data)
+    os.rename(path + '.tmp', path)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+def retired(path):
+    """
+    Whether the worker that wrote ``path`` has exited: its pid is gone, or
+    it is now ours and the file is from before this process started.
+    """
+    match = WORKER_FILE.search(path)
+    if not match:
+        return False
+    pid = int(match.group(1))
+    if pid == os.getpid():
+        return match.group(2) != str(_started)
+    return not alive(pid)
+
+def load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def add(totals, samples):
+    for key, value in samples.iteritems():
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for position, part in enumerate(value):
+                total[position] += part
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+def collect():
+    """
+    {key: value} summed over every worker's file, after folding the files of
+    exited workers into the retired totals. Holds a lock on the directory so
+    that a concurrent scrape never counts a folded file twice or not at all.
+    """
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    pattern = os.path.join(directory, 'metrics-*.json')
+    with open(os.path.join(directory, 'metrics.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        gone = [path for path in glob.glob(pattern) if retired(path)]
+        if gone:
+            path = os.path.join(directory, RETIRED)
+            totals = load(path)
+            for worker in gone:
+                add(totals, load(worker))
+            with open(path + '.tmp', 'w') as f:
+                json.dump(totals, f)
+            os.rename(path + '.tmp', path)
+            for worker in gone:
+                os.remove(worker)
+        totals = {}
+        for path in glob.glob(pattern):
+            add(totals, load(path))
+    return totals
+
+def formatLabels(labels, **extra):
+    pairs = labels + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, unicode(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in pairs)
+
+def formatNumber(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    flush(force=True)
+    series = {}
+    for key, value in collect().iteritems():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append(
+            ([tuple(pair) for pair in labels], value))
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text, buckets = METRICS[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in sorted(series[name]):
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, formatLabels(labels),
+                                          formatNumber(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name, formatLabels(labels, le=bound), cumulative))
+            lines.append('%s_sum%s %s' % (name, formatLabels(labels),
+                                          formatNumber(value[-2])))
+            lines.append('%s_count%s %d' % (name, formatLabels(labels),
+                                            value[-1]))
+    return '\n'.join(lines) + '\n'
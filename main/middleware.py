@@ -0,0 +1,233 @@
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.module_loading import import_by_path
+
+from main import compression, hints, metrics, profiling, querylog
+
+profile_logger = logging.getLogger('main.profiling')
+
+
+def isLeanPath(path):
+    """
+    True if ``path`` is served without sessions, CSRF, auth or messages.
+
+    Anonymous, read-only sections (prime, music) never need any of them, and
+    skipping them keeps ``Set-Cookie`` and ``Vary: Cookie`` off the response
+    so shared caches can store the page.
+    """
+    prefixes = tuple(getattr(settings, 'LEAN_PATH_PREFIXES', ()))
+    return bool(prefixes) and path.startswith(prefixes)
+
+
+class FullStackOnly(object):
+    """
+    Runs the wrapped middleware for every request except lean paths.
+
+    Subclasses set ``middleware_path`` to the dotted path of the middleware
+    they stand in for, and are listed in ``MIDDLEWARE_CLASSES`` in its place.
+    """
+    middleware_path = None
+
+    def __init__(self):
+        self.wrapped = import_by_path(self.middleware_path)()
+
+    def _hook(self, request, name):
+        if isLeanPath(request.path_info):
+            return None
+        return getattr(self.wrapped, name, None)
+
+    def process_request(self, request):
+        hook = self._hook(request, 'process_request')
+        if hook:
+            return hook(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        hook = self._hook(request, 'process_view')
+        if hook:
+            return hook(request, view_func, view_args, view_kwargs)
+
+    def process_template_response(self, request, response):
+        hook = self._hook(request, 'process_template_response')
+        if hook:
+            return hook(request, response)
+        return response
+
+    def process_response(self, request, response):
+        hook = self._hook(request, 'process_response')
+        if hook:
+            return hook(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        hook = self._hook(request, 'process_exception')
+        if hook:
+            return hook(request, exception)
+
+
+class SessionMiddleware(FullStackOnly):
+    middleware_path = 'django.contrib.sessions.middleware.SessionMiddleware'
+
+class CsrfViewMiddleware(FullStackOnly):
+    middleware_path = 'django.middleware.csrf.CsrfViewMiddleware'
+
+class AuthenticationMiddleware(FullStackOnly):
+    middleware_path = 'django.contrib.auth.middleware.AuthenticationMiddleware'
+
+class MessageMiddleware(FullStackOnly):
+    middleware_path = 'django.contrib.messages.middleware.MessageMiddleware'
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a ``PROFILING_SAMPLE_RATE`` fraction of requests (0 to 1) and
+    reports SQL, template and filter timings in a ``Server-Timing`` header
+    and a JSON line on the ``main.profiling`` logger. Not loaded at all when
+    the rate is 0. List it first so it times the rest of the stack.
+    """
+    def __init__(self):
+        if not getattr(settings, 'PROFILING_SAMPLE_RATE', 0):
+            raise MiddlewareNotUsed
+        profiling.installTemplateTiming()
+
+    def process_request(self, request):
+        profiling.stop()
+        if random.random() < settings.PROFILING_SAMPLE_RATE:
+            profiling.start()
+
+    def process_response(self, request, response):
+        result = profiling.stop()
+        if result is None:
+            return response
+        response['Server-Timing'] = profiling.serverTiming(result)
+        match = getattr(request, 'resolver_match', None)
+        profile_logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.url_name if match else None,
+            'status': response.status_code,
+            'timings': dict((name, {'ms': round(ms, 2), 'count': count})
+                            for name, (ms, count) in result.iteritems()),
+        }, sort_keys=True))
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Counts requests and records latency and query count per resolved URL
+    name into ``main.metrics``. Not loaded unless ``METRICS_DIR`` is set.
+
+    Django 1.6 has no cheap query hook, so the connection's query log is
+    switched on for the request and its growth counted.
+    """
+    def __init__(self):
+        if not metrics.enabled():
+            raise MiddlewareNotUsed
+
+    def process_request(self, request):
+        request._metrics = (time.time(), connection.use_debug_cursor,
+                            len(connection.queries))
+        connection.use_debug_cursor = True
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_metrics'):
+            return response
+        start, debug_cursor, first_query = request._metrics
+        queries = len(connection.queries) - first_query
+        connection.use_debug_cursor = debug_cursor
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.inc('http_requests_total', view=view, method=request.method,
+                    status=response.status_code)
+        metrics.observe('http_request_duration_seconds', time.time() - start,
+                        view=view)
+        metrics.observe('db_queries_per_request', queries, view=view)
+        metrics.flush()
+        return response
+
+
+class QueryLogMiddleware(object):
+    """
+    Feeds the queries of a ``QUERY_LOG_SAMPLE_RATE`` fraction of requests
+    (0 to 1) into ``main.querylog``, attributed to the resolved view and
+    template. Not loaded at all when the rate is 0.
+    """
+    def __init__(self):
+        if not getattr(settings, 'QUERY_LOG_SAMPLE_RATE', 0):
+            raise MiddlewareNotUsed
+        querylog.installTemplateTracking()
+
+    def process_request(self, request):
+        request._querylog = None
+        if random.random() < settings.QUERY_LOG_SAMPLE_RATE:
+            request._querylog = (connection.use_debug_cursor,
+                                 len(connection.queries))
+            connection.use_debug_cursor = True
+            querylog.startTracking()
+
+    def process_response(self, request, response):
+        state = getattr(request, '_querylog', None)
+        if state is None:
+            return response
+        debug_cursor, first_query = state
+        spans = [(start - first_query, end - first_query, name)
+                 for start, end, name in querylog.stopTracking()]
+        queries = connection.queries[first_query:]
+        connection.use_debug_cursor = debug_cursor
+        match = getattr(request, 'resolver_match', None)
+        querylog.record(queries, match.view_name if match else 'unresolved',
+                        spans, getattr(settings, 'QUERY_LOG_MIN_DURATION', 0))
+        if querylog.flushDue():
+            querylog.flush()
+        return response
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses text responses of lean paths, including streaming ones, with
+    brotli or gzip as negotiated from ``Accept-Encoding``. Responses that
+    already have a ``Content-Encoding`` (such as prime's pre-compressed
+    cached pages) are passed through. Not loaded unless
+    ``RESPONSE_COMPRESSION`` is set; list it before anything that changes
+    response bodies.
+
+    Everything else, such as the admin, is sent as it is: a page holding a
+    CSRF token beside text the visitor controls would leak the token through
+    its compressed length (BREACH). Lean paths never use CSRF, and a
+    response whose request did is left alone too.
+    """
+    def __init__(self):
+        if not compression.enabled():
+            raise MiddlewareNotUsed
+
+    def process_response(self, request, response):
+        if not isLeanPath(request.path_info) or \
+                request.META.get('CSRF_COOKIE_USED'):
+            return response
+        compression.varyOnEncoding(response)
+        if not compression.compressible(response):
+            return response
+        encoding = compression.negotiate(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding:
+            compression.compressResponse(response, encoding)
+        return response
+
+
+class PreloadMiddleware(object):
+    """
+    Sends the critical resources a page's templates asked for (see
+    ``main.hints``) as ``Link: rel=preload`` headers. List it after
+    ``CompressionMiddleware``.
+    """
+    def process_request(self, request):
+        hints.start()
+
+    def process_response(self, request, response):
+        hints.apply(response, hints.stop())
+        return response
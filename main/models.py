@@ -18,3 +18,31 @@ class Author(models.Model):
     def __unicode__(self):
         return "%s %s" % (self.first_name, self.last_name)
 
+
+
+class QueryFingerprint(models.Model):
+    """
+    Aggregated timings of one normalized SQL statement, per view and
+    template that ran it. Written in batches by ``main.querylog``.
+    """
+    fingerprint = models.CharField(max_length=32, db_index=True)
+    view = models.CharField(max_length=200)
+    template = models.CharField(max_length=200, blank=True)
+    sql = models.TextField()
+    example = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=0)
+    total_time = models.FloatField(default=0, help_text="milliseconds")
+    p95 = models.FloatField(default=0, help_text="milliseconds")
+    buckets = models.TextField(blank=True, editable=False)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-total_time']
+        unique_together = ('fingerprint', 'view', 'template')
+
+    def mean_time(self):
+        return self.total_time / self.count if self.count else 0
+
+    def __unicode__(self):
+        return "%s (%s)" % (self.sql[:60], self.view)
@@ -0,0 +1,116 @@
+"""
+Per-request timing of SQL, template rendering and named hot spots.
+
+``ProfilingMiddleware`` (see ``main.middleware``) starts a ``Profile`` for a
+sample of requests; while one is active, functions decorated with
+``timed(name)`` and ``Template.render`` add their wall time to it, and the
+connection keeps a query log. Outside a sampled request the decorators cost
+a thread-local lookup.
+"""
+import threading
+import time
+from functools import wraps
+
+from django.db import connection
+from django.template.base import Template
+
+_local = threading.local()
+
+
+class Profile(object):
+    def __init__(self):
+        self.start = time.time()
+        self.timings = {}
+        self.calls = {}
+        self.template_depth = 0
+        self.saved_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.first_query = len(connection.queries)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def finish(self):
+        """
+        Stops recording and returns {name: (milliseconds, count)}, including
+        ``db`` (query time and count) and ``total``.
+        """
+        queries = connection.queries[self.first_query:]
+        connection.use_debug_cursor = self.saved_debug_cursor
+        result = dict((name, (seconds * 1000, self.calls[name]))
+                      for name, seconds in self.timings.iteritems())
+        result['db'] = (sum(float(q['time']) for q in queries) * 1000,
+                        len(queries))
+        result['total'] = ((time.time() - self.start) * 1000, 1)
+        return result
+
+
+def start():
+    _local.profile = Profile()
+    return _local.profile
+
+def stop():
+    profile = current()
+    _local.profile = None
+    return profile.finish() if profile else None
+
+def current():
+    return getattr(_local, 'profile', None)
+
+
+def timed(name):
+    """
+    Adds the decorated function's time to the active profile as ``name``.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = current()
+            if profile is None:
+                return func(*args, **kwargs)
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.add(name, time.time() - started)
+        # lets template filters check their arguments against ``func``
+        wrapper._decorated_function = getattr(func, '_decorated_function',
+                                              func)
+        return wrapper
+    return decorator
+
+
+_template_render = Template.render
+
+def _timedRender(self, context):
+    profile = current()
+    if profile is None:
+        return _template_render(self, context)
+    # only the outermost template; includes are part of it
+    profile.template_depth += 1
+    started = time.time()
+    try:
+        return _template_render(self, context)
+    finally:
+        profile.template_depth -= 1
+        if not profile.template_depth:
+            profile.add('template', time.time() - started)
+
+def installTemplateTiming():
+    Template.render = _timedRender
+
+
+def serverTiming(result):
+    """
+    ``Server-Timing`` header value for a finished profile.
+    """
+    metrics = []
+    for name in sorted(result):
+        milliseconds, count = result[name]
+        if name == 'total':
+            continue
+        desc = '%d queries' % count if name == 'db' else '%d calls' % count
+        metrics.append('%s;dur=%.1f;desc="%s"' % (name, milliseconds, desc))
+    metrics.append('total;dur=%.1f' % result['total'][0])
+    return ', '.join(metrics)
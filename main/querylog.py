@@ -0,0 +1,194 @@
+"""
+Query fingerprinting and aggregation for the slow query log.
+
+``QueryLogMiddleware`` hands each sampled request's query log to
+``record()``, which normalizes every statement into a fingerprint (literals
+replaced by ``?``, ``IN`` lists collapsed) and attributes it to the resolved
+view and the innermost template being rendered when it ran. Counts, total
+time and a latency histogram are kept in memory per (fingerprint, view,
+template) and merged into ``QueryFingerprint`` rows every ``FLUSH_INTERVAL``
+seconds.
+"""
+import ast
+import bisect
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from django.db import connection, DatabaseError, transaction
+from django.template.base import Template
+
+from main.models import QueryFingerprint
+
+logger = logging.getLogger('main.querylog')
+
+FLUSH_INTERVAL = 30.0
+FLUSH_SIZE = 500
+
+# upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w".])-?\d+(?:\.\d+)?(?![\w"])')
+IN_LIST = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+SPACE = re.compile(r'\s+')
+# SQLite's query log holds reprs of the statement and its parameters
+SQLITE_LOG = re.compile(r'^QUERY = (u?(?:\'.*\'|".*")) - PARAMS = ',
+                        re.DOTALL)
+
+
+def normalize(sql):
+    match = SQLITE_LOG.match(sql)
+    if match:
+        sql = ast.literal_eval(match.group(1))
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    sql = IN_LIST.sub('IN (...)', sql)
+    return SPACE.sub(' ', sql).strip()
+
+def fingerprint(normalized):
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()
+
+def percentile(buckets, fraction):
+    """
+    Estimate from bucket counts, taking each bucket's upper bound (the last
+    bucket reports the largest finite bound).
+    """
+    total = sum(buckets)
+    if not total:
+        return 0
+    rank = fraction * total
+    seen = 0
+    for position, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            return BUCKETS[min(position, len(BUCKETS) - 1)]
+    return BUCKETS[-1]
+
+
+# template attribution
+
+_local = threading.local()
+_template_render = None
+
+def _trackedRender(self, context):
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        return _template_render(self, context)
+    start = len(connection.queries)
+    try:
+        return _template_render(self, context)
+    finally:
+        spans.append((start, len(connection.queries), self.name or ''))
+
+def installTemplateTracking():
+    global _template_render
+    if _template_render is None:
+        _template_render = Template.render
+        Template.render = _trackedRender
+
+def startTracking():
+    _local.spans = []
+
+def stopTracking():
+    spans = getattr(_local, 'spans', None) or []
+    _local.spans = None
+    return spans
+
+def templateFor(index, spans):
+    """
+    Name of the innermost template whose render covers query ``index``.
+    """
+    covering = [(end - start, -start, name) for start, end, name in spans
+                if start <= index < end]
+    return min(covering)[2] if covering else ''
+
+
+# aggregation
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = time.time()
+
+def record(queries, view, spans, min_duration=0):
+    """
+    Adds a request's ``connection.queries`` slice to the pending batch.
+    """
+    with _lock:
+        for index, query in enumerate(queries):
+            duration = float(query['time']) * 1000
+            if duration < min_duration:
+                continue
+            sql = normalize(query['sql'])
+            key = (fingerprint(sql), view, templateFor(index, spans))
+            entry = _pending.get(key)
+            if entry is None:
+                entry = _pending[key] = {
+                    'sql': sql, 'example': query['sql'], 'count': 0,
+                    'total_time': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+            entry['count'] += 1
+            entry['total_time'] += duration
+            entry['buckets'][bisect.bisect_left(BUCKETS, duration)] += 1
+
+def flushDue():
+    return len(_pending) >= FLUSH_SIZE or \
+        time.time() - _last_flush >= FLUSH_INTERVAL
+
+def requeue(batch):
+    with _lock:
+        for key, entry in batch.iteritems():
+            pending = _pending.get(key)
+            if pending is None:
+                _pending[key] = entry
+            else:
+                pending['count'] += entry['count']
+                pending['total_time'] += entry['total_time']
+                pending['buckets'] = [a + b for a, b in zip(
+                    pending['buckets'], entry['buckets'])]
+
+def flush():
+    """
+    Merges the pending batch into ``QueryFingerprint`` rows. It runs inside
+    a reader's request, so it never raises: on any database error (such as
+    a conflict with another worker or a lock timeout) the batch is logged
+    and kept for the next flush.
+    """
+    global _pending, _last_flush
+    with _lock:
+        batch, _pending = _pending, {}
+        _last_flush = time.time()
+    if not batch:
+        return
+    try:
+        with transaction.atomic():
+            existing = dict(
+                ((row.fingerprint, row.view, row.template), row)
+                for row in QueryFingerprint.objects.select_for_update()
+                .filter(fingerprint__in=set(key[0] for key in batch)))
+            created = []
+            for key, entry in batch.iteritems():
+                row = existing.get(key)
+                if row is None:
+                    row = QueryFingerprint(fingerprint=key[0], view=key[1],
+                                           template=key[2], sql=entry['sql'],
+                                           example=entry['example'])
+                    buckets = entry['buckets']
+                else:
+                    buckets = [a + b for a, b in
+                               zip(json.loads(row.buckets), entry['buckets'])]
+                row.count += entry['count']
+                row.total_time += entry['total_time']
+                row.buckets = json.dumps(buckets)
+                row.p95 = percentile(buckets, 0.95)
+                if row.pk is None:
+                    created.append(row)
+                else:
+                    row.save()
+            QueryFingerprint.objects.bulk_create(created)
+    except DatabaseError as error:
+        logger.warning("Flushing %d query fingerprints failed: %s",
+                       len(batch), error)
+        requeue(batch)
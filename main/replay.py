@@ -0,0 +1,215 @@
+"""
+Replays GET requests from an access log against a running instance.
+
+``parse()`` reads Common or Combined Log Format lines (nginx and Apache
+defaults) and yields each GET request's offset in seconds from the first
+one. ``replay()`` sends them to ``base_url`` from ``concurrency`` threads,
+keeping the original spacing divided by ``speedup`` (0 sends as fast as
+the threads allow). ``summarize()`` groups the timings by the URL pattern
+each path resolves to here, so builds can be compared with ``compare()``.
+"""
+import gzip
+import random
+import re
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from Queue import Queue
+from datetime import datetime
+
+from django.core.urlresolvers import resolve, Resolver404
+
+from main.benchmark import percentile
+
+LOG_LINE = re.compile(r'^(?P<client>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] '
+                      r'"(?P<method>[A-Z]+) (?P<path>\S+)(?: (?P<protocol>'
+                      r'[^"]*))?" (?P<status>\d{3}) (?P<size>\S+)')
+TIME_FORMAT = '%d/%b/%Y:%H:%M:%S'
+
+# the only query parameters an anonymized log keeps
+KEPT_PARAMETERS = ('page', 'q')
+# parameters whose values are what a reader typed, replaced by a token
+TOKENIZED_PARAMETERS = ('q',)
+
+
+def openLog(path):
+    return gzip.open(path) if path.endswith('.gz') else open(path)
+
+def parseTime(value):
+    # the zone offset is the same throughout a log; only spacing matters
+    return datetime.strptime(value.split()[0], TIME_FORMAT)
+
+def parse(lines, sample=1.0, seed=0):
+    """
+    Yields ``(offset, path)`` for a ``sample`` fraction of the GET requests.
+    """
+    rng = random.Random(seed)
+    first = None
+    for line in lines:
+        match = LOG_LINE.match(line)
+        if not match or match.group('method') != 'GET':
+            continue
+        if sample < 1 and rng.random() >= sample:
+            continue
+        when = parseTime(match.group('time'))
+        if first is None:
+            first = when
+        yield (when - first).total_seconds(), match.group('path')
+
+def tokenFor(value, tokens):
+    # numbered rather than hashed: search text is short enough to guess
+    if value not in tokens:
+        tokens[value] = 'query%d' % (len(tokens) + 1)
+    return tokens[value]
+
+def anonymize(line, tokens=None):
+    """
+    ``line`` without the client address, user, referrer and user agent, and
+    with query parameters outside ``KEPT_PARAMETERS`` removed; None if the
+    line is not a log entry.
+
+    Values of ``TOKENIZED_PARAMETERS`` are replaced by a token that is the
+    same for every occurrence of a value, so a replay still repeats the
+    searches it repeated, unless ``tokens`` (the {value: token} mapping
+    shared across a log) is None.
+    """
+    match = LOG_LINE.match(line)
+    if not match:
+        return None
+    parts = urlparse.urlsplit(match.group('path'))
+    query = urllib.urlencode([
+        (name, tokenFor(value, tokens)
+         if tokens is not None and name in TOKENIZED_PARAMETERS else value)
+        for name, value in urlparse.parse_qsl(parts.query)
+        if name in KEPT_PARAMETERS])
+    path = parts.path + ('?' + query if query else '')
+    return '- - - [%s] "%s %s %s" %s %s\n' % (
+        match.group('time'), match.group('method'), path,
+        match.group('protocol') or 'HTTP/1.0', match.group('status'),
+        match.group('size'))
+
+def anonymizeLog(lines, sample=1.0, seed=0, keep_queries=False):
+    rng = random.Random(seed)
+    tokens = None if keep_queries else {}
+    for line in lines:
+        line = anonymize(line, tokens)
+        if line is not None and (sample >= 1 or rng.random() < sample):
+            yield line
+
+
+def patternFor(path):
+    try:
+        match = resolve(urlparse.urlsplit(path).path)
+    except Resolver404:
+        return 'unresolved'
+    return match.view_name
+
+
+def replay(requests, base_url, concurrency=8, speedup=1.0, timeout=30,
+           log=None):
+    """
+    Sends ``requests`` (from ``parse()``) and returns a list of
+    ``(path, status, seconds, late)``: status 0 is a connection error or
+    timeout, and ``late`` is how far behind schedule the request was sent.
+    """
+    log = log or (lambda message: None)
+    base_url = base_url.rstrip('/')
+    queue = Queue(maxsize=concurrency * 4)
+    records = []
+    lock = threading.Lock()
+
+    def work():
+        opener = urllib2.build_opener()
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            path, due = item
+            late = max(0.0, time.time() - due)
+            start = time.time()
+            try:
+                response = opener.open(base_url + path, timeout=timeout)
+                response.read()
+                status = response.getcode()
+            except urllib2.HTTPError as error:
+                error.read()
+                status = error.code
+            except (urllib2.URLError, socket.error):
+                status = 0
+            with lock:
+                records.append((path, status, time.time() - start, late))
+                if len(records) % 1000 == 0:
+                    log("%d requests sent" % len(records))
+
+    threads = [threading.Thread(target=work) for _ in xrange(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    started = time.time()
+    for offset, path in requests:
+        due = started + (offset / speedup if speedup else 0)
+        wait = due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        queue.put((path, due))
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def summarize(records):
+    """
+    {pattern: stats} with latency percentiles in milliseconds, status
+    counts and the share of requests that failed (5xx or no response).
+    """
+    grouped = {}
+    for path, status, seconds, late in records:
+        grouped.setdefault(patternFor(path), []).append(
+            (status, seconds * 1000, late * 1000))
+    results = {}
+    for pattern, rows in grouped.iteritems():
+        timings = sorted(milliseconds for _, milliseconds, _ in rows)
+        statuses = {}
+        for status, _, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(1 for status, _, _ in rows
+                     if status == 0 or status >= 500)
+        results[pattern] = {
+            'requests': len(rows),
+            'p50': percentile(timings, 0.50),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99),
+            'mean': sum(timings) / len(timings),
+            'errors': errors,
+            'error_rate': float(errors) / len(rows),
+            'statuses': statuses,
+            'max_late': max(late for _, _, late in rows),
+        }
+    return results
+
+
+def compare(old, new):
+    """
+    Lines comparing two ``summarize()`` results pattern by pattern.
+    """
+    lines = ['%-24s %21s %21s %15s' % ('pattern', 'p50 ms', 'p95 ms',
+                                       'errors')]
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            lines.append('%-24s (only requested in one run)' % name)
+            continue
+        cells = []
+        for key in ('p50', 'p95'):
+            change = (new[name][key] - old[name][key]) / old[name][key] * 100 \
+                if old[name][key] else 0
+            cells.append('%7.1f -> %6.1f %+4.0f%%' % (
+                old[name][key], new[name][key], change))
+        lines.append('%-24s %s %s %5.1f%% -> %.1f%%' % (
+            name, cells[0], cells[1], old[name]['error_rate'] * 100,
+            new[name]['error_rate'] * 100))
+    return lines
@@ -0,0 +1,130 @@
+"""
+Worker startup: preloading before fork, and measuring what startup costs.
+
+With ``WSGI_PRELOAD`` set, ``project.wsgi`` calls ``preload()`` once the
+application exists. Under a pre-forking server that imports the application
+in the master (gunicorn ``--preload``, uWSGI without ``lazy-apps``) the work
+is done once and the pages it touched are shared copy-on-write by every
+worker, which then only has to open its own database connection.
+
+``measure()`` runs in a fresh interpreter (see ``benchstartup``) and reports
+import time, the first request and resident memory, optionally per forked
+worker.
+"""
+import gc
+import json
+import os
+import resource
+import sys
+import time
+
+from django.conf import settings
+
+
+def templateNames():
+    names = []
+    for directory in settings.TEMPLATE_DIRS:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.html'):
+                    names.append(os.path.relpath(os.path.join(root, name),
+                                                 directory))
+    return sorted(names)
+
+def preload(application):
+    """
+    Does in the current process what every worker would otherwise repeat on
+    its first requests. Leaves no database connection open, since a
+    connection must not be shared across a fork.
+    """
+    from django.core.urlresolvers import get_resolver
+    from django.db import connections
+    from django.template.loader import get_template
+    from django.utils import translation
+    from main import assets
+
+    # middleware, including the template render hooks it installs
+    application.load_middleware()
+    # URL patterns, the views they import and admin.autodiscover()
+    get_resolver(None)._populate()
+    # kept compiled when TEMPLATE_LOADERS uses the cached loader
+    for name in templateNames():
+        get_template(name)
+    assets.loadManifest()
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+    # imported lazily by the markdown filter; nearly every page needs it
+    import markdown2
+
+    for connection in connections.all():
+        connection.close()
+    gc.collect()
+
+
+def memory():
+    """
+    (rss, private) of this process in kilobytes. ``private`` counts pages
+    no other process maps, which is what each extra worker really costs; it
+    is None where /proc is unavailable.
+    """
+    rss = private = None
+    try:
+        with open('/proc/self/smaps') as f:
+            rss = private = 0
+            for line in f:
+                if line.startswith('Rss:'):
+                    rss += int(line.split()[1])
+                elif line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    private += int(line.split()[1])
+    except IOError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, private
+
+def firstRequest(application, path):
+    from django.test.client import RequestFactory
+    environ = RequestFactory(HTTP_HOST='localhost').get(path).environ
+    started = time.time()
+    status = []
+    body = application(environ, lambda code, headers: status.append(code))
+    ''.join(body)
+    return (time.time() - started) * 1000, status[0]
+
+def measure(path, workers):
+    """
+    Imports the WSGI application, then forks ``workers`` processes that
+    each serve ``path`` once. Returns a dict; meant for a fresh interpreter.
+    """
+    before = set(sys.modules)
+    started = time.time()
+    from project.wsgi import application
+    result = {
+        'preload': bool(os.environ.get('WSGI_PRELOAD')),
+        'import_ms': (time.time() - started) * 1000,
+        'modules': len(set(sys.modules) - before),
+        'heavy_modules': sorted(name for name in ('PIL.Image', 'markdown2',
+                                                  'numpy')
+                                if name in sys.modules),
+    }
+    result['master_rss_kb'], _ = memory()
+
+    children = []
+    for _ in xrange(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            milliseconds, status = firstRequest(application, path)
+            rss, private = memory()
+            os.write(write, json.dumps({
+                'first_request_ms': milliseconds, 'status': status,
+                'rss_kb': rss, 'private_kb': private}))
+            os._exit(0)
+        os.close(write)
+        children.append((pid, read))
+    result['workers'] = []
+    for pid, read in children:
+        with os.fdopen(read) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        result['workers'].append(json.loads(data))
+    return result
@@ -0,0 +1,27 @@
+// Click-to-load embeds: a .embed-facade link (see main/embeds.py) is
+// replaced by the player it stands in for when it is clicked. Listens while
+// capturing, so the click never reaches handlers of enclosing elements.
+(function() {
+    document.addEventListener('click', function(event) {
+        var facade = event.target;
+        while (facade && !(facade.getAttribute &&
+                           facade.getAttribute('data-embed'))) {
+            facade = facade.parentNode;
+        }
+        if (!facade || event.button || event.metaKey || event.ctrlKey) {
+            return;
+        }
+        event.preventDefault();
+        event.stopPropagation();
+        var iframe = document.createElement('iframe');
+        iframe.src = facade.getAttribute('data-embed');
+        iframe.width = facade.getAttribute('data-width');
+        iframe.height = facade.getAttribute('data-height');
+        iframe.className = facade.getAttribute('data-class');
+        iframe.setAttribute('frameborder', '0');
+        iframe.setAttribute('allowtransparency', 'true');
+        iframe.setAttribute('allowfullscreen', '');
+        iframe.setAttribute('allow', 'autoplay; encrypted-media');
+        facade.parentNode.replaceChild(iframe, facade);
+    }, true);
+})();
@@ -0,0 +1,253 @@
+"""
+Deterministic synthetic content for load and regression testing.
+
+``Generator(seed).run(**counts)`` bulk-inserts authors, issues with PDFs,
+images, tags, articles, recipes and DIY pieces with markdown bodies full of
+``[imgN]``, YouTube, Spotify and ``[br]`` shortcodes, city guides and albums,
+then rebuilds what the save signals would have maintained (feed entries,
+search and suggestion indexes, the prime cache generation); bylines are
+written directly. Rows are appended to whatever is already in the database.
+"""
+import itertools
+import random
+from StringIO import StringIO
+from datetime import date, timedelta
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Max
+from django.utils.text import slugify
+
+from main.models import Author
+from music.models import Album
+from prime.models import Issue, PDF, Image, Article, Recipe, DIYarticle, \
+    RecipeTag, DIYTag, Neighborhood, CityGuideArticle, buildByline
+
+WORDS = (
+    "bruin campus westwood quad library royce powell dorm dining hall "
+    "midterm finals quarter lecture professor student club concert game "
+    "pauley stadium rally coffee brunch taco ramen burger salad tea boba "
+    "bike bus freeway beach sunset hike trail canyon garden mural gallery "
+    "vintage thrift record vinyl playlist album band festival film studio "
+    "recipe spoon skillet oven roast simmer whisk garlic lemon basil chili "
+    "paper glue paint brush fabric stitch frame shelf plant lamp poster "
+    "quiet loud bright cheap easy quick fresh late early weekly local new "
+    "find make try read share learn visit plan cook build grow walk ride"
+).split()
+FIRST_NAMES = ("Alex Jordan Taylor Morgan Casey Riley Jamie Avery Quinn "
+               "Rowan Sam Drew Emerson Harper Kai Logan Reese Skyler").split()
+LAST_NAMES = ("Nguyen Garcia Smith Kim Patel Lopez Chen Johnson Brown Lee "
+              "Martinez Davis Wong Rivera Clark Lewis Walker Young").split()
+DISPLAYS = ('right', 'left', 'center', 'full')
+GUIDE_OPTIONS = ('see', 'do', 'eat')
+PARAGRAPH_POOL = 500
+CHUNK = 1000
+
+
+class Generator(object):
+    def __init__(self, seed=0, log=None):
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.paragraphs = [self.paragraph() for _ in xrange(PARAGRAPH_POOL)]
+
+    # text
+
+    def words(self, low, high):
+        return ' '.join(self.random.choice(WORDS)
+                        for _ in xrange(self.random.randint(low, high)))
+
+    def title(self):
+        return self.words(2, 6).capitalize()[:120]
+
+    def paragraph(self):
+        words = [self.random.choice(WORDS)
+                 for _ in xrange(self.random.randint(30, 110))]
+        for _ in xrange(self.random.randint(0, 3)):
+            position = self.random.randrange(len(words))
+            style = self.random.choice(('*%s*', '**%s**',
+                                        '[%s](http://dailybruin.com/)'))
+            words[position] = style % words[position]
+        text = ' '.join(words).capitalize() + '.'
+        shape = self.random.random()
+        if shape < 0.1:
+            return '## %s\n\n%s' % (self.title(), text)
+        if shape < 0.2:
+            return '\n'.join('* %s' % self.words(3, 8) for _ in xrange(4))
+        return text
+
+    def shortcode(self, image_ids):
+        kind = self.random.random()
+        if kind < 0.6 and image_ids:
+            return '[img%d %s]' % (self.random.choice(image_ids),
+                                   self.random.choice(DISPLAYS))
+        if kind < 0.75:
+            return '[youtube]http://youtu.be/%s[/youtube]' % \
+                self.words(1, 1)[:11]
+        if kind < 0.9:
+            return '[spotify]%022d[/spotify]' % self.random.randrange(10 ** 9)
+        return '[br]'
+
+    def body(self, image_ids, low=4, high=10):
+        parts = []
+        for _ in xrange(self.random.randint(low, high)):
+            parts.append(self.random.choice(self.paragraphs))
+            if self.random.random() < 0.4:
+                parts.append(self.shortcode(image_ids))
+        return '\n\n'.join(parts)
+
+    # storage
+
+    def bulk(self, model, objects):
+        """
+        Inserts ``objects`` in chunks and returns the new primary keys in
+        insertion order (bulk_create does not set them on PostgreSQL).
+        """
+        before = model.objects.aggregate(top=Max('pk'))['top'] or 0
+        objects = iter(objects)
+        while True:
+            chunk = list(itertools.islice(objects, CHUNK))
+            if not chunk:
+                break
+            model.objects.bulk_create(chunk)
+        pks = list(model.objects.filter(pk__gt=before).order_by('pk')
+                   .values_list('pk', flat=True))
+        self.log("%6d %s" % (len(pks),
+                             unicode(model._meta.verbose_name_plural)))
+        return pks
+
+    def link(self, through, source, target, pairs):
+        for start in xrange(0, len(pairs), CHUNK):
+            through.objects.bulk_create(
+                [through(**{source: a, target: b})
+                 for a, b in pairs[start:start + CHUNK]])
+
+    def pickAuthors(self, authors):
+        return self.random.sample(authors, min(len(authors),
+                                               self.random.randint(1, 2)))
+
+    # content
+
+    def run(self, authors=50, issues=10, images=200, tags=20, articles=200,
+            recipes=50, diys=50, neighborhoods=5, guides=30, albums=50):
+        with transaction.atomic():
+            counts = self.generate(authors, issues, images, tags, articles,
+                                   recipes, diys, neighborhoods, guides,
+                                   albums)
+        call_command('rebuildfeed', stdout=StringIO())
+        from prime import caching, search, suggest
+        search.reindexAll()
+        suggest.invalidate()
+        caching.bumpGeneration()
+        return counts
+
+    def generate(self, authors, issues, images, tags, articles, recipes,
+                 diys, neighborhoods, guides, albums):
+        r = self.random
+        names = [(r.choice(FIRST_NAMES), r.choice(LAST_NAMES))
+                 for _ in xrange(authors)]
+        author_ids = self.bulk(Author, (
+            Author(first_name=first, last_name=last, bio=self.words(10, 30))
+            for first, last in names))
+        bylines = dict((pk, u"%s %s" % name)
+                       for pk, name in zip(author_ids, names))
+
+        start = (Issue.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        first_release = date.today() - timedelta(days=30 * issues)
+        issue_slugs = ['issue-%d' % (start + n) for n in xrange(issues)]
+        issue_ids = self.bulk(Issue, (
+            Issue(name='Issue %d' % (start + n), slug=slug,
+                  release_date=first_release + timedelta(days=30 * n))
+            for n, slug in enumerate(issue_slugs)))
+        slug_of = dict(zip(issue_ids, issue_slugs))
+        self.bulk(PDF, (
+            PDF(issue_id=pk, pdf='prime/%s/pdf/issue.pdf' % slug,
+                image='prime/%s/pdf_image/cover.jpg' % slug)
+            for pk, slug in slug_of.iteritems()))
+
+        image_ids = self.bulk(Image, (
+            Image(issue_id=pk, author_id=r.choice(author_ids),
+                  image='prime/%s/article/photo-%d.jpg' % (slug_of[pk], n),
+                  caption=self.words(5, 15))
+            for n, pk in ((n, r.choice(issue_ids))
+                          for n in xrange(images))))
+
+        recipe_tags = self.bulk(RecipeTag, (
+            RecipeTag(name=('%s %d' % (r.choice(WORDS), n))[:32])
+            for n in xrange(tags)))
+        diy_tags = self.bulk(DIYTag, (
+            DIYTag(name=('%s %d' % (r.choice(WORDS), n))[:32])
+            for n in xrange(tags)))
+
+        for model, count, tag_ids, tag_field in (
+                (Article, articles, None, None),
+                (Recipe, recipes, recipe_tags, 'recipetag_id'),
+                (DIYarticle, diys, diy_tags, 'diytag_id')):
+            self.content(model, count, issue_ids, slug_of, image_ids,
+                         author_ids, bylines, tag_ids, tag_field)
+
+        neighborhood_ids = self.bulk(Neighborhood, (
+            Neighborhood(title='%s %d-%d' % (self.title()[:100], start, n),
+                         slug='neighborhood-%d-%d' % (start, n),
+                         lead_photo='prime/cityguides/lead/%d.jpg' % n,
+                         intro_body=self.body(image_ids, 1, 3))
+            for n in xrange(neighborhoods)))
+        if neighborhood_ids:
+            self.bulk(CityGuideArticle, (
+                CityGuideArticle(
+                    neighborhood_id=r.choice(neighborhood_ids),
+                    title=self.title(), option=r.choice(GUIDE_OPTIONS),
+                    lead_photo='prime/cityguides/neighborhood/%d.jpg' % n,
+                    body=self.body(image_ids, 1, 3))
+                for n in xrange(guides)))
+
+        self.bulk(Album, (
+            Album(title=self.title(), artist=self.words(1, 3).title()[:64],
+                  rating=r.randint(0, 10) / 2.0,
+                  review_url='http://dailybruin.com/reviews/%d/' % n,
+                  author_id=r.choice(author_ids),
+                  artwork='music/album-%d.jpg' % n,
+                  spotify_url='spotify:album:%022d' % r.randrange(10 ** 9))
+            for n in xrange(albums)))
+
+        return dict(authors=authors, issues=issues, images=images,
+                    tags=tags, articles=articles, recipes=recipes,
+                    diys=diys, neighborhoods=neighborhoods, guides=guides,
+                    albums=albums)
+
+    def content(self, model, count, issue_ids, slug_of, image_ids,
+                author_ids, bylines, tag_ids, tag_field):
+        r = self.random
+        start = (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+        plan = []
+        for n in xrange(count):
+            issue_id = r.choice(issue_ids) if issue_ids else None
+            plan.append((issue_id, self.pickAuthors(author_ids)))
+        directory = {Article: 'lead', Recipe: 'recipe/lead',
+                     DIYarticle: 'diy/lead'}[model]
+
+        def objects():
+            for n, (issue_id, authors) in enumerate(plan):
+                title = self.title()
+                if model is Article:
+                    lead = 'prime/%s/lead/%d.jpg' % (
+                        slug_of.get(issue_id, 'none'), n)
+                else:
+                    lead = 'prime/%s/%d.jpg' % (directory, n)
+                yield model(
+                    issue_id=issue_id, title=title,
+                    slug='%s-%d' % (slugify(unicode(title))[:100],
+                                    start + n),
+                    lead_photo=lead, teaser=self.words(8, 25)[:200],
+                    body=self.body(image_ids), position=n % 12,
+                    byline=buildByline([bylines[a] for a in authors]))
+        pks = self.bulk(model, objects())
+
+        self.link(model.author.through, model._meta.model_name + '_id',
+                  'author_id',
+                  [(pk, a) for pk, (_, authors) in zip(pks, plan)
+                   for a in authors])
+        if tag_ids:
+            self.link(model.tag.through, model._meta.model_name + '_id',
+                      tag_field,
+                      [(pk, tag) for pk in pks
+                       for tag in r.sample(tag_ids, min(len(tag_ids), 2))])
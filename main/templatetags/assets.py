@@ -0,0 +1,49 @@
+import posixpath
+import re
+
+from django import template
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from main import assets, hints
+
+register = template.Library()
+
+TAGS = {
+    '.css': '<link href="%s" rel="stylesheet" type="text/css">',
+    '.js': '<script src="%s"></script>',
+}
+
+@register.simple_tag
+def bundle(name):
+    """
+    Tags loading the ``ASSET_BUNDLES`` entry ``name``::
+
+        {% bundle "prime.css" %}
+
+    Stylesheets and their fonts are also added to the page's preloads.
+    """
+    extension = '.css' if name.endswith('.css') else '.js'
+    urls = assets.urls(name)
+    if extension == '.css':
+        for url in urls:
+            hints.add(url, 'style')
+        for url in assets.fonts(name):
+            path = re.match(r'[^?#]*', url).group(0)
+            hints.add(url, 'font', hints.FONT_TYPES.get(
+                posixpath.splitext(path)[1]), crossorigin=True)
+    tag = TAGS[extension]
+    return mark_safe('\n'.join(tag % escape(url) for url in urls))
+
+@register.simple_tag
+def preload(kind, *parts):
+    """
+    Adds the URL made of ``parts`` to the page's preloads and outputs
+    nothing. Skipped if any part is empty, such as a missing image::
+
+        {% preload "image" MEDIA_URL issue.header_image %}
+    """
+    parts = [unicode(part) if part is not None else '' for part in parts]
+    if parts and all(parts):
+        hints.add(''.join(parts), kind)
+    return ''
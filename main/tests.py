@@ -5,7 +5,38 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.http import StreamingHttpResponse
+from django.template import Context, Template
+from django.test import LiveServerTestCase, TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from django.contrib.auth.models import User
+
+from main import assets, compression, embeds, hints, metrics, querylog, \
+    replay, startup
+from main.middleware import CompressionMiddleware
+from main.models import Author, QueryFingerprint
+from main.synthetic import Generator
+from music.models import Album
+from prime import caching
+from prime.models import Article, FeedEntry, Recipe
+from prime.templatetags.shortcodes import spotify, youtube
 
 
 class SimpleTest(TestCase):
@@ -14,3 +45,610 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class LeanPathTest(TestCase):
+    def test_public_pages_set_no_cookies(self):
+        response = self.client.get('/music/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.cookies)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_admin_keeps_full_stack(self):
+        response = self.client.get('/admin/', HTTP_HOST='localhost')
+        self.assertIn('csrftoken', response.cookies)
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        Recipe.objects.create(title="Soup", slug="soup", body="*Hot*",
+                              lead_photo="prime/recipe/lead/s.jpg")
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        self.logger = logging.getLogger('main.profiling')
+        self.saved_handlers = self.logger.handlers
+        self.logger.handlers = [self.handler]
+
+    def tearDown(self):
+        self.logger.handlers = self.saved_handlers
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PRIME_CACHE_TIMEOUT=0)
+    def test_sampled_request(self):
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        timing = response['Server-Timing']
+        for name in ('db;', 'template;', 'markdown;', 'image;', 'total;'):
+            self.assertIn(name, timing)
+        line = json.loads(self.records[0].getMessage())
+        self.assertEqual(line['view'], 'prime_recipes')
+        self.assertTrue(line['timings']['db']['count'] > 0)
+        self.assertEqual(line['timings']['markdown']['count'], 1)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_disabled(self):
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(self.records, [])
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        Recipe.objects.create(title="Soup", slug="soup",
+                              lead_photo="prime/recipe/lead/s.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_endpoint(self):
+        with self.settings(METRICS_DIR=self.directory):
+            for _ in range(2):
+                self.client.get('/prime/recipes/soup/', HTTP_HOST='localhost')
+            # another worker's samples
+            with open(self.directory + '/metrics-1.json', 'w') as f:
+                json.dump({metrics._key('http_requests_total', {
+                    'view': 'prime_recipes', 'method': 'GET',
+                    'status': 200}): 3}, f)
+            response = self.client.get('/metrics', HTTP_HOST='localhost',
+                                       REMOTE_ADDR='127.0.0.1')
+        body = response.content
+        self.assertIn('http_requests_total{method="GET",status="200",'
+                      'view="prime_recipes"} 5', body)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{view="prime_recipes"} 2', body)
+        self.assertIn('db_queries_per_request_bucket'
+                      '{view="prime_recipes",le="+Inf"} 2', body)
+        self.assertIn('cache_requests_total{cache="page",result="hit"} 1',
+                      body)
+
+    def test_exited_workers_folded(self):
+        key = metrics._key('http_requests_total', {
+            'view': 'prime_recipes', 'method': 'GET', 'status': 200})
+        worker = subprocess.Popen(['true'])
+        worker.wait()
+        with self.settings(METRICS_DIR=self.directory):
+            for name in ('metrics-%d-1.json' % worker.pid,
+                         # an earlier process that had this worker's pid
+                         'metrics-%d-1.json' % os.getpid()):
+                with open(os.path.join(self.directory, name), 'w') as f:
+                    json.dump({key: 3}, f)
+            self.assertEqual(metrics.collect()[key], 6)
+            self.assertEqual(os.listdir(self.directory).count(
+                'metrics-retired.json'), 1)
+            self.assertEqual(len([name for name in os.listdir(self.directory)
+                                  if name.endswith('-1.json')]), 0)
+            # a later worker with a recycled pid adds to the totals
+            with open(os.path.join(self.directory, 'metrics-%d-2.json' %
+                                   worker.pid), 'w') as f:
+                json.dump({key: 1}, f)
+            self.assertEqual(metrics.collect()[key], 7)
+            self.assertEqual(metrics.collect()[key], 7)
+
+    def test_remote_requests_refused(self):
+        with self.settings(METRICS_DIR=self.directory):
+            response = self.client.get('/metrics', HTTP_HOST='localhost',
+                                       REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryLogTest(TestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            querylog.normalize('SELECT "t"."id" FROM "prime_image2" t\n'
+                               'WHERE "t"."id" IN (1, 2, 3) AND x = \'it\'\'s\' '
+                               'LIMIT 21'),
+            'SELECT "t"."id" FROM "prime_image2" t WHERE "t"."id" IN (...) '
+            'AND x = ? LIMIT ?')
+
+    @override_settings(QUERY_LOG_SAMPLE_RATE=1, PRIME_CACHE_TIMEOUT=0)
+    def test_aggregated_by_view_and_template(self):
+        Recipe.objects.create(title="Soup", slug="soup", body="[img1]",
+                              lead_photo="prime/recipe/lead/s.jpg")
+        for _ in range(3):
+            self.client.get('/prime/recipes/soup/', HTTP_HOST='localhost')
+        querylog.flush()
+
+        image = QueryFingerprint.objects.get(sql__contains='"prime_image"')
+        self.assertEqual(image.view, 'prime_recipes')
+        self.assertEqual(image.template, 'prime/diy-or-recipe/article.html')
+        self.assertEqual(image.count, 3)
+        self.assertTrue(image.p95 > 0)
+        recipe = QueryFingerprint.objects.get(
+            sql__startswith='SELECT "prime_recipe"', template='')
+        self.assertEqual(recipe.count, 3)
+
+        self.client.get('/prime/recipes/soup/', HTTP_HOST='localhost')
+        querylog.flush()
+        self.assertEqual(QueryFingerprint.objects.get(pk=image.pk).count, 4)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        response = self.client.get('/admin/main/queryfingerprint/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, 'prime_recipes')
+
+    @override_settings(QUERY_LOG_SAMPLE_RATE=1, PRIME_CACHE_TIMEOUT=0)
+    def test_database_errors_keep_the_batch(self):
+        Recipe.objects.create(title="Soup", slug="soup",
+                              lead_photo="prime/recipe/lead/s.jpg")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('main.querylog')
+        saved_handlers, logger.handlers = logger.handlers, [handler]
+        def failing():
+            raise OperationalError("database is locked")
+        manager = QueryFingerprint.objects
+        manager.select_for_update = failing
+        saved_flush = querylog._last_flush
+        querylog._last_flush = 0
+        try:
+            response = self.client.get('/prime/recipes/soup/',
+                                       HTTP_HOST='localhost')
+        finally:
+            del manager.select_for_update
+            logger.handlers = saved_handlers
+            querylog._last_flush = saved_flush
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(records), 1)
+        self.assertFalse(QueryFingerprint.objects.exists())
+        querylog.flush()
+        self.assertTrue(QueryFingerprint.objects.filter(
+            view='prime_recipes').exists())
+
+
+class SyntheticContentTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_generate_and_benchmark(self):
+        Generator(seed=1).run(authors=5, issues=3, images=10, tags=4,
+                              articles=12, recipes=4, diys=4,
+                              neighborhoods=2, guides=6, albums=3)
+        self.assertEqual(FeedEntry.objects.count(), 20)
+        article = Article.objects.all()[0]
+        self.assertTrue(article.byline)
+        self.assertEqual(article.byline, article.getPrettyAuthors())
+        self.assertTrue(Article.objects.filter(body__contains='[img')
+                        .exists())
+
+        output = os.path.join(self.directory, 'bench.json')
+        call_command('benchurls', samples=2, repeat=1, output=output,
+                     stdout=StringIO())
+        call_command('benchurls', samples=2, repeat=1, compare=output,
+                     stdout=StringIO())
+        with open(output) as f:
+            result = json.load(f)
+        self.assertEqual(result['rows']['article'], 12)
+        self.assertEqual(result['results']['prime_article']['statuses'],
+                         [200])
+        self.assertIn('skipped', result['results']['music_reviews'])
+        for name in ('root', 'prime_issue', 'main_page', 'prime_diy_tag'):
+            self.assertTrue(result['results'][name]['p95'] > 0)
+
+
+ACCESS_LOG = """\
+10.0.0.1 - - [10/Oct/2014:13:55:36 -0700] "GET /prime/recipes/soup/ HTTP/1.1" 200 2326 "http://example.com/" "Mozilla/5.0"
+10.0.0.2 - - [10/Oct/2014:13:55:37 -0700] "POST /prime/search/ HTTP/1.1" 403 12 "-" "curl/7.0"
+10.0.0.3 - - [10/Oct/2014:13:55:37 -0700] "GET /prime/recipes/soup/?utm_source=x&page=2 HTTP/1.1" 200 2326 "-" "Mozilla/5.0"
+not a log line
+10.0.0.4 - - [10/Oct/2014:13:55:38 -0700] "GET /music/ HTTP/1.1" 200 512 "-" "Mozilla/5.0"
+10.0.0.5 - - [10/Oct/2014:13:55:39 -0700] "GET /nowhere/ HTTP/1.1" 404 0 "-" "Mozilla/5.0"
+"""
+
+
+@override_settings(PRIME_CACHE_TIMEOUT=0)
+class ReplayTest(LiveServerTestCase):
+    def setUp(self):
+        Recipe.objects.create(title="Soup", slug="soup", body="*Hot*",
+                              lead_photo="prime/recipe/lead/s.jpg")
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'access.log')
+        with open(self.log, 'w') as f:
+            f.write(ACCESS_LOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse(self):
+        requests = list(replay.parse(ACCESS_LOG.splitlines()))
+        self.assertEqual([offset for offset, _ in requests], [0, 1, 2, 3])
+        self.assertEqual(requests[1][1],
+                         '/prime/recipes/soup/?utm_source=x&page=2')
+        line = replay.anonymize(ACCESS_LOG.splitlines()[2])
+        self.assertEqual(line, '- - - [10/Oct/2014:13:55:37 -0700] '
+                               '"GET /prime/recipes/soup/?page=2 HTTP/1.1" '
+                               '200 2326\n')
+
+    def test_search_text_replaced(self):
+        lines = ['10.0.0.%d - - [10/Oct/2014:13:55:3%d -0700] "GET /prime/'
+                 'search/?q=%s&page=2 HTTP/1.1" 200 512' % (number, number,
+                                                          query)
+                 for number, query in enumerate(['my+name', 'soup',
+                                                 'my+name'])]
+        paths = [line.split()[6] for line in replay.anonymizeLog(lines)]
+        self.assertEqual(paths, ['/prime/search/?q=query1&page=2',
+                                 '/prime/search/?q=query2&page=2',
+                                 '/prime/search/?q=query1&page=2'])
+        paths = [line.split()[6] for line in
+                 replay.anonymizeLog(lines, keep_queries=True)]
+        self.assertEqual(paths[0], '/prime/search/?q=my+name&page=2')
+
+    def test_replay(self):
+        output = os.path.join(self.directory, 'replay.json')
+        call_command('replaylog', self.log, base_url=self.live_server_url,
+                     speedup=0, concurrency=2, output=output,
+                     stdout=StringIO())
+        call_command('replaylog', self.log, base_url=self.live_server_url,
+                     speedup=0, compare=output, stdout=StringIO())
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(results['prime_recipes']['requests'], 2)
+        self.assertEqual(results['prime_recipes']['statuses'], {'200': 2})
+        self.assertEqual(results['main_page']['error_rate'], 0)
+        self.assertEqual(results['unresolved']['statuses'], {'404': 1})
+        self.assertNotIn('prime_search', results)
+
+        anonymized = os.path.join(self.directory, 'anonymized.log')
+        call_command('replaylog', self.log, anonymize=anonymized,
+                     stdout=StringIO())
+        with open(anonymized) as f:
+            self.assertNotIn('10.0.0', f.read())
+
+
+class StartupTest(TestCase):
+    def test_preload(self):
+        from django.core.handlers.wsgi import WSGIHandler
+        application = WSGIHandler()
+        startup.preload(application)
+        self.assertIn('prime/article.html', startup.templateNames())
+        self.assertIsNotNone(application._request_middleware)
+
+    def test_benchmark(self):
+        output = StringIO()
+        call_command('benchstartup', workers=1, runs=1, path='/nowhere/',
+                     stdout=output)
+        lazy, preloaded = output.getvalue().split('preloaded:')
+        self.assertIn('heavy modules: none', lazy)
+        self.assertIn('heavy modules: markdown2', preloaded)
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Recipe.objects.create(title="Soup", slug="soup",
+                              body="Simmer *slowly*. " * 100,
+                              lead_photo="prime/recipe/lead/s.jpg")
+        self.compressed = []
+        self.levels = []
+        self.saved_compress = compression.compress
+        def counting(data, encoding, best=False):
+            self.compressed.append(encoding)
+            self.levels.append(best)
+            return self.saved_compress(data, encoding, best)
+        compression.compress = counting
+
+    def tearDown(self):
+        compression.compress = self.saved_compress
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(compression.negotiate('gzip;q=0, deflate'), None)
+        self.assertEqual(compression.negotiate(''), None)
+        self.assertEqual(compression.negotiate('*'),
+                         compression.available()[0])
+        self.assertEqual(compression.negotiate('br;q=0.5, gzip'), 'gzip')
+
+    def get(self, **headers):
+        return self.client.get('/prime/recipes/soup/', HTTP_HOST='localhost',
+                               **headers)
+
+    @override_settings(PRIME_CACHE_TIMEOUT=0)
+    def test_response(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('<em>slowly</em>', gunzip(response.content))
+
+        response = self.get()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_not_outside_lean_paths(self):
+        # the admin login form holds a CSRF token
+        response = self.client.get('/admin/', HTTP_HOST='localhost',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('csrfmiddlewaretoken', response.content)
+        request = RequestFactory().get('/prime/', HTTP_ACCEPT_ENCODING='gzip')
+        request.META['CSRF_COOKIE_USED'] = True
+        response = CompressionMiddleware().process_response(
+            request, StreamingHttpResponse(['x' * 1000]))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_cached_pages_compressed_once(self):
+        first = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        second = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(self.compressed, ['gzip'])
+        self.assertEqual(second['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(first.content), gunzip(second.content))
+        self.assertContains(self.get(), '<em>slowly</em>')
+
+    def test_best_level_offline(self):
+        first = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(self.levels, [False])
+        caching.compressPage('/prime/recipes/soup/')
+        self.assertEqual(self.compressed[1:], list(compression.available()))
+        self.assertEqual(self.levels[1:], [True] * len(self.compressed[1:]))
+        second = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gunzip(first.content), gunzip(second.content))
+        self.assertEqual(len(self.compressed), 1 + len(
+            compression.available()))
+
+    def test_streaming(self):
+        request = RequestFactory().get('/prime/feeds/all.atom',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        response = StreamingHttpResponse(
+            ('line %d\n' % n for n in xrange(1000)),
+            content_type='text/plain')
+        response = CompressionMiddleware().process_response(request, response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = ''.join(response.streaming_content)
+        self.assertTrue(gunzip(data).endswith('line 999\n'))
+
+    def test_static_siblings(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'site.css'), 'w') as f:
+                f.write('body { color: black; }\n' * 50)
+            with override_settings(STATIC_ROOT=root):
+                call_command('compressstatic', stdout=StringIO())
+            with open(os.path.join(root, 'site.css.gz'), 'rb') as f:
+                self.assertEqual(gunzip(f.read()),
+                                 'body { color: black; }\n' * 50)
+        finally:
+            shutil.rmtree(root)
+
+
+class AssetsTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        assets.loadManifest(reload=True)
+
+    def test_minify(self):
+        self.assertEqual(assets.minifyJS(
+            'var url = "http://a/*b";  // note\n\n'
+            '  var re = /\\/*[/]/g; /* gone */ x = a / b;\n'
+            '/*! kept */'),
+            'var url = "http://a/*b";\nvar re = /\\/*[/]/g;   x = a / b;\n'
+            '/*! kept */')
+        self.assertEqual(assets.minifyCSS(
+            '/* c */ a ,  b > i {\n  color : red;\n  content: "x ; y";\n}'),
+            'a,b>i{color : red;content: "x ; y"}')
+        self.assertEqual(
+            assets.rewriteURLs("url('../img/a.png?x#y') url(data:x)",
+                               'prime/css/main.css'),
+            "url('/static/prime/img/a.png?x#y') url(data:x)")
+
+    def test_build(self):
+        response = self.client.get('/music/', HTTP_HOST='localhost')
+        self.assertContains(response, '/static/music/css/reset.css')
+        with override_settings(STATIC_ROOT=self.root):
+            call_command('buildassets', stdout=StringIO())
+            response = self.client.get('/music/', HTTP_HOST='localhost')
+            self.assertNotContains(response, '/static/music/css/reset.css')
+            hashed = assets.loadManifest()['music.css']
+            self.assertContains(response, '/static/%s' % hashed)
+            with open(os.path.join(self.root, hashed)) as f:
+                self.assertIn('/static/music/font/fontello.eot', f.read())
+            with override_settings(DEBUG=True):
+                response = self.client.get('/music/', HTTP_HOST='localhost')
+                self.assertContains(response, '/static/music/css/reset.css')
+
+    def test_cascade(self):
+        # stylesheets come in the order the pages linked them before bundling
+        Recipe.objects.create(title="Soup", slug="soup", body="Simmer.")
+        for path, order in (
+                ('/prime/search/?q=soup', ('diy-or-recipe/style.css',
+                                           'bootstrap.min.css',
+                                           'bootstrap-theme.min.css',
+                                           'minishare.css', 'embeds.css')),
+                ('/prime/recipes/soup/', ('minishare.css',
+                                          'diy-or-recipe/style.css',
+                                          'bootstrap.min.css',
+                                          'normalize.css', 'embeds.css'))):
+            content = self.client.get(path, HTTP_HOST='localhost').content
+            positions = [content.index(name) for name in order]
+            self.assertEqual(positions, sorted(positions))
+
+
+class PreloadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Recipe.objects.create(title="Soup", slug="soup", body="Simmer.",
+                              lead_photo="prime/recipe/lead/s.jpg")
+
+    def links(self, path):
+        response = self.client.get(path, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return [part.strip() for part in response['Link'].split(',')]
+
+    def test_fonts(self):
+        self.assertEqual(assets.fonts('music.css'),
+                         ['/static/music/font/fontello.woff?42971895'])
+        self.assertEqual(len(assets.fonts('prime-district.css')), 2)
+        self.assertEqual(assets.fonts('music.js'), [])
+
+    def test_header(self):
+        links = self.links('/music/')
+        self.assertEqual(links[0], '</static/music/css/reset.css>; '
+                                   'rel=preload; as=style')
+        self.assertIn('</static/music/font/fontello.woff?42971895>; '
+                      'rel=preload; as=font; type="font/woff"; crossorigin',
+                      links)
+        self.assertFalse([link for link in links if 'as=script' in link])
+
+    def test_cached_page(self):
+        first = self.links('/prime/recipes/soup/')
+        self.assertIn('</static/prime/img/Recipes/header.jpg>; '
+                      'rel=preload; as=image', first)
+        self.assertEqual(self.links('/prime/recipes/soup/'), first)
+
+    def test_empty_parts_skipped(self):
+        hints.start()
+        try:
+            Template('{% load assets %}{% preload "image" "/media/" photo %}'
+                     ).render(Context({'photo': ''}))
+        finally:
+            self.assertEqual(hints.stop(), [])
+
+
+class StubOEmbedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        parsed = urlparse.urlparse(self.path)
+        if parsed.path == '/thumb.jpg':
+            body, content_type = 'JPEG', 'image/jpeg'
+        elif parsed.path == '/oembed':
+            url = urlparse.parse_qs(parsed.query)['url'][0]
+            body, content_type = json.dumps({
+                'title': 'Stub <%s>' % url.rsplit('/', 1)[-1],
+                'thumbnail_url': 'http://127.0.0.1:%d/thumb.jpg' %
+                self.server.server_port,
+            }), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EmbedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = HTTPServer(('127.0.0.1', 0), StubOEmbedHandler)
+        self.server.paths = []
+        threading.Thread(target=self.server.serve_forever).start()
+        endpoint = 'http://127.0.0.1:%d/oembed' % self.server.server_port
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(
+            MEDIA_ROOT=self.media, EMBED_FETCH_ON_SAVE=True,
+            OEMBED_ENDPOINTS={'youtube': endpoint, 'spotify': endpoint})
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.media)
+
+    def test_fetched_once_on_save(self):
+        recipe = Recipe.objects.create(
+            title="Soup", slug="soup", lead_photo="prime/recipe/lead/s.jpg",
+            body="[youtube]http://youtu.be/abc[/youtube]\n\n"
+                 "[spotify]123[/spotify]")
+        self.assertEqual(len(self.server.paths), 4)
+        recipe.save()
+        self.assertEqual(len(self.server.paths), 4)
+
+        metadata = embeds.read('youtube', 'abc')
+        self.assertEqual(metadata['title'], 'Stub <watch?v=abc>')
+        with open(os.path.join(self.media, metadata['thumbnail'])) as f:
+            self.assertEqual(f.read(), 'JPEG')
+
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, 'data-embed="//www.youtube.com/embed/'
+                                      'abc?autoplay=1"')
+        self.assertContains(response, 'Stub &lt;watch?v=abc&gt;')
+        self.assertNotContains(response, '<iframe')
+        html = spotify('[spotify]123[/spotify]')
+        self.assertIn('href="https://open.spotify.com/track/123"', html)
+        self.assertIn('<img src="/media/embeds/spotify/', html)
+
+    def test_not_fetched_on_save_by_default(self):
+        with override_settings(EMBED_FETCH_ON_SAVE=False):
+            Recipe.objects.create(
+                title="Soup", slug="soup",
+                lead_photo="prime/recipe/lead/s.jpg",
+                body="[youtube]http://youtu.be/abc[/youtube]")
+        self.assertEqual(self.server.paths, [])
+        self.assertIsNone(embeds.read('youtube', 'abc'))
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        self.assertNotContains(response, 'Stub &lt;watch?v=abc&gt;')
+        call_command('fetchembeds', stdout=StringIO())
+        self.assertEqual(embeds.read('youtube', 'abc')['title'],
+                         'Stub <watch?v=abc>')
+        # the page cached with a bare facade is rendered again
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, 'Stub &lt;watch?v=abc&gt;')
+
+    def test_album(self):
+        author = Author.objects.create(first_name="Ann", last_name="Critic")
+        Album.objects.create(title="Blue", artist="Joni", rating=5,
+                             review_url='http://example.com/', author=author,
+                             artwork='music/blue.jpg',
+                             spotify_url='spotify:album:blue')
+        response = self.client.get('/music/', HTTP_HOST='localhost')
+        self.assertContains(response, 'class="embed-facade embed-spotify '
+                                      'spotify-embed"')
+        self.assertContains(response, 'Stub &lt;blue&gt;')
+
+    def test_unreachable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('main.embeds')
+        saved_handlers, logger.handlers = logger.handlers, [handler]
+        try:
+            with override_settings(EMBED_FETCH_TIMEOUT=1):
+                self.assertEqual(embeds.ensure([('youtube', 'xyz')]), 0)
+        finally:
+            logger.handlers = saved_handlers
+        self.assertEqual(len(records), 1)
+        self.assertIsNone(embeds.read('youtube', 'xyz'))
+        html = youtube('[youtube]http://youtu.be/xyz[/youtube]')
+        self.assertIn('href="https://www.youtube.com/watch?v=xyz"', html)
+        self.assertNotIn('<img', html)
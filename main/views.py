@@ -1,2 +1,14 @@
 from main.models import Author
 from django.views.generic.list import ListView
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from main import metrics
+
+
+def metrics_endpoint(request):
+    if not metrics.enabled() or 'HTTP_X_FORWARDED_FOR' in request.META or \
+            request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
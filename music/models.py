@@ -12,3 +12,5 @@ class Album(models.Model):
     def __unicode__(self):
         return self.title
 
+
+from music import signals
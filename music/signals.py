@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from music.models import Album
+
+
+@receiver(post_save, sender=Album)
+def fetchEmbed(sender, instance, raw=False, **kwargs):
+    from main import embeds
+    if not raw and instance.spotify_url and \
+            getattr(settings, 'EMBED_FETCH_ON_SAVE', False):
+        embeds.ensure([('spotify', instance.spotify_url)])
@@ -1,3 +1,24 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from main.synthetic import Generator
+
+
+class QueryBudgetTest(TestCase):
+    def count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/music/', HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_main_view(self):
+        generator = Generator(seed=3)
+        generator.run(authors=3, issues=0, images=0, tags=0, articles=0,
+                      recipes=0, diys=0, neighborhoods=0, guides=0,
+                      albums=10)
+        self.assertEqual(self.count(), 1)
+        generator.run(authors=30, issues=0, images=0, tags=0, articles=0,
+                      recipes=0, diys=0, neighborhoods=0, guides=0,
+                      albums=1000)
+        self.assertEqual(self.count(), 1)
@@ -3,6 +3,6 @@ from .views import MainView
 
 urlpatterns = patterns('',
     url(r'^$', MainView.as_view(), name='main_page'),
-    url(r'^reviews$', 'music.views.fetch_review')
+    url(r'^reviews$', 'music.views.fetch_review', name='music_reviews')
 )
 
@@ -1,4 +1,5 @@
 import json
+import time
 import urllib
 import urllib2
 
@@ -10,6 +11,8 @@ from django.shortcuts import render
 
 from django.views.generic import TemplateView
 
+from main import embeds, metrics
+
 from .models import Album
 
 class MainView(TemplateView):
@@ -18,7 +21,9 @@ class MainView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(MainView, self).get_context_data(**kwargs)
-        context['albums'] = Album.objects.all()
+        context['albums'] = Album.objects.select_related('author')
+        found = embeds.lookup(('spotify', album.spotify_url)
+                              for album in context['albums'])
 
         # Allow for clean rating star rending in the template:
         max_rating = 5
@@ -36,6 +41,11 @@ class MainView(TemplateView):
             if (abs(rating - floor(rating)) < 0.1): # 0.1 acts as "epsilon"
                 album.need_half_star = False
 
+            album.spotify_embed = embeds.facade(
+                'spotify', album.spotify_url,
+                found.get(('spotify', album.spotify_url)), 300, 80,
+                'spotify-embed')
+
         return context
 
 def fetch_review(request):
@@ -45,8 +55,15 @@ def fetch_review(request):
 
     opener = urllib2.build_opener()
     opener.addheaders = [('Accept-Charset', 'utf-8')]
-    response = opener.open(req)
-    data = response.read().decode('utf-8')
+    start = time.time()
+    try:
+        response = opener.open(req)
+        data = response.read().decode('utf-8')
+    except Exception:
+        metrics.inc('review_fetch_errors_total')
+        raise
+    finally:
+        metrics.observe('review_fetch_duration_seconds', time.time() - start)
 
     # Only grab the content field of the JSON response.
     # (This has to be done manually, and as a string, because the JSON response from DB is corrupted in some way)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.db import models
 from django.forms import Textarea
+from prime import caching
 from prime.models import Issue, Article, Image, PDF, Recipe, DIYarticle, CityGuideArticle, Neighborhood, RecipeTag, DIYTag
 
 # admin.site.register(CityGuideArticle, CGAdmin)
@@ -12,6 +13,24 @@ admin.site.register(Neighborhood, NeighborhoodAdmin)
 class IssueAdmin(admin.ModelAdmin):
     list_display = ('name', 'release_date')
     prepopulated_fields = {"slug": ("name",)}
+    actions = ['warm_caches']
+
+    def warm_caches(self, request, queryset):
+        for issue in queryset:
+            missing = [name for name, status in caching.warmImages(issue)
+                       if status == 'missing']
+            pages = caching.warmPages(issue)
+            errors = [url for url, status, _, _, _ in pages
+                      if status != 200]
+            message = "%s: %d pages warmed in %.2fs" % (
+                issue, len(pages),
+                sum(seconds for _, _, _, seconds, _ in pages))
+            if errors:
+                message += "; failed: %s" % ', '.join(errors)
+            if missing:
+                message += "; missing images: %s" % ', '.join(missing)
+            self.message_user(request, message)
+    warm_caches.short_description = "Warm page caches for the selected issues"
 admin.site.register(Issue, IssueAdmin)
 
 class ArticleAdmin(admin.ModelAdmin):
@@ -0,0 +1,347 @@
+"""
+Whole issues as a zip or EPUB, for reading offline.
+
+``ArchiveView`` streams the archive as it is built: the zip is written
+entry by entry (``ZipStream``), with sizes and checksums of each entry in a
+data descriptor after its data, so nothing has to be seekable or held in
+memory. Pieces are read with ``iterator()`` and rendered one at a time,
+images and the PDF copied in chunks, so memory stays flat however large
+the issue.
+
+Both formats hold every article, recipe and DIY piece of the issue as HTML
+with its images; the zip also has the PDF and an ``index.html``. EPUB
+readers have no use for the PDF, so it is left out there.
+
+The first build is written to ``MEDIA_ROOT/archives/`` while it streams and
+kept under a name carrying the prime content generation (see
+``prime.caching``); later requests stream that file until content changes.
+"""
+import binascii
+import mimetypes
+import os
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from prime.models import Article, Recipe, DIYarticle, Image, PDF
+from prime.templatetags.shortcodes import IMG, YOUTUBE, SPOTIFY, LINEBREAK
+
+DIRECTORY = 'archives'
+FORMATS = {
+    'zip': {'content_type': 'application/zip', 'prefix': '',
+            'extension': '.html'},
+    'epub': {'content_type': 'application/epub+zip', 'prefix': 'OEBPS/',
+             'extension': '.xhtml'},
+}
+KINDS = ((Article, 'article'), (Recipe, 'recipe'), (DIYarticle, 'diy'))
+CHUNK = 64 * 1024
+
+STYLE = """body { font-family: Georgia, serif; line-height: 1.5; margin: 1em; }
+figure { margin: 1em 0; }
+img { max-width: 100%; height: auto; }
+figcaption, .byline { color: #555; font-size: 0.9em; }
+"""
+
+
+class ZipStream(object):
+    """
+    Writes a zip archive as a sequence of strings. Every method is a
+    generator of the bytes it adds; ``finish()`` ends the archive.
+    """
+    def __init__(self, date_time=None):
+        self.offset = 0
+        self.entries = []
+        self.dos_time, self.dos_date = dosDateTime(
+            date_time or time.localtime()[:6])
+
+    def emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def header(self, name, flags, method, crc=0, size=0, compressed=0):
+        name = name.encode('utf-8')
+        return self.emit(struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 20, flags, method, self.dos_time,
+            self.dos_date, crc, compressed, size, len(name), 0) + name)
+
+    def add(self, name, data, compress=True):
+        """
+        An entry holding the string ``data``; its sizes are known up front,
+        so it needs no data descriptor (EPUB wants that for ``mimetype``).
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        method = zlib.DEFLATED if compress else 0
+        stored = deflate([data]) if compress else data
+        crc = binascii.crc32(data) & 0xffffffff
+        offset = self.offset
+        yield self.header(name, 0x800, method, crc, len(data), len(stored))
+        yield self.emit(stored)
+        self.record(name, 0x800, method, crc, len(data), len(stored), offset)
+
+    def addFile(self, name, path, compress=False):
+        """
+        An entry copied from the file at ``path`` in chunks.
+        """
+        flags = 0x800 | 0x08
+        method = zlib.DEFLATED if compress else 0
+        offset = self.offset
+        yield self.header(name, flags, method)
+        crc = size = compressed = 0
+        with open(path, 'rb') as f:
+            chunks = iter(lambda: f.read(CHUNK), '')
+            if compress:
+                compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                              -zlib.MAX_WBITS)
+            for chunk in chunks:
+                crc = binascii.crc32(chunk, crc)
+                size += len(chunk)
+                if compress:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    compressed += len(chunk)
+                    yield self.emit(chunk)
+            if compress:
+                chunk = compressor.flush()
+                compressed += len(chunk)
+                yield self.emit(chunk)
+        crc &= 0xffffffff
+        yield self.emit(struct.pack('<IIII', 0x08074b50, crc, compressed,
+                                    size))
+        self.record(name, flags, method, crc, size, compressed, offset)
+
+    def record(self, name, flags, method, crc, size, compressed, offset):
+        if self.offset > 0xffffffff:
+            # would need zip64, which this writer does not do
+            raise ValueError("Archive larger than 4 GB.")
+        self.entries.append((name.encode('utf-8'), flags, method, crc, size,
+                             compressed, offset))
+
+    def finish(self):
+        start = self.offset
+        for name, flags, method, crc, size, compressed, offset in \
+                self.entries:
+            yield self.emit(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, flags, method,
+                self.dos_time, self.dos_date, crc, compressed, size,
+                len(name), 0, 0, 0, 0, 0, offset) + name)
+        yield self.emit(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(self.entries),
+            len(self.entries), self.offset - start, start, 0))
+
+def dosDateTime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11 | minute << 5 | second // 2,
+            max(year - 1980, 0) << 9 | month << 5 | day)
+
+def deflate(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return ''.join(compressor.compress(chunk) for chunk in chunks) + \
+        compressor.flush()
+
+
+# file names and the disk cache
+
+def imageName(name):
+    """
+    Name in the archive of the media file ``name``.
+    """
+    return 'images/%s' % name.replace('/', '-')
+
+def pieceName(kind, slug, format):
+    return '%s-%s%s' % (kind, slug, FORMATS[format]['extension'])
+
+def cachedPath(issue, format, generation):
+    return os.path.join(settings.MEDIA_ROOT, DIRECTORY, '%s-%s.%s' % (
+        issue.slug, generation, format))
+
+def cached(issue, format, generation):
+    """
+    Path of the finished archive for this content generation, or None.
+    """
+    path = cachedPath(issue, format, generation)
+    return path if os.path.exists(path) else None
+
+def stored(issue, format):
+    """
+    Every archive of ``issue`` in ``format`` on disk, of any generation.
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, DIRECTORY)
+    prefix, suffix = issue.slug + '-', '.' + format
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in os.listdir(directory)
+            if name.startswith(prefix) and name.endswith(suffix) and
+            name[len(prefix):-len(suffix)].isdigit()]
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), ''):
+            yield chunk
+
+def saving(chunks, path, replaces=()):
+    """
+    Passes ``chunks`` through while writing them to ``path``, which only
+    appears once the last chunk is written; the files in ``replaces`` are
+    then removed. An interrupted download leaves nothing behind, and
+    requests building the same archive at once each write their own file.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = tempfile.mkstemp(
+        prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    # mkstemp creates files only their owner can read
+    os.chmod(temporary, 0644)
+    complete = False
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            os.rename(temporary, path)
+        elif os.path.exists(temporary):
+            os.remove(temporary)
+    for old in replaces:
+        if old != path and os.path.exists(old):
+            os.remove(old)
+
+
+# content
+
+def bodyHTML(text, images):
+    """
+    A piece's body as HTML for offline reading: markdown as on the site,
+    image shortcodes pointing into the archive, embeds as plain links.
+    """
+    from prime.templatetags.markdown import markdown
+
+    def figure(match):
+        image = images.get(int(match.group('pk')))
+        if image is None or not image.image:
+            return ''
+        credit = ' <span class="credit">%s</span>' % escape(image.author) \
+            if image.author else ''
+        return ('<figure><img src="%s" alt="%s" /><figcaption>%s%s'
+                '</figcaption></figure>' % (
+                    imageName(image.image.name), escape(image.caption),
+                    escape(image.caption), credit))
+
+    html = markdown(text)
+    html = IMG.sub(figure, html)
+    html = YOUTUBE.sub(lambda match: '<a href="https://www.youtube.com/watch'
+                       '?v=%s">Watch on YouTube</a>' % escape(
+                           match.group('uid')), html)
+    html = SPOTIFY.sub(lambda match: '<a href="https://open.spotify.com/'
+                       'track/%s">Listen on Spotify</a>' % escape(
+                           match.group('sid')), html)
+    return LINEBREAK.sub('<br />', html)
+
+def pieces(issue):
+    """
+    (kind, piece) for everything in ``issue``, in issue order.
+    """
+    for model, kind in KINDS:
+        for piece in model.objects.filter(issue=issue)\
+                                  .order_by('position', 'id').iterator():
+            yield kind, piece
+
+
+class Archive(object):
+    def __init__(self, issue, format):
+        self.issue = issue
+        self.format = format
+        self.prefix = FORMATS[format]['prefix']
+        release = issue.release_date
+        self.zip = ZipStream((release.year, release.month, release.day,
+                              0, 0, 0))
+        self.added = set()
+        # (name, title, media type) of everything listed in content.opf
+        self.items = []
+        self.contents = []
+
+    def addMedia(self, name):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        archived = imageName(name)
+        if archived in self.added or not os.path.isfile(path):
+            return
+        self.added.add(archived)
+        self.items.append((archived, None, mimetypes.guess_type(path)[0] or
+                           'application/octet-stream'))
+        for chunk in self.zip.addFile(self.prefix + archived, path):
+            yield chunk
+
+    def render(self, template, context):
+        context = dict(context, issue=self.issue,
+                       epub=self.format == 'epub', style='style.css')
+        return render_to_string(template, context)
+
+    def chunks(self):
+        zip = self.zip
+        if self.format == 'epub':
+            for chunk in zip.add('mimetype', 'application/epub+zip',
+                                 compress=False):
+                yield chunk
+            for chunk in zip.add('META-INF/container.xml',
+                                 render_to_string(
+                                     'prime/archive/container.xml', {})):
+                yield chunk
+        for chunk in zip.add(self.prefix + 'style.css', STYLE):
+            yield chunk
+        self.items.append(('style.css', None, 'text/css'))
+
+        for kind, piece in pieces(self.issue):
+            images = Image.objects.select_related('author').in_bulk(
+                set(int(pk) for pk, _ in IMG.findall(piece.body)))
+            name = pieceName(kind, piece.slug, self.format)
+            lead = imageName(piece.lead_photo.name) \
+                if piece.lead_photo and os.path.isfile(
+                    piece.lead_photo.path) else None
+            for chunk in zip.add(self.prefix + name, self.render(
+                    'prime/archive/piece.html', {
+                        'piece': piece, 'lead': lead,
+                        'body': bodyHTML(piece.body, images)})):
+                yield chunk
+            self.items.append((name, piece.title,
+                               'application/xhtml+xml'))
+            self.contents.append((name, piece.title, piece.byline))
+            media = [piece.lead_photo.name] if lead else []
+            media += [image.image.name for image in images.values()
+                      if image.image]
+            for medium in sorted(media):
+                for chunk in self.addMedia(medium):
+                    yield chunk
+
+        if self.format == 'zip':
+            pdf = PDF.objects.filter(issue=self.issue).first()
+            if pdf and pdf.pdf and os.path.isfile(pdf.pdf.path):
+                for chunk in zip.addFile('%s.pdf' % self.issue.slug,
+                                         pdf.pdf.path):
+                    yield chunk
+            index = self.render('prime/archive/contents.html',
+                                {'contents': self.contents,
+                                 'pdf': pdf and pdf.pdf})
+            for chunk in zip.add('index.html', index):
+                yield chunk
+        else:
+            for chunk in zip.add(self.prefix + 'nav.xhtml', self.render(
+                    'prime/archive/contents.html',
+                    {'contents': self.contents})):
+                yield chunk
+            for chunk in zip.add(self.prefix + 'content.opf', self.render(
+                    'prime/archive/content.opf', {
+                        'items': self.items,
+                        'modified': datetime.utcnow().strftime(
+                            '%Y-%m-%dT%H:%M:%SZ')})):
+                yield chunk
+        for chunk in zip.finish():
+            yield chunk
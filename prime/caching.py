@@ -0,0 +1,214 @@
+"""
+Page and fragment caches for prime, plus issue warm-up.
+
+Every key embeds a content generation stored in the default cache, bumped
+whenever a prime row (or an author) is saved or deleted, so nothing is ever
+invalidated key by key: a bump makes every old entry unreachable and it
+expires on its own. The generation is taken from the clock, so it only goes
+up: if the cache evicts it, it starts again past every value handed out
+before, and old entries stay unreachable. ``PRIME_CACHE_TIMEOUT = 0`` disables both caches.
+Pages are also kept compressed, once per encoding (see ``main.compression``).
+"""
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, reverse
+from django.http import Http404
+
+from main import compression, hints, metrics
+
+from prime.models import Article, Recipe, DIYarticle, Image, PDF, \
+    RecipeTag, DIYTag, refreshPreview, resizeImage
+
+GENERATION_KEY = 'prime:content:generation'
+
+logger = logging.getLogger('prime.caching')
+
+
+def enabled():
+    return bool(getattr(settings, 'PRIME_CACHE_TIMEOUT', 0))
+
+def clock():
+    # in microseconds; saves never come faster than that
+    return int(time.time() * 1000000)
+
+def generation():
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        cache.add(GENERATION_KEY, clock(), None)
+        value = cache.get(GENERATION_KEY) or clock()
+    return value
+
+def bumpGeneration():
+    """
+    Moves the generation on to the current time. Two workers bumping at
+    once both leave it past its old value, so neither bump is lost.
+    """
+    cache.set(GENERATION_KEY, max(clock(), (cache.get(GENERATION_KEY) or 0)
+                                  + 1), None)
+
+def pageKey(path):
+    return 'prime:page:%s:%s' % (generation(),
+                                 hashlib.md5(path).hexdigest())
+
+def fragmentKey(name, instance):
+    return 'prime:fragment:%s:%s:%s.%s:%s' % (
+        generation(), name, instance._meta.app_label,
+        instance._meta.model_name, instance.pk)
+
+
+def cachedPage(view):
+    """
+    Caches successful, cookie-free GET responses of ``view`` by full path.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not enabled() or request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        key = pageKey(request.get_full_path())
+        encoding = compression.negotiate(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')) \
+            if compression.enabled() else None
+        if encoding:
+            response = cache.get('%s:%s' % (key, encoding))
+            if response is not None:
+                metrics.inc('cache_requests_total', cache='page',
+                            result='hit')
+                return response
+        response = cache.get(key)
+        metrics.inc('cache_requests_total', cache='page',
+                    result='miss' if response is None else 'hit')
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.cookies or \
+                    response.streaming:
+                return response
+            # a hit renders no template, so keep the preloads with the page
+            hints.apply(response, hints.current())
+            cache.set(key, response, settings.PRIME_CACHE_TIMEOUT)
+        # compressed once and kept beside the plain page; warmPages redoes
+        # it at the highest level, too slow for a reader to wait for
+        if encoding and compression.compressible(response) and \
+                compression.compressResponse(response, encoding):
+            cache.set('%s:%s' % (key, encoding), response,
+                      settings.PRIME_CACHE_TIMEOUT)
+        return response
+    return wrapper
+
+
+# warm-up
+
+def issueURLs(issue):
+    """
+    Every page showing content from ``issue``.
+    """
+    urls = [reverse('root'), reverse('prime_past_issues'),
+            reverse('prime_issue', args=[issue.slug])]
+    urls += [reverse('prime_article', args=[issue.slug, slug]) for slug in
+             Article.objects.filter(issue=issue)
+             .values_list('slug', flat=True)]
+    urls += [reverse('prime_recipe')]
+    urls += [reverse('prime_recipes', args=[slug]) for slug in
+             Recipe.objects.filter(issue=issue)
+             .values_list('slug', flat=True)]
+    urls += [reverse('prime_recipe_tag', args=[name]) for name in
+             RecipeTag.objects.filter(recipe__issue=issue).distinct()
+             .values_list('name', flat=True)]
+    urls += [reverse('prime_diy')]
+    urls += [reverse('prime_diys', args=[slug]) for slug in
+             DIYarticle.objects.filter(issue=issue)
+             .values_list('slug', flat=True)]
+    urls += [reverse('prime_diy_tag', args=[name]) for name in
+             DIYTag.objects.filter(diyarticle__issue=issue).distinct()
+             .values_list('name', flat=True)]
+    return urls
+
+def issueImages(issue):
+    """
+    (ImageFieldFile, resize) for every image file belonging to ``issue``;
+    ``resize`` is True for images that get an in-place display variant.
+    """
+    files = [(image.image, True) for image in
+             Image.objects.filter(issue=issue)]
+    if issue.header_image:
+        files.append((issue.header_image, False))
+    files += [(pdf.image, False) for pdf in PDF.objects.filter(issue=issue)]
+    for model in (Article, Recipe, DIYarticle):
+        files += [(content.lead_photo, False) for content in
+                  model.objects.filter(issue=issue)]
+    return files
+
+def warmImages(issue):
+    """
+    Checks every image of ``issue``, generating missing display variants
+    and previews. Returns a list of (name, status) with status 'ok',
+    'resized' or 'missing'.
+    """
+    from PIL import Image as PyImage
+    results = []
+    for field, resize in issueImages(issue):
+        try:
+            if resize and resizeImage(field.path):
+                status = 'resized'
+            else:
+                PyImage.open(field.path).verify()
+                status = 'ok'
+        except (IOError, SyntaxError):
+            status = 'missing'
+        if status == 'resized' or status == 'ok' and \
+                not getattr(field.instance, field.field.name + '_preview'):
+            refreshPreview(field)
+        results.append((field.name, status))
+    return results
+
+def compressPage(path):
+    """
+    Stores every encoding of the cached page at ``path``, compressed at the
+    highest level.
+    """
+    key = pageKey(path)
+    for encoding in compression.available():
+        response = cache.get(key)
+        if response is not None and compression.compressible(response) and \
+                compression.compressResponse(response, encoding, best=True):
+            cache.set('%s:%s' % (key, encoding), response,
+                      settings.PRIME_CACHE_TIMEOUT)
+
+def warmPages(issue):
+    """
+    Renders every page of ``issue`` through its view so the page and
+    fragment caches are filled, with each page's encodings compressed
+    thoroughly (see ``compressPage``). Returns a list of (url, status code, hit,
+    seconds, error); ``hit`` is True if the page was already cached, and
+    ``error`` describes the exception of a page that failed, which does not
+    stop the others.
+    """
+    from django.test.client import RequestFactory
+    factory = RequestFactory(HTTP_HOST='localhost')
+    results = []
+    for url in issueURLs(issue):
+        hit = enabled() and cache.get(pageKey(url)) is not None
+        error = None
+        start = time.time()
+        # as PreloadMiddleware would, so the cached page keeps its hints
+        hints.start()
+        try:
+            match = resolve(url)
+            status = match.func(factory.get(url), *match.args,
+                                **match.kwargs).status_code
+        except Http404:
+            status = 404
+        except Exception as exception:
+            logger.exception("Warming %s failed", url)
+            status, error = 500, '%s: %s' % (type(exception).__name__,
+                                             exception)
+        finally:
+            hints.stop()
+        if status == 200 and enabled() and compression.enabled():
+            compressPage(url)
+        results.append((url, status, hit, time.time() - start, error))
+    return results
@@ -0,0 +1,292 @@
+"""
+Static HTML export of the prime section.
+
+Every public prime page is rendered through the normal URL conf and written
+under a target directory, so nginx can serve it without touching Django::
+
+    location /prime/ {
+        try_files $uri/index.page-$arg_page.html $uri/index.html @django;
+    }
+
+Page 1 of a paginated listing is ``index.html``; page N is
+``index.page-N.html``, discovered by following the ``?page=N`` links of the
+rendered pages. Search and suggest stay dynamic.
+
+Incremental runs use a manifest (``.export-manifest.json`` in the target
+directory) holding, for each URL, the SELECT statements it executed and a
+digest of their results. A page is re-rendered only if replaying its queries
+gives a different digest, i.e. one of its source rows changed or a row was
+added to or removed from one of its listings. Replaying a handful of indexed
+queries is much cheaper than rendering markdown and templates. Edited
+templates trigger a full export.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import urllib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.db.backends import util
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from prime.models import Issue, Article, Recipe, DIYarticle, RecipeTag, \
+    DIYTag, Neighborhood
+
+MANIFEST_NAME = '.export-manifest.json'
+PAGE_LINK = re.compile(r'href="\?page=(\d+)"')
+
+
+def seedURLs():
+    """
+    Every prime URL reachable without pagination.
+    """
+    urls = [reverse(name) for name in ('root', 'prime_recipe', 'prime_diy',
+                                       'cityguides_view',
+                                       'prime_past_issues')]
+    urls += [reverse('prime_issue', args=[slug]) for slug in
+             Issue.objects.values_list('slug', flat=True)]
+    urls += [reverse('prime_article', args=[issue_slug, slug])
+             for issue_slug, slug in Article.objects
+             .filter(issue__isnull=False)
+             .values_list('issue__slug', 'slug')]
+    urls += [reverse('prime_recipes', args=[slug]) for slug in
+             Recipe.objects.values_list('slug', flat=True)]
+    urls += [reverse('prime_diys', args=[slug]) for slug in
+             DIYarticle.objects.values_list('slug', flat=True)]
+    urls += [reverse('prime_recipe_tag', args=[name]) for name in
+             RecipeTag.objects.values_list('name', flat=True)]
+    urls += [reverse('prime_diy_tag', args=[name]) for name in
+             DIYTag.objects.values_list('name', flat=True)]
+    urls += [reverse('cityguide_view', args=[slug]) for slug in
+             Neighborhood.objects.values_list('slug', flat=True)]
+    return sorted(set(urls))
+
+def outputPath(target, url):
+    """
+    File for ``url`` under ``target``, or None if it would escape it.
+    """
+    path, _, query = url.partition('?page=')
+    name = 'index.page-%s.html' % query if query else 'index.html'
+    parts = urllib.unquote(path).strip('/').split('/')
+    if any(part in ('', '.', '..') for part in parts):
+        return None
+    return os.path.join(target, *parts + [name])
+
+def templatesSignature():
+    digest = hashlib.md5()
+    for directory in settings.TEMPLATE_DIRS:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                with open(os.path.join(root, name), 'rb') as f:
+                    digest.update(name)
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+# query recording
+
+class RecordingCursor(object):
+    """
+    Buffers each SELECT's rows so their digest is taken from exactly what
+    the page rendered.
+    """
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+        self.rows = None
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def execute(self, sql, params=None):
+        result = self.cursor.execute(sql, params)
+        self.rows = None
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            rows = self.cursor.fetchall()
+            self.recorder.record(sql, params, rows)
+            self.rows = iter(rows)
+        else:
+            self.recorder.cacheable = False
+        return result
+
+    def executemany(self, sql, param_list):
+        self.recorder.cacheable = False
+        return self.cursor.executemany(sql, param_list)
+
+    def fetchone(self):
+        if self.rows is None:
+            return self.cursor.fetchone()
+        return next(self.rows, None)
+
+    def fetchmany(self, size=None):
+        if self.rows is None:
+            return self.cursor.fetchmany(size)
+        size = size or self.cursor.arraysize
+        return [row for _, row in zip(xrange(size), self.rows)]
+
+    def fetchall(self):
+        if self.rows is None:
+            return self.cursor.fetchall()
+        return list(self.rows)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class Recorder(object):
+    def __init__(self):
+        self.queries = []
+        self.digest = hashlib.md5()
+        self.cacheable = True
+
+    def record(self, sql, params, rows):
+        self.queries.append((sql, None if params is None else list(params)))
+        self.digest.update(repr((sql, rows)))
+
+    def __enter__(self):
+        db = connections[DEFAULT_DB_ALIAS]
+        self.saved = db.use_debug_cursor
+        db.use_debug_cursor = True
+        db.make_debug_cursor = lambda cursor: RecordingCursor(
+            util.CursorWrapper(cursor, db), self)
+        return self
+
+    def __exit__(self, *exc_info):
+        db = connections[DEFAULT_DB_ALIAS]
+        db.use_debug_cursor = self.saved
+        del db.make_debug_cursor
+
+
+def replayDigest(queries):
+    digest = hashlib.md5()
+    cursor = connection.cursor()
+    for sql, params in queries:
+        cursor.execute(sql, params)
+        digest.update(repr((sql, cursor.fetchall())))
+    return digest.hexdigest()
+
+
+# rendering, run in worker processes
+
+_client = None
+
+def renderPage(task):
+    """
+    (url, previous manifest entry or None) -> (url, status, entry, content).
+    ``status`` is 'skipped' if the replayed digest still matches, in which
+    case ``content`` is None.
+    """
+    global _client
+    url, previous = task
+    if previous and previous['cacheable'] and \
+            replayDigest(previous['queries']) == previous['digest']:
+        return url, 'skipped', previous, None
+
+    if _client is None:
+        _client = Client(HTTP_HOST='localhost')
+    # cache hits would hide the queries the page depends on
+    with override_settings(PRIME_CACHE_TIMEOUT=0), Recorder() as recorder:
+        response = _client.get(url)
+    content = response.content if response.status_code == 200 else None
+    entry = {
+        'status': response.status_code,
+        'queries': recorder.queries,
+        'digest': recorder.digest.hexdigest(),
+        'cacheable': recorder.cacheable and
+                     response.status_code in (200, 301, 302),
+        'links': ['%s?page=%s' % (url.partition('?')[0], page)
+                  for page in sorted(set(PAGE_LINK.findall(content or '')))],
+    }
+    return url, 'rendered', entry, content
+
+
+class Exporter(object):
+    def __init__(self, target, processes=None, full=False):
+        self.target = target
+        self.processes = processes or multiprocessing.cpu_count()
+        self.full = full
+        self.manifest_path = os.path.join(target, MANIFEST_NAME)
+
+    def loadManifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if manifest.get('templates') != templatesSignature():
+            return {}
+        return manifest['pages']
+
+    def saveManifest(self, pages):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({'templates': templatesSignature(), 'pages': pages}, f,
+                      cls=DjangoJSONEncoder)
+        os.rename(self.manifest_path + '.tmp', self.manifest_path)
+
+    def write(self, url, content):
+        path = outputPath(self.target, url)
+        if path is None:
+            return False
+        if content is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return True
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.rename(path + '.tmp', path)
+        return True
+
+    def run(self):
+        """
+        Exports every page and returns a dict of counts.
+        """
+        if not os.path.isdir(self.target):
+            os.makedirs(self.target)
+        previous = {} if self.full else self.loadManifest()
+        pages = {}
+        counts = dict.fromkeys(['rendered', 'skipped', 'removed', 'errors'],
+                               0)
+
+        pool = None
+        if self.processes > 1:
+            # each worker opens its own connection
+            connection.close()
+            pool = multiprocessing.Pool(self.processes)
+        mapper = pool.imap_unordered if pool else map
+        try:
+            batch = seedURLs()
+            while batch:
+                tasks = [(url, previous.get(url)) for url in batch]
+                found = set()
+                for url, status, entry, content in mapper(renderPage, tasks):
+                    pages[url] = entry
+                    if entry['status'] not in (200, 301, 302):
+                        counts['errors'] += 1
+                    elif status == 'rendered' and \
+                            not self.write(url, content):
+                        counts['errors'] += 1
+                    counts[status] += 1
+                    found.update(entry['links'])
+                batch = sorted(found - set(pages))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        for url in set(previous) - set(pages):
+            path = outputPath(self.target, url)
+            if path and os.path.exists(path):
+                os.remove(path)
+            counts['removed'] += 1
+        self.saveManifest(pages)
+        return counts
@@ -0,0 +1,230 @@
+"""
+Sitemaps and Atom/RSS feeds for prime.
+
+``/prime/sitemap.xml`` is a sitemap index pointing at one sitemap per
+section (``SECTIONS``), split into files of ``SITEMAP_LIMIT`` URLs, so
+crawlers reach every issue, piece, tag and neighborhood without walking the
+paginated listings. Rows are read as plain values in pk-ordered chunks and
+written out as they come.
+
+Feeds (``FEED_LENGTH`` latest pieces) exist for everything and per content
+type under ``/prime/feeds/``, and per issue at ``/prime/issue/<slug>/feed``,
+each as ``.atom`` and ``.rss``.
+
+Every document is streamed and kept in the cache once complete, under the
+prime content generation (see ``prime.caching``), so it is built again only
+after content changes.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.utils.html import escape
+
+from main import metrics
+from prime import caching
+from prime.models import Issue, FeedEntry, RecipeTag, DIYTag, Neighborhood
+
+# URLs per sitemap file; the protocol allows 50,000, but a file this size
+# stays well under memcached's 1 MB item limit
+SITEMAP_LIMIT = 5000
+FEED_LENGTH = 50
+CHUNK = 1000
+
+SITEMAP_TYPE = 'application/xml; charset=utf-8'
+FEED_TYPES = {
+    'atom': 'application/atom+xml; charset=utf-8',
+    'rss': 'application/rss+xml; charset=utf-8',
+}
+FEED_TITLES = {
+    'all': 'prime',
+    'article': 'prime articles',
+    'recipe': 'prime recipes',
+    'diy': 'prime DIY',
+}
+
+# listings that are not in any other section
+PAGES = ('root', 'prime_recipe', 'prime_diy', 'cityguides_view',
+         'prime_past_issues')
+
+# name, queryset, fields, (*fields) -> (URL name, args, lastmod)
+SECTIONS = (
+    ('issues', Issue.objects.all(), ('slug', 'release_date'),
+     lambda slug, released: ('prime_issue', [slug], released)),
+    ('articles', FeedEntry.objects.filter(kind='article',
+                                          issue__isnull=False),
+     ('issue__slug', 'slug', 'pub_date'),
+     lambda issue, slug, published: ('prime_article', [issue, slug],
+                                     published)),
+    ('recipes', FeedEntry.objects.filter(kind='recipe'),
+     ('slug', 'pub_date'),
+     lambda slug, published: ('prime_recipes', [slug], published)),
+    ('diy', FeedEntry.objects.filter(kind='diy'), ('slug', 'pub_date'),
+     lambda slug, published: ('prime_diys', [slug], published)),
+    ('recipe-tags', RecipeTag.objects.all(), ('name',),
+     lambda name: ('prime_recipe_tag', [name], None)),
+    ('diy-tags', DIYTag.objects.all(), ('name',),
+     lambda name: ('prime_diy_tag', [name], None)),
+    ('neighborhoods', Neighborhood.objects.all(), ('slug',),
+     lambda slug: ('cityguide_view', [slug], None)),
+)
+
+
+def chunked(queryset, fields, offset=0, limit=None):
+    """
+    ``fields`` of the rows of ``queryset`` in pk order, from the
+    ``offset``th on, fetched ``CHUNK`` at a time by primary key range.
+    """
+    start = queryset.order_by('pk').values_list('pk', flat=True)[
+        offset:offset + 1] if offset else [0]
+    if not start:
+        return
+    last, count, inclusive = start[0], 0, bool(offset)
+    while limit is None or count < limit:
+        size = CHUNK if limit is None else min(CHUNK, limit - count)
+        rows = queryset.filter(**{'pk__gte' if inclusive else 'pk__gt': last})\
+                       .order_by('pk').values_list('pk', *fields)[:size]
+        rows = list(rows)
+        for row in rows:
+            yield row[1:]
+        count += len(rows)
+        if len(rows) < size:
+            return
+        last, inclusive = rows[-1][0], False
+
+
+# caching and streaming
+
+def keeping(chunks, key):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(parts), settings.PRIME_CACHE_TIMEOUT)
+
+def cachedStream(request, content_type, chunks):
+    """
+    A response streaming ``chunks()``, or what it produced the last time if
+    content has not changed since.
+    """
+    if not caching.enabled():
+        return StreamingHttpResponse(chunks(), content_type=content_type)
+    key = 'prime:feed:%s:%s' % (caching.generation(), hashlib.md5(
+        request.build_absolute_uri()).hexdigest())
+    content = cache.get(key)
+    metrics.inc('cache_requests_total', cache='feed',
+                result='miss' if content is None else 'hit')
+    if content is not None:
+        return HttpResponse(content, content_type=content_type)
+    return StreamingHttpResponse(keeping(chunks(), key),
+                                 content_type=content_type)
+
+
+# sitemaps
+
+def section(name):
+    for section in SECTIONS:
+        if section[0] == name:
+            return section
+    return None
+
+def pageCount(name):
+    if name == 'pages':
+        return 1
+    count = section(name)[1].count()
+    return max(1, (count + SITEMAP_LIMIT - 1) // SITEMAP_LIMIT)
+
+def sitemapIndex(base):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex '
+           'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    for name in ('pages',) + tuple(section[0] for section in SECTIONS):
+        yield ''.join('<sitemap><loc>%s%s</loc></sitemap>\n' % (
+            base, escape(reverse('prime_sitemap_section',
+                                 args=[name, page])))
+            for page in xrange(1, pageCount(name) + 1))
+    yield '</sitemapindex>\n'
+
+def sitemapURLs(name, page):
+    """
+    (path, lastmod or None) of page ``page`` of sitemap section ``name``.
+    """
+    if name == 'pages':
+        for url_name in PAGES:
+            yield reverse(url_name), None
+        return
+    _, queryset, fields, target = section(name)
+    for row in chunked(queryset, fields, (page - 1) * SITEMAP_LIMIT,
+                       SITEMAP_LIMIT):
+        url_name, args, lastmod = target(*row)
+        yield reverse(url_name, args=args), lastmod
+
+def sitemap(base, name, page):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n<urlset '
+           'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+    parts = []
+    for path, lastmod in sitemapURLs(name, page):
+        parts.append('<url><loc>%s%s</loc>%s</url>\n' % (
+            base, escape(path), '<lastmod>%s</lastmod>' %
+            lastmod.isoformat() if lastmod else ''))
+        if len(parts) == CHUNK:
+            yield ''.join(parts)
+            parts = []
+    yield ''.join(parts) + '</urlset>\n'
+
+
+# feeds
+
+def feedEntries(kind=None, issue=None):
+    entries = FeedEntry.objects.filter(pub_date__isnull=False)\
+                               .select_related('issue')
+    if issue is not None:
+        return entries.filter(issue=issue).order_by('position', 'id')
+    if kind != 'all':
+        entries = entries.filter(kind=kind)
+    return entries[:FEED_LENGTH]
+
+def atom(base, title, link, self_link, entries):
+    entries = list(entries)
+    updated = max([entry.pub_date for entry in entries] or [None])
+    yield (u'<?xml version="1.0" encoding="utf-8"?>\n'
+           u'<feed xmlns="http://www.w3.org/2005/Atom">\n'
+           u'<title>%s</title>\n<link href="%s%s" rel="alternate"/>\n'
+           u'<link href="%s%s" rel="self"/>\n<id>%s%s</id>\n'
+           u'%s<author><name>Daily Bruin</name></author>\n' % (
+               escape(title), base, escape(link), base, escape(self_link),
+               base, escape(self_link), '<updated>%s</updated>\n' %
+               rfc3339_date(updated) if updated else '')).encode('utf-8')
+    for entry in entries:
+        url = base + escape(entry.get_absolute_url())
+        yield (u'<entry><title>%s</title><link href="%s" rel="alternate"/>'
+               u'<id>%s</id><updated>%s</updated><summary>%s</summary>'
+               u'</entry>\n' % (escape(entry.title), url, url,
+                                rfc3339_date(entry.pub_date),
+                                escape(entry.teaser))).encode('utf-8')
+    yield '</feed>\n'
+
+def rss(base, title, link, self_link, entries):
+    entries = list(entries)
+    updated = max([entry.pub_date for entry in entries] or [None])
+    yield (u'<?xml version="1.0" encoding="utf-8"?>\n'
+           u'<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">'
+           u'\n<channel><title>%s</title><link>%s%s</link>'
+           u'<description>%s from the Daily Bruin</description>'
+           u'<atom:link href="%s%s" rel="self"/>%s\n' % (
+               escape(title), base, escape(link), escape(title), base,
+               escape(self_link), '<lastBuildDate>%s</lastBuildDate>' %
+               rfc2822_date(updated) if updated else '')).encode('utf-8')
+    for entry in entries:
+        url = base + escape(entry.get_absolute_url())
+        yield (u'<item><title>%s</title><link>%s</link>'
+               u'<guid isPermaLink="true">%s</guid><pubDate>%s</pubDate>'
+               u'<description>%s</description></item>\n' % (
+                   escape(entry.title), url, url,
+                   rfc2822_date(entry.pub_date),
+                   escape(entry.teaser))).encode('utf-8')
+    yield '</channel></rss>\n'
+
+FEED_WRITERS = {'atom': atom, 'rss': rss}
@@ -0,0 +1,538 @@
+"""
+Bulk import of a whole issue from markdown files and images.
+
+The source is a directory or a zip of one. ``issue.md`` (which may sit in a
+top-level folder of the zip) describes the issue; every other ``.md`` file
+beside or below it is one piece::
+
+    ---
+    type: recipe
+    title: Ramen in twenty minutes
+    authors: Alex Chen, Sam Lee
+    tags: dinner, quick
+    lead_photo: photos/ramen.jpg
+    teaser: Better than the dining hall's.
+    ---
+    Start with the broth.
+
+    ![Simmer it slowly](photos/broth.jpg "left")
+
+Front matter is ``key: value`` lines; ``authors`` and ``tags`` are comma
+separated. Local images in the body become ``Image`` rows and their
+references ``[imgN display]`` shortcodes (the quoted title is the display,
+``right`` by default); image paths are relative to the markdown file.
+
+Everything is checked before anything is written. Images are then copied
+into ``MEDIA_ROOT``, resized as the admin would and given their previews in
+a process pool, and the rows are created with ``bulk_create`` in one
+transaction. Bulk inserts skip the save signals, so the importer updates
+feed entries, search, suggestions and the page cache itself.
+"""
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import zipfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.text import slugify
+
+from main.models import Author
+from prime.models import Issue, Article, Recipe, DIYarticle, Image, \
+    RecipeTag, DIYTag, FeedEntry, buildByline, imagePreview, resizeImage
+
+ISSUE_FILE = 'issue.md'
+FRONT_MATTER = re.compile(r'\A---[ \t]*\r?\n(.*?)^---[ \t]*\r?\n?',
+                          re.M | re.S)
+IMAGE_REFERENCE = re.compile(r'!\[(?P<caption>[^\]]*)\]\((?P<src>[^)\s]+)'
+                             r'(?:\s+"(?P<display>[^"]*)")?\)')
+ISSUE_KEYS = ('name', 'slug', 'release_date', 'header_image')
+PIECE_KEYS = ('type', 'title', 'slug', 'teaser', 'authors', 'tags',
+              'lead_photo', 'photographer', 'position', 'redirect')
+TYPES = {
+    'article': (Article, None),
+    'recipe': (Recipe, RecipeTag),
+    'diy': (DIYarticle, DIYTag),
+}
+CHUNK = 500
+
+
+class IssueImportError(Exception):
+    pass
+
+
+def parseFrontMatter(text):
+    """
+    ({key: value}, body) of a markdown file with front matter.
+    """
+    match = FRONT_MATTER.match(text)
+    if match is None:
+        return {}, text
+    fields = {}
+    for line in match.group(1).splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        key, separator, value = line.partition(':')
+        if not separator:
+            raise ValueError("%r is not a key: value line." % line)
+        fields[key.strip().lower()] = value.strip()
+    return fields, text[match.end():]
+
+def splitList(value):
+    return [item.strip() for item in (value or '').split(',')
+            if item.strip()]
+
+def isLocal(src):
+    return '://' not in src and not src.startswith(('/', 'data:'))
+
+
+class Source(object):
+    """
+    The files of a directory or zip, as posix paths relative to the folder
+    holding ``issue.md``.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.is_zipfile(path)
+        if self.archive:
+            with zipfile.ZipFile(path) as archive:
+                members = [name for name in archive.namelist()
+                           if not name.endswith('/')]
+        elif os.path.isdir(path):
+            members = []
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    members.append(os.path.relpath(
+                        os.path.join(root, name), path).replace(os.sep, '/'))
+        else:
+            raise IssueImportError("%s is neither a directory nor a zip."
+                                   % path)
+        found = sorted((name for name in members
+                        if posixpath.basename(name) == ISSUE_FILE),
+                       key=lambda name: name.count('/'))
+        if not found:
+            raise IssueImportError("No %s in %s." % (ISSUE_FILE, path))
+        self.root = posixpath.dirname(found[0])
+        prefix = self.root + '/' if self.root else ''
+        self.members = dict((name[len(prefix):], name) for name in members
+                            if name.startswith(prefix))
+
+    def names(self):
+        return sorted(self.members)
+
+    def read(self, name):
+        if self.archive:
+            with zipfile.ZipFile(self.path) as archive:
+                return archive.read(self.members[name])
+        with open(os.path.join(self.path, self.members[name]), 'rb') as f:
+            return f.read()
+
+    def task(self, name):
+        """
+        What a worker process needs to open ``name``.
+        """
+        return self.path, self.archive, self.members[name]
+
+
+# image processing, run in worker processes
+
+_archives = {}
+
+def copyMember(source, target):
+    path, archive, member = source
+    if archive:
+        if path not in _archives:
+            _archives[path] = zipfile.ZipFile(path)
+        stream = _archives[path].open(member)
+    else:
+        stream = open(os.path.join(path, member), 'rb')
+    try:
+        with open(target, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+    finally:
+        stream.close()
+
+def processImage(task):
+    """
+    (source, target name, resize) -> (target name, width, height,
+    preview, error). Copies the image into ``MEDIA_ROOT``, shrinks it as
+    ``Image.save`` does if asked to and computes its preview.
+    """
+    source, name, resize = task
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        copyMember(source, path)
+        if resize:
+            resizeImage(path)
+        width, height, preview = imagePreview(path)
+    except (IOError, SyntaxError, zipfile.BadZipfile) as error:
+        return name, None, None, '', str(error) or error.__class__.__name__
+    return name, width, height, preview, None
+
+
+class Importer(object):
+    def __init__(self, path, processes=None, log=None):
+        self.source = Source(path)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.log = log or (lambda message: None)
+        # (source name, resized) -> target name
+        self.images = {}
+        self.reserved = set()
+        self.written = []
+
+    # planning
+
+    def text(self, name):
+        try:
+            return self.source.read(name).decode('utf-8')
+        except UnicodeDecodeError:
+            raise IssueImportError("%s is not UTF-8." % name)
+
+    def parse(self, name, keys):
+        try:
+            fields, body = parseFrontMatter(self.text(name))
+        except ValueError as error:
+            raise IssueImportError("%s: %s" % (name, error))
+        unknown = set(fields) - set(keys)
+        if unknown:
+            raise IssueImportError("%s: unknown field %s." % (
+                name, ', '.join(sorted(unknown))))
+        return fields, body
+
+    def targetName(self, directory, filename):
+        """
+        A free name for ``filename`` under ``directory`` in ``MEDIA_ROOT``,
+        also unique within this import.
+        """
+        root, extension = posixpath.splitext(filename)
+        name = posixpath.join(directory, filename)
+        count = 0
+        while name in self.reserved or default_storage.exists(name):
+            count += 1
+            name = posixpath.join(directory, '%s_%d%s' % (root, count,
+                                                          extension))
+        self.reserved.add(name)
+        return name
+
+    def addImage(self, name, reference, directory, resize):
+        """
+        Plans the copy of ``reference`` (relative to markdown file
+        ``name``) into ``directory``; returns its target name.
+        """
+        source_name = posixpath.normpath(posixpath.join(
+            posixpath.dirname(name), reference))
+        if source_name not in self.source.members:
+            raise IssueImportError("%s: %s is not in the import." % (
+                name, reference))
+        if (source_name, resize) not in self.images:
+            self.images[source_name, resize] = self.targetName(
+                directory, posixpath.basename(source_name))
+        return self.images[source_name, resize]
+
+    def planIssue(self):
+        fields, _ = self.parse(ISSUE_FILE, ISSUE_KEYS)
+        slug = fields.get('slug') or slugify(fields.get('name', u''))
+        issue = Issue.objects.filter(slug=slug).first()
+        if issue is not None:
+            # content is added to it; its own fields stay as they are
+            return issue
+        try:
+            release_date = datetime.strptime(fields.get('release_date', ''),
+                                             '%Y-%m-%d').date()
+        except ValueError:
+            raise IssueImportError("%s: release_date must be YYYY-MM-DD." %
+                                   ISSUE_FILE)
+        issue = Issue(name=fields.get('name', ''), slug=slug,
+                      release_date=release_date)
+        if fields.get('header_image'):
+            issue.header_image = self.addImage(
+                ISSUE_FILE, fields['header_image'],
+                'prime/%s/header' % slug, False)
+        self.validate(ISSUE_FILE, issue)
+        return issue
+
+    def planPiece(self, name, issue, position):
+        fields, body = self.parse(name, PIECE_KEYS)
+        kind = fields.get('type', 'article').lower()
+        if kind not in TYPES:
+            raise IssueImportError("%s: type must be one of %s." % (
+                name, ', '.join(sorted(TYPES))))
+        model, tag_model = TYPES[kind]
+        if not fields.get('lead_photo'):
+            raise IssueImportError("%s: lead_photo is required." % name)
+        if fields.get('tags') and tag_model is None:
+            raise IssueImportError("%s: only recipes and DIY have tags." %
+                                   name)
+        title = fields.get('title', '')
+        lead_directory = model._meta.get_field('lead_photo')\
+            .generate_filename(model(issue=issue), '')
+        try:
+            position = int(fields.get('position', position))
+        except ValueError:
+            raise IssueImportError("%s: position must be a number." % name)
+        instance = model(
+            title=title, slug=fields.get('slug') or slugify(title),
+            teaser=fields.get('teaser', ''), redirect=fields.get('redirect',
+                                                                 ''),
+            position=position,
+            lead_photo=self.addImage(name, fields['lead_photo'],
+                                     lead_directory.rstrip('/'), False))
+
+        images = []
+        for match in IMAGE_REFERENCE.finditer(body):
+            if isLocal(match.group('src')):
+                images.append(self.addImage(
+                    name, match.group('src'),
+                    'prime/%s/article' % issue.slug, True))
+        self.validate(name, instance)
+        return {
+            'name': name, 'model': model, 'instance': instance,
+            'body': body, 'images': images,
+            'authors': [self.authorName(name, author)
+                        for author in splitList(fields.get('authors'))],
+            'photographer': self.authorName(name, fields['photographer'])
+                            if fields.get('photographer') else None,
+            'tag_model': tag_model, 'tags': splitList(fields.get('tags')),
+        }
+
+    def authorName(self, name, author):
+        first, _, last = author.rpartition(' ')
+        if not first or len(first) > 32 or len(last) > 32:
+            raise IssueImportError("%s: %r is not a first and last name." %
+                                   (name, author))
+        return first, last
+
+    def validate(self, name, instance):
+        try:
+            instance.full_clean(exclude=['issue', 'author', 'tag'])
+        except ValidationError as error:
+            raise IssueImportError("%s: %s" % (name, '; '.join(
+                '%s: %s' % (field, ' '.join(messages))
+                for field, messages in sorted(error.message_dict.items()))))
+
+    def checkSlugs(self, issue, pieces):
+        seen = set()
+        for piece in pieces:
+            model, slug = piece['model'], piece['instance'].slug
+            # recipe and DIY URLs have no issue in them
+            existing = model.objects.filter(slug=slug)
+            if model is Article:
+                existing = existing.filter(issue__slug=issue.slug)
+            if (model, slug) in seen or existing.exists():
+                raise IssueImportError("%s: slug %s is already taken." % (
+                    piece['name'], slug))
+            seen.add((model, slug))
+
+    # writing
+
+    def processImages(self):
+        tasks = [(self.source.task(source_name), name, resize)
+                 for (source_name, resize), name
+                 in sorted(self.images.items())]
+        for directory in set(posixpath.dirname(name) for _, name, _ in tasks):
+            path = os.path.join(settings.MEDIA_ROOT, directory)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        # removed again if anything fails; the names were free before
+        self.written = [name for _, name, _ in tasks]
+        pool = None
+        if self.processes > 1 and len(tasks) > 1:
+            # workers only touch files, never the database connection
+            pool = multiprocessing.Pool(min(self.processes, len(tasks)))
+        mapper = pool.imap_unordered if pool else map
+        results = {}
+        try:
+            for name, width, height, preview, error in mapper(processImage,
+                                                              tasks):
+                if error:
+                    raise IssueImportError("%s: %s" % (name, error))
+                results[name] = (width, height, preview)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+            for archive in _archives.values():
+                archive.close()
+            _archives.clear()
+        self.log("%6d images processed" % len(results))
+        return results
+
+    def bulk(self, model, objects, fields):
+        """
+        Inserts ``objects`` and returns their primary keys in order
+        (bulk_create does not set them on PostgreSQL). The rows are found
+        again by ``fields``, which tell them apart, so rows others insert
+        meanwhile are never mistaken for them.
+        """
+        model.objects.bulk_create(objects, batch_size=CHUNK)
+        keys = [tuple(unicode(getattr(instance, field)) for field in fields)
+                for instance in objects]
+        pks = {}
+        for start in xrange(0, len(keys), CHUNK):
+            chunk = keys[start:start + CHUNK]
+            rows = model.objects.filter(**dict(
+                ('%s__in' % field, set(key[i] for key in chunk))
+                for i, field in enumerate(fields)))
+            # the newest row of a key is the one just inserted
+            for row in rows.order_by('pk').values_list('pk', *fields):
+                pks[tuple(unicode(value) for value in row[1:])] = row[0]
+        return [pks[key] for key in keys]
+
+    def authors(self, names):
+        """
+        {(first, last): Author}, creating the ones that do not exist yet.
+        """
+        found = {}
+        for author in Author.objects.filter(
+                first_name__in=set(first for first, _ in names),
+                last_name__in=set(last for _, last in names)):
+            found.setdefault((author.first_name, author.last_name), author)
+        missing = sorted(set(names) - set(found))
+        for pk, (first, last) in zip(self.bulk(Author, [
+                Author(first_name=first, last_name=last)
+                for first, last in missing], ('first_name', 'last_name')),
+                missing):
+            found[first, last] = Author(pk=pk, first_name=first,
+                                        last_name=last)
+        return found
+
+    def tags(self, tag_model, names):
+        found = dict((tag.name, tag.pk) for tag in
+                     tag_model.objects.filter(name__in=set(names)))
+        missing = sorted(set(names) - set(found))
+        found.update(zip(missing, self.bulk(tag_model, [
+            tag_model(name=name) for name in missing], ('name',))))
+        return found
+
+    def insert(self, issue, pieces, previews):
+        def setPreview(instance, field):
+            width, height, preview = previews[getattr(instance, field).name]
+            setattr(instance, field + '_width', width)
+            setattr(instance, field + '_height', height)
+            setattr(instance, field + '_preview', preview)
+
+        if issue.pk is None:
+            if issue.header_image:
+                setPreview(issue, 'header_image')
+            issue.save()
+        authors = self.authors(
+            [name for piece in pieces for name in piece['authors']] +
+            [piece['photographer'] for piece in pieces
+             if piece['photographer']])
+
+        # one Image row per image file, credited to the first piece using it
+        order = []
+        credit = {}
+        captions = {}
+        for piece in pieces:
+            for match, name in zip(
+                    (match for match in IMAGE_REFERENCE.finditer(
+                        piece['body']) if isLocal(match.group('src'))),
+                    piece['images']):
+                if name not in credit:
+                    order.append(name)
+                    credit[name] = piece['photographer']
+                    captions[name] = match.group('caption')
+        images = []
+        for name in order:
+            image = Image(issue_id=issue.pk, image=name,
+                          caption=captions[name],
+                          author=authors.get(credit[name]))
+            setPreview(image, 'image')
+            images.append(image)
+        image_pks = dict(zip(order, self.bulk(Image, images, ('image',))))
+
+        created = []
+        for model, tag_model in TYPES.values():
+            batch = [piece for piece in pieces if piece['model'] is model]
+            if not batch:
+                continue
+            objects = []
+            for piece in batch:
+                instance = piece['instance']
+                names = iter(piece['images'])
+                instance.body = IMAGE_REFERENCE.sub(
+                    lambda match: self.shortcode(match, names, image_pks),
+                    piece['body'])
+                instance.issue_id = issue.pk
+                instance.byline = buildByline(
+                    [authors[name] for name in piece['authors']])
+                setPreview(instance, 'lead_photo')
+                objects.append(instance)
+            pks = self.bulk(model, objects, ('issue_id', 'slug'))
+            for pk, instance in zip(pks, objects):
+                instance.pk = pk
+            field = model._meta.model_name + '_id'
+            model.author.through.objects.bulk_create([
+                model.author.through(**{field: pk,
+                                        'author_id': authors[name].pk})
+                for pk, piece in zip(pks, batch)
+                for name in piece['authors']], batch_size=CHUNK)
+            if tag_model is not None:
+                tag_pks = self.tags(tag_model, [tag for piece in batch
+                                                for tag in piece['tags']])
+                tag_field = tag_model._meta.model_name + '_id'
+                model.tag.through.objects.bulk_create([
+                    model.tag.through(**{field: pk,
+                                         tag_field: tag_pks[tag]})
+                    for pk, piece in zip(pks, batch)
+                    for tag in piece['tags']], batch_size=CHUNK)
+            created.extend(objects)
+            self.log("%6d %s" % (len(objects),
+                                 unicode(model._meta.verbose_name_plural)))
+
+        for instance in created:
+            instance.issue = issue
+        FeedEntry.objects.bulk_create(
+            [FeedEntry.fromContent(instance) for instance in created],
+            batch_size=CHUNK)
+        return created, len(images)
+
+    def shortcode(self, match, names, image_pks):
+        if not isLocal(match.group('src')):
+            return match.group(0)
+        return '[img%d %s]' % (image_pks[next(names)],
+                               match.group('display') or 'right')
+
+    def run(self):
+        """
+        Imports the issue and returns a dict of counts.
+        """
+        from main import embeds
+        from prime import caching, search, suggest
+        from prime.templatetags.shortcodes import embedsIn
+        issue = self.planIssue()
+        names = [name for name in self.source.names()
+                 if name.endswith('.md') and name != ISSUE_FILE]
+        pieces = [self.planPiece(name, issue, position)
+                  for position, name in enumerate(names)]
+        self.checkSlugs(issue, pieces)
+
+        try:
+            previews = self.processImages()
+            with transaction.atomic():
+                created, images = self.insert(issue, pieces, previews)
+        except:
+            for name in self.written:
+                path = os.path.join(settings.MEDIA_ROOT, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        for instance in created:
+            search.updateDocument(instance)
+        suggest.invalidate()
+        caching.bumpGeneration()
+        if getattr(settings, 'EMBED_FETCH_ON_SAVE', False):
+            embeds.ensure([embed for instance in created
+                           for embed in embedsIn(instance.body)])
+        counts = {'issue': issue.slug, 'images': images}
+        for kind, (model, _) in TYPES.items():
+            counts[kind] = len([instance for instance in created
+                                if type(instance) is model])
+        return counts
@@ -0,0 +1,107 @@
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+SCRIPT = ("import json, sys; "
+          "from prime.management.commands.benchimages import measure; "
+          "print json.dumps(measure(sys.argv[1], sys.argv[2]))")
+
+# name, PIL format, extension, save options
+FORMATS = (
+    ('jpeg', 'JPEG', '.jpg', {'quality': 90}),
+    ('progressive jpeg', 'JPEG', '.jpg', {'quality': 90, 'progressive': True}),
+    ('png', 'PNG', '.png', {}),
+)
+
+
+def measure(mode, path):
+    """
+    Processes the image at ``path`` in this (fresh) interpreter: ``decode``
+    decodes it in full, ``ingest`` runs what saving an upload does. Returns
+    the peak resident memory it took, in kilobytes, and the time.
+    """
+    from PIL import Image as PyImage
+    from prime.models import ImageTooLarge, imagePreview, resizeImage
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    status = 'ok'
+    try:
+        if mode == 'decode':
+            PyImage.open(path).load()
+        else:
+            imagePreview(path)
+            resizeImage(path)
+    except ImageTooLarge:
+        status = 'rejected'
+    return {
+        'status': status,
+        'ms': (time.time() - started) * 1000,
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+        before,
+    }
+
+def generate(path, megapixels, format, options):
+    from PIL import Image as PyImage
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    size = (width, int(megapixels * 1e6 / width))
+    # noise, so the file is as hard to compress as a photo
+    PyImage.effect_noise(size, 40).convert('RGB').save(path, format,
+                                                        **options)
+    return size
+
+
+class Command(NoArgsCommand):
+    help = ("Generates large test photos and reports the peak memory and "
+            "time of decoding each in full against ingesting it as an "
+            "upload is (reduced-size decoding, pixel limit), each in a "
+            "fresh interpreter.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--megapixels', default='12,50',
+                    help='Comma-separated image sizes (default: 12,50).'),
+    )
+
+    def run(self, mode, path):
+        environ = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, '-c', SCRIPT, mode, path],
+                                   stdout=subprocess.PIPE, env=environ)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise CommandError("Measuring %s of %s failed." % (mode, path))
+        return json.loads(output.splitlines()[-1])
+
+    def handle_noargs(self, **options):
+        try:
+            sizes = [float(value) for value in
+                     options['megapixels'].split(',')]
+        except ValueError:
+            raise CommandError("--megapixels takes numbers, e.g. 12,50.")
+        directory = tempfile.mkdtemp()
+        try:
+            self.stdout.write("%-26s %9s %13s %13s %10s" % (
+                'image', 'file', 'decode peak', 'ingest peak', 'ingest'))
+            for megapixels in sizes:
+                for name, format, extension, save_options in FORMATS:
+                    path = os.path.join(directory, 'source' + extension)
+                    size = generate(path, megapixels, format, save_options)
+                    decode = self.run('decode', path)
+                    copy = os.path.join(directory, 'upload' + extension)
+                    shutil.copy(path, copy)
+                    ingest = self.run('ingest', copy)
+                    self.stdout.write("%-26s %6.1f MB %10d KB %10d KB %7d ms%s"
+                                      % ('%s %gMP (%dx%d)' % (
+                                          name, megapixels, size[0], size[1]),
+                                         os.path.getsize(path) / 1048576.0,
+                                         decode['peak_kb'], ingest['peak_kb'],
+                                         ingest['ms'],
+                                         '' if ingest['status'] == 'ok'
+                                         else ' ' + ingest['status']))
+        finally:
+            shutil.rmtree(directory)
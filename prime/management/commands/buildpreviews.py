@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db.models import get_models
+
+from prime.caching import bumpGeneration
+from prime.models import previewFieldNames, refreshPreview
+
+
+class Command(NoArgsCommand):
+    help = ("Stores the size and blurred placeholder of prime images "
+            "uploaded before previews existed. New uploads get theirs when "
+            "saved.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--force', action='store_true', default=False,
+                    help='Recompute previews that already exist.'),
+    )
+
+    def handle_noargs(self, **options):
+        made = missing = 0
+        for model in get_models():
+            if model._meta.app_label != 'prime':
+                continue
+            for name in previewFieldNames(model):
+                queryset = model.objects.exclude(**{name: ''}).exclude(
+                    **{name + '__isnull': True})
+                if not options['force']:
+                    queryset = queryset.filter(**{name + '_preview': ''})
+                for instance in queryset.iterator():
+                    field_file = getattr(instance, name)
+                    refreshPreview(field_file)
+                    if getattr(instance, name + '_preview'):
+                        made += 1
+                    else:
+                        missing += 1
+                        self.stdout.write("unreadable %s" % field_file.name)
+        bumpGeneration()
+        self.stdout.write("Stored %d previews; %d images could not be read."
+                          % (made, missing))
@@ -0,0 +1,23 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from prime import related
+
+
+class Command(NoArgsCommand):
+    help = ("Computes related articles, recipes and DIY pieces with TF-IDF "
+            "cosine similarity. Only changed documents are recomputed unless "
+            "--full is given.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--top', type='int', default=5,
+                    help='Neighbours to keep per document (default: 5).'),
+        make_option('--full', action='store_true', default=False,
+                    help='Recompute every document.'),
+    )
+
+    def handle_noargs(self, **options):
+        changed, recomputed = related.build(top=options['top'],
+                                            full=options['full'])
+        self.stdout.write("%d changed documents, %d neighbour lists "
+                          "recomputed." % (changed, recomputed))
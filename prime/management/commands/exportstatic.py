@@ -0,0 +1,29 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from prime.export import Exporter
+
+
+class Command(BaseCommand):
+    args = '<target directory>'
+    help = ("Renders every prime page to static HTML under the target "
+            "directory. Pages whose source rows are unchanged since the last "
+            "export are skipped unless --full is given.")
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=None,
+                    help='Worker processes (default: one per CPU).'),
+        make_option('--full', action='store_true', default=False,
+                    help='Re-render every page.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: exportstatic %s" % self.args)
+        start = time.time()
+        counts = Exporter(args[0], processes=options['processes'],
+                          full=options['full']).run()
+        self.stdout.write("%(rendered)d rendered, %(skipped)d unchanged, "
+                          "%(removed)d removed, %(errors)d errors" % counts)
+        self.stdout.write("Finished in %.1fs." % (time.time() - start))
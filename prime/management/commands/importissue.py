@@ -0,0 +1,32 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from prime.importer import Importer, IssueImportError
+
+
+class Command(BaseCommand):
+    args = '<directory or zip>'
+    help = ("Imports a whole issue from markdown files with front matter "
+            "and their images (see prime.importer for the layout). Images "
+            "are processed in parallel and the rows created in one "
+            "transaction.")
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', default=None,
+                    help='Image worker processes (default: one per CPU).'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: importissue %s" % self.args)
+        start = time.time()
+        try:
+            counts = Importer(args[0], processes=options['processes'],
+                              log=self.stdout.write).run()
+        except IssueImportError as error:
+            raise CommandError(str(error))
+        self.stdout.write("Imported into %(issue)s: %(article)d articles, "
+                          "%(recipe)d recipes, %(diy)d DIY, %(images)d "
+                          "images" % counts)
+        self.stdout.write("Finished in %.1fs." % (time.time() - start))
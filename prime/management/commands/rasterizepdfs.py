@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from prime import pdfpages
+from prime.caching import bumpGeneration
+from prime.models import PDF
+
+
+class Command(BaseCommand):
+    args = '[<issue slug> ...]'
+    help = ("Renders issue PDFs into per-page images for the print viewer, "
+            "and covers for PDFs without one. Needs poppler-utils. Without "
+            "arguments, every PDF that changed since it was last rendered.")
+    option_list = BaseCommand.option_list + (
+        make_option('--force', action='store_true', default=False,
+                    help='Render PDFs that are already up to date.'),
+    )
+
+    def handle(self, *args, **options):
+        pdfs = PDF.objects.select_related('issue').order_by('issue__slug')
+        if args:
+            pdfs = pdfs.filter(issue__slug__in=args)
+            missing = set(args) - set(pdf.issue.slug for pdf in pdfs)
+            if missing:
+                raise CommandError("No PDF for issue %s." %
+                                   ', '.join(sorted(missing)))
+        rendered = 0
+        for pdf in pdfs:
+            if not options['force'] and pdfpages.upToDate(pdf):
+                continue
+            try:
+                manifest = pdfpages.rasterize(pdf)
+            except pdfpages.RasterizeError as error:
+                raise CommandError(str(error))
+            rendered += 1
+            self.stdout.write("%s: %d pages" % (pdf.issue.slug,
+                                                len(manifest['pages'])))
+        if rendered:
+            bumpGeneration()
+        self.stdout.write("Rendered %d PDFs." % rendered)
@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from prime.caching import bumpGeneration
+from prime.models import FeedEntry, FEED_KINDS
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the prime FeedEntry table from articles, recipes and DIY."
+
+    def handle_noargs(self, **options):
+        with transaction.atomic():
+            FeedEntry.objects.all().delete()
+            for model in FEED_KINDS:
+                entries = [FeedEntry.fromContent(content) for content in
+                           model.objects.select_related('issue')]
+                FeedEntry.objects.bulk_create(entries, batch_size=500)
+        bumpGeneration()
+        self.stdout.write("Indexed %d feed entries." %
+                          FeedEntry.objects.count())
@@ -0,0 +1,12 @@
+from django.core.management.base import NoArgsCommand
+
+from prime import search
+
+
+class Command(NoArgsCommand):
+    help = ("Recomputes the full-text search vectors for every article, "
+            "recipe, DIY and city guide article (e.g. after a bulk load).")
+
+    def handle_noargs(self, **options):
+        search.reindexAll()
+        self.stdout.write("Search index rebuilt.")
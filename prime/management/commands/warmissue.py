@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from prime import caching
+from prime.models import Issue
+
+
+class Command(BaseCommand):
+    args = '<issue slug>'
+    help = ("Pre-renders every page of an issue into the page and fragment "
+            "caches and generates missing image variants, with timings.")
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: warmissue %s" % self.args)
+        try:
+            issue = Issue.objects.get(slug=args[0])
+        except Issue.DoesNotExist:
+            raise CommandError("No issue with slug '%s'." % args[0])
+
+        for name, status in caching.warmImages(issue):
+            self.stdout.write("%-8s %s" % (status, name))
+        total = 0
+        for url, status, hit, seconds, error in caching.warmPages(issue):
+            total += seconds
+            self.stdout.write("%3d %-4s %7.1fms  %s%s" % (
+                status, 'hit' if hit else 'miss', seconds * 1000, url,
+                '  (%s)' % error if error else ''))
+        self.stdout.write("Warmed %s in %.2fs." % (issue, total))
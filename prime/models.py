@@ -1,7 +1,13 @@
+import base64
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.text import slugify
 
-from PIL import Image as PyImage
+# longest side of a placeholder; a few hundred bytes once inlined
+PREVIEW_SIZE = 16
 
 # utility functions
 
@@ -19,6 +25,127 @@ def createUploadPath(directory, same_model=False):
 def getLatestIssue():
     return Issue.objects.latest('release_date')
 
+class ImageTooLarge(IOError):
+    pass
+
+def openImage(source):
+    """
+    Opens the image at ``source``, a path or file, reading only its header.
+    Raises ImageTooLarge beyond ``IMAGE_MAX_PIXELS``, since decoding a
+    small file can take gigabytes (a decompression bomb).
+    """
+    # PIL is only needed when images are uploaded or warmed, not to serve
+    from PIL import Image as PyImage
+    image = PyImage.open(source)
+    limit = getattr(settings, 'IMAGE_MAX_PIXELS', None)
+    if limit and image.size[0] * image.size[1] > limit:
+        raise ImageTooLarge("%dx%d is more than %d pixels." % (
+            image.size[0], image.size[1], limit))
+    return image
+
+def checkImageSize(field_file):
+    """
+    Validator of image fields: rejects uploads over ``IMAGE_MAX_PIXELS``.
+    """
+    if not field_file or getattr(field_file, '_committed', True):
+        return
+    try:
+        openImage(field_file.file)
+    except ImageTooLarge as error:
+        raise ValidationError("This image is too large: %s" % error)
+    except IOError:
+        pass  # left to ImageField's own check
+    finally:
+        field_file.file.seek(0)
+
+def resizeImage(path, size=(500, 1000)):
+    """
+    Shrinks the image at ``path`` in place to fit ``size``. Returns True if
+    it had to be resized.
+    """
+    from PIL import Image as PyImage
+    image = openImage(path)
+    if image.size[0] <= size[0] and image.size[1] <= size[1]:
+        return False
+    # a JPEG is decoded at 1/2, 1/4 or 1/8 scale when that still covers
+    # size, so memory follows the result rather than the upload
+    image.draft(image.mode, size)
+    image.thumbnail(size, PyImage.ANTIALIAS)
+    image.save(path)
+    return True
+
+def previewFields():
+    """
+    Width, height and placeholder (a data URI) of an image field, declared
+    as ``<field>_width, <field>_height, <field>_preview = previewFields()``
+    and filled in whenever a file is uploaded (see ``prime.signals``).
+    """
+    return (models.PositiveIntegerField(null=True, blank=True, editable=False),
+            models.PositiveIntegerField(null=True, blank=True, editable=False),
+            models.TextField(blank=True, editable=False))
+
+_preview_fields = {}
+
+def previewFieldNames(model):
+    """
+    Names of the image fields of ``model`` that have preview fields.
+    """
+    if model not in _preview_fields:
+        names = set(field.name for field in model._meta.fields)
+        _preview_fields[model] = [
+            field.name for field in model._meta.fields
+            if isinstance(field, models.ImageField) and
+            field.name + '_preview' in names]
+    return _preview_fields[model]
+
+def imagePreview(source):
+    """
+    (width, height, placeholder) for the image at ``source``, a path or a
+    file; the placeholder is a tiny blurred JPEG as a data URI.
+    """
+    from PIL import Image as PyImage, ImageFilter
+    image = openImage(source)
+    width, height = image.size
+    image.draft(image.mode, (PREVIEW_SIZE, PREVIEW_SIZE))
+    image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), PyImage.ANTIALIAS)
+    image = image.convert('RGB').filter(ImageFilter.GaussianBlur(1))
+    buffer = StringIO()
+    image.save(buffer, 'JPEG', quality=40)
+    return width, height, 'data:image/jpeg;base64,%s' % \
+        base64.b64encode(buffer.getvalue())
+
+def setPreview(instance, name, source=None):
+    """
+    Sets the preview fields of image field ``name`` from ``source``, or
+    clears them if there is none or PIL cannot read it.
+    """
+    width = height = None
+    preview = ''
+    if source is not None:
+        try:
+            width, height, preview = imagePreview(source)
+        except (IOError, SyntaxError):
+            pass
+    setattr(instance, name + '_width', width)
+    setattr(instance, name + '_height', height)
+    setattr(instance, name + '_preview', preview)
+
+def refreshPreview(field_file):
+    """
+    Recomputes the preview fields of ``field_file`` from the file on disk,
+    after it was resized or for rows saved before previews existed.
+    """
+    instance, name = field_file.instance, field_file.field.name
+    setPreview(instance, name, field_file.path if field_file else None)
+    fields = (name + '_width', name + '_height', name + '_preview')
+    type(instance).objects.filter(pk=instance.pk).update(
+        **dict((field, getattr(instance, field)) for field in fields))
+    if type(instance) in FEED_KINDS:
+        FeedEntry.sync(instance)
+
+def buildByline(authors):
+    return ' and '.join([unicode(a) for a in authors])
+
 
 # models
 
@@ -28,7 +155,9 @@ class Issue(models.Model):
     release_date = models.DateField()
     get_upload_path = createUploadPath('header', same_model=True)
     header_image = models.ImageField(upload_to=get_upload_path, blank=True,
-                                     null=True)
+                                     null=True, validators=[checkImageSize])
+    header_image_width, header_image_height, header_image_preview = \
+        previewFields()
 
     class Meta:
         ordering = ['release_date']
@@ -41,21 +170,30 @@ class Article(models.Model):
     title = models.CharField(max_length=128)
     slug = models.SlugField(max_length=128)
     get_upload_path = createUploadPath('lead')
-    lead_photo = models.ImageField(upload_to=get_upload_path)
+    lead_photo = models.ImageField(upload_to=get_upload_path,
+                                   validators=[checkImageSize])
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
     teaser = models.CharField(max_length=200)
     author = models.ManyToManyField('main.Author')
+    byline = models.CharField(max_length=255, blank=True, editable=False)
     body = models.TextField(blank=True)
     redirect = models.URLField(blank=True)
     position = models.PositiveIntegerField(default=0)
 
     def getPrettyAuthors(self):
-        return ' and '.join([str(a) for a in self.author])
+        return self.byline
+
+    def updateByline(self):
+        self.byline = buildByline(self.author.all())
+        type(self).objects.filter(pk=self.pk).update(byline=self.byline)
 
     def __unicode__(self):
         return self.title
 
 class Neighborhood(models.Model):
-    lead_photo = models.ImageField(upload_to="prime/cityguides/lead")
+    lead_photo = models.ImageField(upload_to="prime/cityguides/lead",
+                                   validators=[checkImageSize])
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
     title = models.CharField(max_length=128, unique=True)
     intro_body = models.TextField(blank=True)
     slug = models.SlugField(max_length=128)
@@ -65,7 +203,9 @@ class Neighborhood(models.Model):
 class CityGuideArticle(models.Model):
     neighborhood = models.ForeignKey(Neighborhood)
     title = models.CharField(max_length=128)
-    lead_photo = models.ImageField(upload_to="prime/cityguides/neighborhood/")
+    lead_photo = models.ImageField(upload_to="prime/cityguides/neighborhood/",
+                                   validators=[checkImageSize])
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
     option = models.CharField(max_length=256, choices=[('see', 'see'), ('do', 'do'), ('eat', 'eat')])
     body = models.TextField(blank=True)
 
@@ -76,16 +216,23 @@ class Recipe(models.Model):
     title = models.CharField(max_length=128)
     slug = models.SlugField(max_length=128)
     issue = models.ForeignKey(Issue, blank=True, null=True)
-    lead_photo = models.ImageField(upload_to="prime/recipe/lead")
+    lead_photo = models.ImageField(upload_to="prime/recipe/lead",
+                                   validators=[checkImageSize])
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
     teaser = models.TextField(blank=True)
     author = models.ManyToManyField('main.Author')
+    byline = models.CharField(max_length=255, blank=True, editable=False)
     tag = models.ManyToManyField('RecipeTag')
     body = models.TextField(blank=True) #, widget=models.Field.Textarea(attrs={'rows': 40, 'cols': 120}))
     redirect = models.URLField(blank=True)
     position = models.PositiveIntegerField(default=0)
 
     def getPrettyAuthors(self):
-        return ' and '.join([str(a) for a in self.author])
+        return self.byline
+
+    def updateByline(self):
+        self.byline = buildByline(self.author.all())
+        type(self).objects.filter(pk=self.pk).update(byline=self.byline)
 
     def __unicode__(self):
         return self.title
@@ -94,16 +241,23 @@ class DIYarticle(models.Model):
     title = models.CharField(max_length=128)
     slug = models.SlugField(max_length=128)
     issue = models.ForeignKey(Issue, blank=True, null=True)
-    lead_photo = models.ImageField(upload_to="prime/diy/lead")
+    lead_photo = models.ImageField(upload_to="prime/diy/lead",
+                                   validators=[checkImageSize])
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
     teaser = models.TextField(blank=True)
     author = models.ManyToManyField('main.Author')
+    byline = models.CharField(max_length=255, blank=True, editable=False)
     tag = models.ManyToManyField('DIYTag')
     body = models.TextField(blank=True) #, widget=models.Field.Textarea(attrs={'rows': 40, 'cols': 120}))
     redirect = models.URLField(blank=True)
     position = models.PositiveIntegerField(default=0)
 
     def getPrettyAuthors(self):
-        return ' and '.join([str(a) for a in self.author])
+        return self.byline
+
+    def updateByline(self):
+        self.byline = buildByline(self.author.all())
+        type(self).objects.filter(pk=self.pk).update(byline=self.byline)
 
     def __unicode__(self):
         return self.title
@@ -121,9 +275,118 @@ class DIYTag(models.Model):
         return "%s" % (self.name)
 
 
+class FeedEntry(models.Model):
+    """
+    One row per article, recipe and DIY piece, kept in sync on save and
+    delete, so mixed listings are a single indexed query.
+    """
+    KIND_CHOICES = [('article', 'article'), ('recipe', 'recipe'),
+                    ('diy', 'diy')]
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    issue = models.ForeignKey('Issue', null=True, blank=True)
+    position = models.PositiveIntegerField(default=0)
+    title = models.CharField(max_length=128)
+    slug = models.SlugField(max_length=128)
+    teaser = models.TextField(blank=True)
+    lead_photo = models.CharField(max_length=100, blank=True)
+    lead_photo_width, lead_photo_height, lead_photo_preview = previewFields()
+    pub_date = models.DateField(null=True, blank=True)
+    related_signature = models.CharField(max_length=32, blank=True,
+                                         editable=False)
+
+    synced_fields = ['issue', 'position', 'title', 'slug', 'teaser',
+                     'lead_photo', 'lead_photo_width', 'lead_photo_height',
+                     'lead_photo_preview', 'pub_date']
+
+    class Meta:
+        ordering = ['-pub_date', 'position', 'id']
+        unique_together = ('kind', 'object_id')
+        index_together = [['issue', 'position'],
+                          ['pub_date', 'position']]
+
+    @classmethod
+    def fromContent(cls, content):
+        issue = content.issue
+        return cls(kind=FEED_KINDS[type(content)], object_id=content.pk,
+                   issue=issue, position=content.position,
+                   title=content.title, slug=content.slug,
+                   teaser=content.teaser,
+                   lead_photo=content.lead_photo.name or '',
+                   lead_photo_width=content.lead_photo_width,
+                   lead_photo_height=content.lead_photo_height,
+                   lead_photo_preview=content.lead_photo_preview,
+                   pub_date=issue.release_date if issue else None)
+
+    @classmethod
+    def sync(cls, content):
+        entry = cls.fromContent(content)
+        entry.pk = cls.objects.filter(kind=entry.kind,
+                                      object_id=entry.object_id)\
+                              .values_list('pk', flat=True).first()
+        if entry.pk is None:
+            entry.save()
+        else:
+            entry.save(update_fields=cls.synced_fields)
+
+    @classmethod
+    def remove(cls, content):
+        kind = FEED_KINDS[type(content)]
+        cls.objects.filter(kind=kind, object_id=content.pk).delete()
+
+    @models.permalink
+    def get_absolute_url(self):
+        if self.kind == 'recipe':
+            return ('prime_recipes', [self.slug])
+        if self.kind == 'diy':
+            return ('prime_diys', [self.slug])
+        return ('prime_article', [self.issue.slug, self.slug])
+
+    def __unicode__(self):
+        return "%s: %s" % (self.kind, self.title)
+
+FEED_KINDS = {Article: 'article', Recipe: 'recipe', DIYarticle: 'diy'}
+
+class RelatedContent(models.Model):
+    """
+    Precomputed nearest neighbours of a feed entry, written by the
+    ``buildrelated`` command.
+    """
+    entry = models.ForeignKey(FeedEntry, related_name='related')
+    target = models.ForeignKey(FeedEntry, related_name='+', null=True,
+                               on_delete=models.SET_NULL)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['entry', 'rank']
+        index_together = [['entry', 'rank']]
+
+    def __unicode__(self):
+        return "%s -> %s" % (self.entry, self.target)
+
+
+class SuggestChange(models.Model):
+    """
+    A change to the search-as-you-type index (see ``prime.suggest``); every
+    worker applies them to its own copy in order. An entry with no ``kind``
+    was removed, and a change with no ``entry_type`` rebuilds the index.
+    """
+    entry_type = models.CharField(max_length=32, blank=True)
+    entry_pk = models.PositiveIntegerField(null=True, blank=True)
+    label = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=32, blank=True)
+    url = models.CharField(max_length=255, blank=True)
+
+    def __unicode__(self):
+        return "%s %s %s" % (self.pk, self.entry_type, self.entry_pk)
+
+
 class Image(models.Model):
     get_upload_path = createUploadPath('article')
-    image = models.ImageField(upload_to=get_upload_path)
+    image = models.ImageField(upload_to=get_upload_path,
+                              validators=[checkImageSize])
+    image_width, image_height, image_preview = previewFields()
     issue = models.ForeignKey('Issue', default=None, null=True, blank=True)
     author = models.ForeignKey('main.Author', null=True, blank=True)
     caption = models.TextField(blank=True)
@@ -135,12 +398,17 @@ class Image(models.Model):
         self.__original_image = self.image
 
     def save(self, force_insert=False, force_update=False, *args, **kwargs):
-        if self.image != self.__original_image:
-            size = 500, 1000
+        uploaded = self.image and not self.image._committed
+        if uploaded:
+            # refuse an oversized upload before the row or file is stored
+            try:
+                openImage(self.image.file)
+            finally:
+                self.image.file.seek(0)
+        if uploaded or self.image != self.__original_image:
             super(Image, self).save(force_insert, force_update, *args, **kwargs)
-            image = PyImage.open(self.image)
-            image.thumbnail(size, PyImage.ANTIALIAS)
-            image.save(self.image.path)
+            if resizeImage(self.image.path):
+                refreshPreview(self.image)
         else:
             super(Image, self).save(force_insert, force_update, *args, **kwargs)
         self.__original_image = self.image
@@ -153,8 +421,13 @@ class PDF(models.Model):
     get_upload_path_pdf = createUploadPath('pdf')
     get_upload_path_pdf_image = createUploadPath('pdf_image')
     pdf = models.FileField(upload_to=get_upload_path_pdf)
-    image = models.ImageField(upload_to=get_upload_path_pdf_image)
+    # generated from page 1 by rasterizepdfs when left empty
+    image = models.ImageField(upload_to=get_upload_path_pdf_image, blank=True,
+                              validators=[checkImageSize])
+    image_width, image_height, image_preview = previewFields()
     issue = models.OneToOneField(Issue)
 
     def __unicode__(self):
         return "%s PDF" % self.issue
+
+from prime import signals
@@ -0,0 +1,156 @@
+"""
+Issue PDFs as per-page images, for the print viewer.
+
+``rasterizepdfs`` renders every page of an issue's PDF with poppler's
+``pdftoppm``, one page at a time, and writes a JPEG per page at each of
+``SIZES`` into ``prime/<issue>/pages/`` under ``MEDIA_ROOT``, together with
+a ``manifest.json`` listing them. Page 1 also becomes the issue's cover
+(``PDF.image``) unless one was uploaded.
+
+The viewer (``PrintView``) lists the pages with ``srcset`` so the browser
+fetches one suitable size, page 1 first and the rest only as they near the
+viewport. The full PDF stays available as a download.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+
+PDFTOPPM = 'pdftoppm'
+PDFINFO = 'pdfinfo'
+
+# name, width in pixels; the largest is what pdftoppm renders
+SIZES = (('small', 480), ('medium', 960), ('large', 1600))
+COVER_SIZE = 'medium'
+JPEG_QUALITY = 80
+MANIFEST_NAME = 'manifest.json'
+
+
+class RasterizeError(Exception):
+    pass
+
+
+def directory(pdf):
+    """
+    Where the page images of ``pdf`` go, relative to ``MEDIA_ROOT``.
+    """
+    return 'prime/%s/pages' % pdf.issue.slug
+
+def manifestPath(pdf):
+    return os.path.join(settings.MEDIA_ROOT, directory(pdf), MANIFEST_NAME)
+
+def loadManifest(pdf):
+    """
+    The page manifest of ``pdf``, or None if it was never rasterized.
+    """
+    try:
+        with open(manifestPath(pdf)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def upToDate(pdf):
+    manifest = loadManifest(pdf)
+    try:
+        return manifest is not None and \
+            manifest.get('pdf') == pdf.pdf.name and \
+            os.path.getmtime(manifestPath(pdf)) >= \
+            os.path.getmtime(pdf.pdf.path)
+    except OSError:
+        return False
+
+
+def run(command):
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError as error:
+        raise RasterizeError("Cannot run %s (poppler-utils installed?): %s"
+                             % (command[0], error))
+    output, errors = process.communicate()
+    if process.returncode:
+        raise RasterizeError("%s failed: %s" % (command[0], errors.strip()))
+    return output
+
+def pageCount(path):
+    match = re.search(r'^Pages:\s+(\d+)', run([PDFINFO, path]), re.M)
+    if match is None:
+        raise RasterizeError("No page count for %s." % path)
+    return int(match.group(1))
+
+def renderPage(path, number, work):
+    """
+    Renders page ``number`` of the PDF at ``path`` into ``work`` and returns
+    the file's path; it is as wide as the largest of ``SIZES``.
+    """
+    prefix = os.path.join(work, 'page')
+    run([PDFTOPPM, '-f', str(number), '-l', str(number), '-singlefile',
+         '-scale-to-x', str(SIZES[-1][1]), '-scale-to-y', '-1', path,
+         prefix])
+    return prefix + '.ppm'
+
+def writePage(image, number, target):
+    """
+    Saves ``image`` (page ``number``) at every size into the directory
+    ``target`` (relative to ``MEDIA_ROOT``). Returns its manifest entry.
+    """
+    from PIL import Image as PyImage
+    image = image.convert('RGB')
+    entry = {}
+    for name, width in reversed(SIZES):
+        if image.size[0] > width:
+            image = image.resize(
+                (width, int(round(image.size[1] * width / image.size[0]))),
+                PyImage.ANTIALIAS)
+        filename = '%s/%d-%s.jpg' % (target, number, name)
+        image.save(os.path.join(settings.MEDIA_ROOT, filename), 'JPEG',
+                   quality=JPEG_QUALITY, optimize=True, progressive=True)
+        entry[name] = {'src': filename, 'width': image.size[0],
+                       'height': image.size[1]}
+    return entry
+
+def rasterize(pdf, log=None):
+    """
+    Writes the page images and manifest of ``pdf`` and, if it has none, its
+    cover. Returns the manifest.
+    """
+    from PIL import Image as PyImage
+    from prime.models import refreshPreview
+    log = log or (lambda message: None)
+    target = directory(pdf)
+    if not os.path.isdir(os.path.join(settings.MEDIA_ROOT, target)):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, target))
+    work = tempfile.mkdtemp()
+    pages = []
+    try:
+        count = pageCount(pdf.pdf.path)
+        for number in xrange(1, count + 1):
+            # one page at a time keeps disk and memory use to a page
+            rendered = renderPage(pdf.pdf.path, number, work)
+            pages.append(writePage(PyImage.open(rendered), number, target))
+            os.remove(rendered)
+            log("page %d/%d" % (number, count))
+    finally:
+        shutil.rmtree(work)
+    manifest = {'pdf': pdf.pdf.name, 'sizes': [name for name, _ in SIZES],
+                'pages': pages}
+    path = manifestPath(pdf)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.rename(path + '.tmp', path)
+
+    if not pdf.image and pages:
+        type(pdf).objects.filter(pk=pdf.pk).update(
+            image=pages[0][COVER_SIZE]['src'])
+        pdf.image = pages[0][COVER_SIZE]['src']
+        refreshPreview(pdf.image)
+    return manifest
+
+def srcset(page):
+    return ', '.join('%s%s %dw' % (settings.MEDIA_URL, page[name]['src'],
+                                   page[name]['width'])
+                     for name, _ in SIZES if name in page)
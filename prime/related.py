@@ -0,0 +1,184 @@
+"""
+Batch "related content" for articles, recipes and DIY pieces.
+
+Every feed entry becomes a sublinear TF-IDF vector over its title, teaser,
+body and tag names (tags count as distinct, heavier terms), truncated to its
+``MAX_TERMS`` strongest terms. Vectors are held
+as NumPy arrays in CSR and CSC form, so one document's cosine similarity to
+every other document is a handful of vectorized scatter-adds over the
+postings of its terms, and the top k come from ``argpartition``.
+
+Runs are incremental: each entry's text signature is stored on
+``FeedEntry.related_signature``, and only entries whose text changed, whose
+neighbour lists referenced a changed or deleted entry, or that a changed
+entry now outranks a current neighbour of, are recomputed.
+"""
+import hashlib
+import math
+from collections import defaultdict
+
+import numpy
+
+from django.db import transaction
+
+from prime.caching import bumpGeneration
+from prime.models import Article, Recipe, DIYarticle, FeedEntry, \
+    RelatedContent
+from prime.search import tokenize
+
+TAG_WEIGHT = 3
+MAX_TERMS = 64
+
+
+def loadDocuments():
+    """
+    {feed entry id: (signature, [terms])} for every feed entry.
+    """
+    tags = defaultdict(list)
+    for kind, through, field, tag_name in (
+            ('recipe', Recipe.tag.through, 'recipe_id', 'recipetag__name'),
+            ('diy', DIYarticle.tag.through, 'diyarticle_id', 'diytag__name')):
+        for object_id, name in through.objects.values_list(field, tag_name):
+            tags[kind, object_id].append(name)
+
+    entries = dict(((kind, object_id), pk) for pk, kind, object_id in
+                   FeedEntry.objects.values_list('pk', 'kind', 'object_id'))
+    documents = {}
+    for kind, model in (('article', Article), ('recipe', Recipe),
+                        ('diy', DIYarticle)):
+        rows = model.objects.values_list('pk', 'title', 'teaser', 'body')
+        for object_id, title, teaser, body in rows.iterator():
+            if (kind, object_id) not in entries:
+                continue
+            names = sorted(tags[kind, object_id])
+            text = u'\n'.join([title, teaser, body] + names)
+            signature = hashlib.md5(text.encode('utf-8')).hexdigest()
+            terms = tokenize(u' '.join([title, teaser, body]))
+            for name in names:
+                terms.extend(['tag:' + name.lower()] * TAG_WEIGHT)
+            documents[entries[kind, object_id]] = (signature, terms)
+    return documents
+
+
+class Vectors(object):
+    """
+    L2-normalized TF-IDF rows for a fixed list of entry ids.
+    """
+    def __init__(self, ids, term_lists):
+        self.ids = numpy.array(ids)
+        self.row_of = dict((entry_id, row) for row, entry_id in
+                           enumerate(ids))
+        n = len(ids)
+
+        vocabulary = {}
+        counts = []
+        for terms in term_lists:
+            tf = defaultdict(int)
+            for term in terms:
+                tf[vocabulary.setdefault(term, len(vocabulary))] += 1
+            counts.append(tf)
+
+        df = numpy.zeros(len(vocabulary))
+        for tf in counts:
+            df[list(tf)] += 1
+        idf = numpy.log((1.0 + n) / (1.0 + df)) + 1.0
+
+        indptr, indices, data = [0], [], []
+        for tf in counts:
+            columns = numpy.array(list(tf), dtype=int)
+            weights = numpy.array([1 + math.log(count)
+                                   for count in tf.itervalues()])
+            if len(columns):
+                weights *= idf[columns]
+                if len(columns) > MAX_TERMS:
+                    top = numpy.argpartition(-weights, MAX_TERMS)[:MAX_TERMS]
+                    columns, weights = columns[top], weights[top]
+                weights /= numpy.sqrt((weights ** 2).sum())
+            indices.extend(columns)
+            data.extend(weights)
+            indptr.append(len(indices))
+        self.indptr = numpy.array(indptr)
+        self.indices = numpy.array(indices, dtype=int)
+        self.data = numpy.array(data)
+
+        # column-major copy for scatter-adds
+        order = numpy.argsort(self.indices, kind='mergesort')
+        rows = numpy.repeat(numpy.arange(n), numpy.diff(self.indptr))
+        self.col_rows = rows[order]
+        self.col_data = self.data[order]
+        self.col_ptr = numpy.searchsorted(self.indices[order],
+                                          numpy.arange(len(vocabulary) + 1))
+
+    def similarities(self, row):
+        scores = numpy.zeros(len(self.ids))
+        for position in xrange(self.indptr[row], self.indptr[row + 1]):
+            column = self.indices[position]
+            start, end = self.col_ptr[column], self.col_ptr[column + 1]
+            scores[self.col_rows[start:end]] += \
+                self.data[position] * self.col_data[start:end]
+        scores[row] = 0
+        return scores
+
+    def neighbours(self, scores, top):
+        candidates = numpy.flatnonzero(scores)
+        if len(candidates) > top:
+            best = numpy.argpartition(-scores[candidates], top)[:top]
+            candidates = candidates[best]
+        candidates = candidates[numpy.argsort(-scores[candidates],
+                                              kind='mergesort')]
+        return [(int(self.ids[r]), float(scores[r])) for r in candidates]
+
+
+def build(top=5, full=False):
+    documents = loadDocuments()
+    ids = sorted(documents)
+    vectors = Vectors(ids, [documents[i][1] for i in ids])
+
+    stored = dict(FeedEntry.objects.values_list('pk', 'related_signature'))
+    current = defaultdict(list)
+    for entry_id, target_id, score in RelatedContent.objects\
+            .values_list('entry_id', 'target_id', 'score'):
+        current[entry_id].append((target_id, score))
+
+    if full:
+        changed = set(ids)
+    else:
+        changed = set(i for i in ids if documents[i][0] != stored.get(i))
+    affected = set(changed)
+    for entry_id in ids:
+        # deleted targets are nulled out rather than removed
+        if any(target is None or target in changed
+               for target, _ in current.get(entry_id, ())):
+            affected.add(entry_id)
+
+    results = {}
+    for entry_id in changed:
+        scores = vectors.similarities(vectors.row_of[entry_id])
+        results[entry_id] = vectors.neighbours(scores, top)
+        # a changed document may now outrank an unchanged one's neighbours
+        for row in numpy.flatnonzero(scores):
+            other = int(vectors.ids[row])
+            if other in affected:
+                continue
+            neighbours = current[other]
+            if len(neighbours) < top or \
+                    scores[row] > min(score for _, score in neighbours):
+                affected.add(other)
+    for entry_id in affected - changed:
+        scores = vectors.similarities(vectors.row_of[entry_id])
+        results[entry_id] = vectors.neighbours(scores, top)
+
+    with transaction.atomic():
+        RelatedContent.objects.filter(entry__in=list(results)).delete()
+        RelatedContent.objects.bulk_create(
+            [RelatedContent(entry_id=entry_id, target_id=target_id,
+                            rank=rank, score=score)
+             for entry_id, neighbours in results.iteritems()
+             for rank, (target_id, score) in enumerate(neighbours)],
+            batch_size=1000)
+        for entry_id in changed:
+            FeedEntry.objects.filter(pk=entry_id).update(
+                related_signature=documents[entry_id][0])
+    if results:
+        bumpGeneration()
+    return len(changed), len(results)
@@ -0,0 +1,303 @@
+"""
+Full-text search over articles, recipes, DIY and city guide articles.
+
+On PostgreSQL each table carries a weighted ``search_vector`` tsvector column
+with a GIN index (see migration 0011), refreshed on save. Other backends
+(SQLite test runs) use an in-process inverted index with BM25 ranking that is
+built on first use and kept current by the same save/delete signals.
+"""
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+
+from prime.models import Article, Recipe, DIYarticle, CityGuideArticle
+
+SEARCH_CONFIG = 'english'
+
+# kind, model, (field, weight) pairs
+SOURCES = [
+    ('article', Article, [('title', 'A'), ('teaser', 'B'), ('body', 'C')]),
+    ('recipe', Recipe, [('title', 'A'), ('teaser', 'B'), ('body', 'C')]),
+    ('diy', DIYarticle, [('title', 'A'), ('teaser', 'B'), ('body', 'C')]),
+    ('cityguide', CityGuideArticle, [('title', 'A'), ('body', 'C')]),
+]
+KINDS = dict((model, kind) for kind, model, _ in SOURCES)
+FIELDS = dict((model, fields) for _, model, fields in SOURCES)
+PARENTS = {'article': 'issue', 'cityguide': 'neighborhood'}
+
+
+def usePostgres():
+    return connection.vendor == 'postgresql'
+
+def vectorSQL(fields):
+    return ' || '.join(
+        "setweight(to_tsvector('%s', coalesce(%s, '')), '%s')" %
+        (SEARCH_CONFIG, field, weight) for field, weight in fields)
+
+
+class SearchHit(object):
+    def __init__(self, kind, pk, title, teaser, url, rank):
+        self.kind = kind
+        self.pk = pk
+        self.title = title
+        self.teaser = teaser
+        self.url = url
+        self.rank = rank
+
+    def get_absolute_url(self):
+        return self.url
+
+
+def hitURL(kind, slug, parent_slug):
+    if kind == 'article':
+        return reverse('prime_article', args=[parent_slug, slug])
+    if kind == 'recipe':
+        return reverse('prime_recipes', args=[slug])
+    if kind == 'diy':
+        return reverse('prime_diys', args=[slug])
+    return reverse('cityguide_view', args=[parent_slug])
+
+
+class SearchResults(object):
+    """
+    Lazy, sliceable result set so ``Paginator`` only ranks one page.
+    """
+    def __init__(self, query):
+        self.query = query
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            if not self.query:
+                self._count = 0
+            elif usePostgres():
+                self._count = postgresCount(self.query)
+            else:
+                self._count = getIndex().count(self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        offset = key.start or 0
+        limit = (key.stop if key.stop is not None else self.count()) - offset
+        if limit <= 0 or not self.query:
+            return []
+        if usePostgres():
+            return postgresSearch(self.query, offset, limit)
+        return getIndex().search(self.query, offset, limit)
+
+
+def search(query):
+    return SearchResults(query.strip())
+
+
+# PostgreSQL
+
+# articles outside an issue have no page, so the join leaves them out
+UNION_SQL = '''
+    SELECT 'article' AS kind, t.id, t.title, t.teaser, t.slug,
+           i.slug AS parent_slug, ts_rank_cd(t.search_vector, q) AS rank
+    FROM prime_article t JOIN prime_issue i ON i.id = t.issue_id,
+         plainto_tsquery('%(config)s', %%s) q
+    WHERE t.search_vector @@ q
+    UNION ALL
+    SELECT 'recipe', t.id, t.title, t.teaser, t.slug, NULL,
+           ts_rank_cd(t.search_vector, q)
+    FROM prime_recipe t, plainto_tsquery('%(config)s', %%s) q
+    WHERE t.search_vector @@ q
+    UNION ALL
+    SELECT 'diy', t.id, t.title, t.teaser, t.slug, NULL,
+           ts_rank_cd(t.search_vector, q)
+    FROM prime_diyarticle t, plainto_tsquery('%(config)s', %%s) q
+    WHERE t.search_vector @@ q
+    UNION ALL
+    SELECT 'cityguide', t.id, t.title, '', NULL, n.slug,
+           ts_rank_cd(t.search_vector, q)
+    FROM prime_cityguidearticle t
+         JOIN prime_neighborhood n ON n.id = t.neighborhood_id,
+         plainto_tsquery('%(config)s', %%s) q
+    WHERE t.search_vector @@ q
+''' % {'config': SEARCH_CONFIG}
+
+def postgresCount(query):
+    cursor = connection.cursor()
+    cursor.execute('SELECT count(*) FROM (%s) hits' % UNION_SQL, [query] * 4)
+    return cursor.fetchone()[0]
+
+def postgresSearch(query, offset, limit):
+    cursor = connection.cursor()
+    cursor.execute('SELECT * FROM (%s) hits '
+                   'ORDER BY rank DESC, kind, id LIMIT %%s OFFSET %%s'
+                   % UNION_SQL, [query] * 4 + [limit, offset])
+    return [SearchHit(kind, pk, title, teaser,
+                      hitURL(kind, slug, parent_slug), rank)
+            for kind, pk, title, teaser, slug, parent_slug, rank
+            in cursor.fetchall()]
+
+def postgresUpdate(instance):
+    cursor = connection.cursor()
+    cursor.execute('UPDATE %s SET search_vector = %s WHERE id = %%s' %
+                   (instance._meta.db_table,
+                    vectorSQL(FIELDS[type(instance)])), [instance.pk])
+
+
+# in-process fallback
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset('a an and are as at be by for from in is it of on or '
+                      'that the this to was with'.split())
+WEIGHTS = {'A': 3, 'B': 2, 'C': 1}
+
+def tokenize(text):
+    return [t for t in TOKEN.findall((text or '').lower())
+            if t not in STOPWORDS]
+
+
+class InvertedIndex(object):
+    """
+    term -> {doc key: weighted term frequency}, ranked with BM25.
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.terms = {}
+        self.lengths = {}
+        self.docs = {}
+        self.total_length = 0
+
+    def add(self, key, weighted_texts, doc):
+        self.remove(key)
+        counts = defaultdict(int)
+        for text, weight in weighted_texts:
+            for term in tokenize(text):
+                counts[term] += WEIGHTS[weight]
+        for term, tf in counts.iteritems():
+            self.postings[term][key] = tf
+        self.terms[key] = list(counts)
+        length = sum(counts.itervalues())
+        self.lengths[key] = length
+        self.total_length += length
+        self.docs[key] = doc
+
+    def remove(self, key):
+        if key not in self.docs:
+            return
+        for term in self.terms.pop(key):
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(key)
+        del self.docs[key]
+
+    def matches(self, query):
+        terms = tokenize(query)
+        if not terms:
+            return terms, set()
+        keys = set(self.postings.get(terms[0], ()))
+        for term in terms[1:]:
+            keys &= set(self.postings.get(term, ()))
+        return terms, keys
+
+    def count(self, query):
+        return len(self.matches(query)[1])
+
+    def search(self, query, offset, limit):
+        terms, keys = self.matches(query)
+        n = len(self.docs)
+        average = float(self.total_length) / n if n else 0
+        scores = []
+        for key in keys:
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[key] /
+                              average)
+            for term in terms:
+                postings = self.postings[term]
+                idf = math.log(1 + (n - len(postings) + 0.5) /
+                               (len(postings) + 0.5))
+                tf = postings[key]
+                score += idf * tf * (self.k1 + 1) / (tf + norm)
+            scores.append((-score, key))
+        scores.sort()
+        hits = []
+        for score, key in scores[offset:offset + limit]:
+            kind, pk = key
+            title, teaser, slug, parent_slug = self.docs[key]
+            hits.append(SearchHit(kind, pk, title, teaser,
+                                  hitURL(kind, slug, parent_slug), -score))
+        return hits
+
+_index = None
+_index_lock = threading.Lock()
+
+def listed(instance):
+    """
+    False for articles outside an issue, which have no page to link to.
+    """
+    return not isinstance(instance, Article) or bool(instance.issue_id)
+
+def documentFor(instance):
+    kind = KINDS[type(instance)]
+    texts = [(getattr(instance, field), weight)
+             for field, weight in FIELDS[type(instance)]]
+    parent = PARENTS.get(kind)
+    parent_slug = None
+    if parent and getattr(instance, parent + '_id'):
+        parent_slug = getattr(instance, parent).slug
+    doc = (instance.title, getattr(instance, 'teaser', ''),
+           getattr(instance, 'slug', None), parent_slug)
+    return (kind, instance.pk), texts, doc
+
+def getIndex():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = InvertedIndex()
+                for kind, model, _ in SOURCES:
+                    queryset = model.objects.all()
+                    if kind in PARENTS:
+                        queryset = queryset.select_related(PARENTS[kind])
+                    for instance in queryset:
+                        if listed(instance):
+                            index.add(*documentFor(instance))
+                _index = index
+    return _index
+
+
+# maintenance, called from prime.signals
+
+def updateDocument(instance):
+    if usePostgres():
+        postgresUpdate(instance)
+    elif _index is not None:
+        with _index_lock:
+            if listed(instance):
+                _index.add(*documentFor(instance))
+            else:
+                _index.remove((KINDS[type(instance)], instance.pk))
+
+def removeDocument(instance):
+    if not usePostgres() and _index is not None:
+        with _index_lock:
+            _index.remove((KINDS[type(instance)], instance.pk))
+
+def reindexAll():
+    global _index
+    if usePostgres():
+        cursor = connection.cursor()
+        for _, model, fields in SOURCES:
+            cursor.execute('UPDATE %s SET search_vector = %s' %
+                           (model._meta.db_table, vectorSQL(fields)))
+    else:
+        _index = None
@@ -0,0 +1,168 @@
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, pre_delete, \
+    post_delete, m2m_changed
+from django.dispatch import receiver
+
+from main.models import Author
+from prime.models import Issue, Article, Recipe, DIYarticle, \
+    CityGuideArticle, Neighborhood, RecipeTag, DIYTag, FeedEntry, \
+    SuggestChange, previewFieldNames, setPreview
+
+BYLINE_MODELS = (Article, Recipe, DIYarticle)
+
+
+# content feed
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=DIYarticle)
+def updateFeedEntry(sender, instance, raw=False, **kwargs):
+    if not raw:
+        FeedEntry.sync(instance)
+
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=DIYarticle)
+def removeFeedEntry(sender, instance, **kwargs):
+    FeedEntry.remove(instance)
+
+@receiver(post_save, sender=Issue)
+def updateFeedDates(sender, instance, raw=False, **kwargs):
+    if not raw:
+        FeedEntry.objects.filter(issue=instance).update(
+            pub_date=instance.release_date)
+
+
+# image previews
+
+@receiver(pre_save)
+def updateImagePreviews(sender, instance, raw=False, **kwargs):
+    if raw or sender._meta.app_label != 'prime':
+        return
+    for name in previewFieldNames(sender):
+        field_file = getattr(instance, name)
+        if not field_file:
+            setPreview(instance, name)
+        elif not field_file._committed:
+            # a new upload, read before the field saves it to storage
+            setPreview(instance, name, field_file.file)
+            field_file.file.seek(0)
+
+
+# embed facades
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=DIYarticle)
+@receiver(post_save, sender=CityGuideArticle)
+@receiver(post_save, sender=Neighborhood)
+def fetchEmbeds(sender, instance, raw=False, **kwargs):
+    from main import embeds
+    from prime.templatetags.shortcodes import embedsIn
+    if raw or not getattr(settings, 'EMBED_FETCH_ON_SAVE', False):
+        return
+    text = instance.intro_body if sender is Neighborhood else instance.body
+    embeds.ensure(embedsIn(text))
+
+
+# bylines
+
+@receiver(m2m_changed, sender=Article.author.through)
+@receiver(m2m_changed, sender=Recipe.author.through)
+@receiver(m2m_changed, sender=DIYarticle.author.through)
+def updateBylines(sender, instance, action, reverse, model, pk_set,
+                  **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.updateByline()
+        return
+    # instance is an Author and model the content model
+    if action == 'pre_clear':
+        instance._bylines_cleared = list(
+            model.objects.filter(author=instance).values_list('pk',
+                                                              flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            pk_set = instance.__dict__.pop('_bylines_cleared', ())
+        for content in model.objects.filter(pk__in=pk_set):
+            content.updateByline()
+
+@receiver(post_save, sender=Author)
+def updateAuthorBylines(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for model in BYLINE_MODELS:
+        for content in model.objects.filter(author=instance):
+            content.updateByline()
+
+@receiver(pre_delete, sender=Author)
+def collectAuthorBylines(sender, instance, **kwargs):
+    instance._bylines_affected = [
+        content for model in BYLINE_MODELS
+        for content in model.objects.filter(author=instance)]
+
+@receiver(post_delete, sender=Author)
+def removeAuthorBylines(sender, instance, **kwargs):
+    for content in instance.__dict__.pop('_bylines_affected', ()):
+        content.updateByline()
+
+
+# search index (imported late: prime.search imports prime.models)
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=DIYarticle)
+@receiver(post_save, sender=CityGuideArticle)
+def updateSearchDocument(sender, instance, raw=False, **kwargs):
+    from prime import search
+    if not raw:
+        search.updateDocument(instance)
+
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=DIYarticle)
+@receiver(post_delete, sender=CityGuideArticle)
+def removeSearchDocument(sender, instance, **kwargs):
+    from prime import search
+    search.removeDocument(instance)
+
+
+# search-as-you-type
+
+@receiver(post_save, sender=Article)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=DIYarticle)
+@receiver(post_save, sender=Neighborhood)
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_save, sender=DIYTag)
+def updateSuggestion(sender, instance, raw=False, **kwargs):
+    from prime import suggest
+    if not raw:
+        suggest.updateEntry(instance)
+
+@receiver(post_delete, sender=Article)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=DIYarticle)
+@receiver(post_delete, sender=Neighborhood)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_delete, sender=DIYTag)
+def removeSuggestion(sender, instance, **kwargs):
+    from prime import suggest
+    suggest.removeEntry(instance)
+
+@receiver(post_save, sender=Issue)
+def invalidateSuggestions(sender, instance, raw=False, **kwargs):
+    from prime import suggest
+    suggest.invalidate()
+
+
+# page and fragment caches
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+def bumpContentGeneration(sender, **kwargs):
+    from prime import caching
+    if sender._meta.app_label == 'prime' and sender is not SuggestChange \
+            or sender is Author:
+        caching.bumpGeneration()
@@ -0,0 +1,50 @@
+// Search-as-you-type for the nav search box: fills a <datalist> from
+// /prime/suggest/ and jumps straight to a picked suggestion.
+(function() {
+    var forms = document.querySelectorAll('form.search');
+    for (var i = 0; i < forms.length; i++) {
+        attach(forms[i]);
+    }
+
+    function attach(form) {
+        var input = form.querySelector('input[name=q]');
+        var list = document.createElement('datalist');
+        var urls = {};
+        var pending = null;
+        list.id = 'prime-suggestions-' + Math.random().toString(36).slice(2);
+        input.setAttribute('list', list.id);
+        input.setAttribute('autocomplete', 'off');
+        form.appendChild(list);
+
+        input.addEventListener('input', function(event) {
+            // typing is an InputEvent with an inputType; picking an option
+            // from the list is not, or replaces the text as a whole, so a
+            // typed label that happens to match is not taken as a pick
+            var picked = !event.inputType ||
+                event.inputType === 'insertReplacementText';
+            if (picked && urls[input.value]) {
+                window.location = urls[input.value];
+                return;
+            }
+            if (pending) {
+                pending.abort();
+            }
+            var xhr = pending = new XMLHttpRequest();
+            xhr.open('GET', form.getAttribute('data-suggest') + '?q=' +
+                     encodeURIComponent(input.value));
+            xhr.onload = function() {
+                var results = JSON.parse(xhr.responseText).results;
+                list.innerHTML = '';
+                urls = {};
+                for (var j = 0; j < results.length; j++) {
+                    var option = document.createElement('option');
+                    option.value = results[j].label;
+                    option.label = results[j].kind;
+                    urls[results[j].label] = results[j].url;
+                    list.appendChild(option);
+                }
+            };
+            xhr.send();
+        });
+    }
+})();
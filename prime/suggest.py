@@ -0,0 +1,203 @@
+"""
+In-process prefix index for search-as-you-type.
+
+Titles of articles, recipes, DIY pieces and neighborhoods, plus tag names,
+are held in one sorted array of normalized keys (one per word start, capped
+at ``KEY_LENGTH`` characters) with a parallel array of entry ids, so a lookup
+is a ``bisect`` and a short scan.
+
+Saves and deletes are written to a change log (``SuggestChange``); before a
+lookup, each worker applies the changes it has not seen yet to its own index
+in place. Only a gap in the log (pruned past ``LOG_LENGTH``, or a rolled
+back change) or a saved issue, whose slug is in article URLs, rebuilds the
+whole index.
+"""
+import bisect
+import re
+import threading
+
+from django.core.urlresolvers import reverse
+
+from prime.models import Article, Recipe, DIYarticle, Neighborhood, \
+    RecipeTag, DIYTag, SuggestChange
+
+KEY_LENGTH = 32
+# changes kept in the log; a worker further behind rebuilds its index
+LOG_LENGTH = 1000
+NON_WORD = re.compile(r'\W+', re.UNICODE)
+
+
+def normalize(text):
+    return NON_WORD.sub(' ', text.lower()).strip()
+
+def keysFor(entry):
+    words = normalize(entry[0]).split()
+    return [' '.join(words[start:])[:KEY_LENGTH]
+            for start in xrange(len(words))]
+
+def entryFor(instance):
+    """
+    (label, kind, url) for an indexed instance.
+    """
+    if isinstance(instance, Article):
+        if not instance.issue_id:
+            return None
+        return (instance.title, 'article',
+                reverse('prime_article',
+                        args=[instance.issue.slug, instance.slug]))
+    if isinstance(instance, Recipe):
+        return (instance.title, 'recipe',
+                reverse('prime_recipes', args=[instance.slug]))
+    if isinstance(instance, DIYarticle):
+        return (instance.title, 'diy',
+                reverse('prime_diys', args=[instance.slug]))
+    if isinstance(instance, Neighborhood):
+        return (instance.title, 'neighborhood',
+                reverse('cityguide_view', args=[instance.slug]))
+    if isinstance(instance, RecipeTag):
+        return (instance.name, 'recipe tag',
+                reverse('prime_recipe_tag', args=[instance.name]))
+    return (instance.name, 'diy tag',
+            reverse('prime_diy_tag', args=[instance.name]))
+
+SOURCES = [
+    Article.objects.select_related('issue'),
+    Recipe.objects.all(),
+    DIYarticle.objects.all(),
+    Neighborhood.objects.all(),
+    RecipeTag.objects.all(),
+    DIYTag.objects.all(),
+]
+
+
+class PrefixIndex(object):
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+        self.entries = {}
+
+    @classmethod
+    def build(cls, items):
+        """
+        Bulk load from (entry_id, entry) pairs with a single sort.
+        """
+        index = cls()
+        pairs = []
+        for entry_id, entry in items:
+            if entry is not None:
+                index.entries[entry_id] = entry
+                pairs.extend((key, entry_id) for key in keysFor(entry))
+        pairs.sort()
+        index.keys = [key for key, _ in pairs]
+        index.ids = [entry_id for _, entry_id in pairs]
+        return index
+
+    def add(self, entry_id, entry):
+        self.remove(entry_id)
+        if entry is None:
+            return
+        self.entries[entry_id] = entry
+        for key in keysFor(entry):
+            position = bisect.bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.ids.insert(position, entry_id)
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in keysFor(entry):
+            position = bisect.bisect_left(self.keys, key)
+            while self.ids[position] != entry_id:
+                position += 1
+            del self.keys[position]
+            del self.ids[position]
+
+    def lookup(self, prefix, limit=8):
+        prefix = normalize(prefix)[:KEY_LENGTH]
+        if not prefix:
+            return []
+        position = bisect.bisect_left(self.keys, prefix)
+        seen, results = set(), []
+        while position < len(self.keys) and len(results) < limit and \
+                self.keys[position].startswith(prefix):
+            entry_id = self.ids[position]
+            if entry_id not in seen:
+                seen.add(entry_id)
+                results.append(self.entries[entry_id])
+            position += 1
+        return results
+
+_index = None
+# pk of the last change applied to _index
+_sequence = None
+_lock = threading.RLock()
+
+def entryId(instance):
+    return (type(instance).__name__, instance.pk)
+
+def latestChange():
+    return SuggestChange.objects.order_by('-pk')\
+                                .values_list('pk', flat=True).first() or 0
+
+def applyChanges():
+    """
+    Applies the logged changes after ``_sequence`` to ``_index``. Returns
+    False if the log has a gap or asks for a rebuild.
+    """
+    global _sequence
+    changes = SuggestChange.objects.filter(pk__gt=_sequence).order_by('pk')\
+        .values_list('pk', 'entry_type', 'entry_pk', 'label', 'kind', 'url')
+    for pk, entry_type, entry_pk, label, kind, url in changes:
+        if pk != _sequence + 1 or not entry_type:
+            return False
+        if kind:
+            _index.add((entry_type, entry_pk), (label, kind, url))
+        else:
+            _index.remove((entry_type, entry_pk))
+        _sequence = pk
+    return True
+
+def getIndex():
+    global _index, _sequence
+    with _lock:
+        if _index is None or not applyChanges():
+            # read first, so changes made during the scan are applied again
+            sequence = latestChange()
+            _index = PrefixIndex.build(
+                (entryId(instance), entryFor(instance))
+                for queryset in SOURCES for instance in queryset.all())
+            _sequence = sequence
+        return _index
+
+def lookup(prefix, limit=8):
+    with _lock:
+        return getIndex().lookup(prefix, limit)
+
+
+# maintenance, called from prime.signals
+
+def record(entry_id=None, entry=None):
+    entry_type, entry_pk = entry_id or ('', None)
+    label, kind, url = entry or ('', '', '')
+    change = SuggestChange.objects.create(
+        entry_type=entry_type, entry_pk=entry_pk, label=label[:255],
+        kind=kind, url=url)
+    if change.pk % LOG_LENGTH == 0:
+        SuggestChange.objects.filter(pk__lte=change.pk - LOG_LENGTH).delete()
+
+def updateEntry(instance):
+    record(entryId(instance), entryFor(instance))
+
+def removeEntry(instance):
+    record(entryId(instance))
+
+def invalidate():
+    """
+    Makes every worker rebuild its index, after changes the log cannot
+    describe entry by entry.
+    """
+    global _index
+    with _lock:
+        record()
+        _index = None
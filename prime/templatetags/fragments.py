@@ -0,0 +1,44 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from main import metrics
+from prime.caching import enabled, fragmentKey
+
+register = template.Library()
+
+
+class FragmentNode(template.Node):
+    def __init__(self, name, instance, nodelist):
+        self.name = name
+        self.instance = instance
+        self.nodelist = nodelist
+
+    def render(self, context):
+        if not enabled():
+            return self.nodelist.render(context)
+        key = fragmentKey(self.name, self.instance.resolve(context))
+        value = cache.get(key)
+        metrics.inc('cache_requests_total', cache='fragment',
+                    result='miss' if value is None else 'hit')
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(key, value, settings.PRIME_CACHE_TIMEOUT)
+        return value
+
+@register.tag
+def fragment(parser, token):
+    """
+    Caches the enclosed output per model instance and content generation::
+
+        {% fragment body article %}
+            {{ article.body|markdown|image }}
+        {% endfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(
+            "'fragment' takes a name and a model instance.")
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    return FragmentNode(bits[1], parser.compile_filter(bits[2]), nodelist)
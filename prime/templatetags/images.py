@@ -0,0 +1,39 @@
+from django import template
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+def imgAttributes(name, width, height, preview, lazy=True):
+    """
+    ``src`` and, where known, ``width``, ``height`` and the placeholder
+    (as a background shown until the image arrives) of an ``<img>``.
+    """
+    attributes = ['src="%s%s"' % (settings.MEDIA_URL, escape(name))]
+    if width and height:
+        attributes.append('width="%d" height="%d"' % (width, height))
+    if lazy:
+        attributes.append('loading="lazy" decoding="async"')
+    if preview:
+        style = "background: url('%s') center / cover no-repeat" % preview
+        if width and height:
+            # scaled by CSS width, kept in proportion
+            style += '; height: auto'
+        attributes.append('style="%s"' % style)
+    return ' '.join(attributes)
+
+@register.simple_tag
+def img_attributes(instance, name, lazy=True):
+    """
+    Attributes of an ``<img>`` for image field ``name`` of ``instance``,
+    loaded lazily unless ``lazy=False``::
+
+        <img {% img_attributes entry "lead_photo" %} alt="">
+    """
+    return mark_safe(imgAttributes(
+        unicode(getattr(instance, name) or ''),
+        getattr(instance, name + '_width', None),
+        getattr(instance, name + '_height', None),
+        getattr(instance, name + '_preview', ''), lazy))
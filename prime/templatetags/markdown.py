@@ -1,9 +1,12 @@
 from django import template
 from django.utils.safestring import mark_safe
-import markdown2
-  
+
+from main.profiling import timed
+
 register = template.Library()
    
 @register.filter()
+@timed('markdown')
 def markdown(value):
+    import markdown2
     return mark_safe(markdown2.markdown(value, safe_mode='escape'))
@@ -1,53 +1,69 @@
 import re
 from django import template
 from django.template.defaultfilters import stringfilter
-from project.settings.base import MEDIA_URL
+from main import embeds
 from prime.models import Image
+from prime.templatetags.images import imgAttributes
+from main.profiling import timed
 register = template.Library()
 
+IMG = re.compile(r'\[img(?P<pk>\d+)\s*(?P<display>\S+)?\]')
+YOUTUBE = re.compile(r'\[youtube\]http://youtu\.be/(?P<uid>\S+)\[/youtube\]')
+SPOTIFY = re.compile(r'\[spotify\](?P<sid>\S+)\[/spotify\]')
+LINEBREAK = re.compile(r'\[br\]')
+
 @register.filter(is_safe=True)
 @stringfilter
-def image(value):
-    img = r'\[img(?P<pk>\d+)\s*(?P<display>\S+)?\]'
-    return re.sub(img, imgHTML, value)
+@timed('image')
+def image(value, images=None):
+    # one query for every image in the body rather than one per shortcode;
+    # none if the view already loaded them (see imagesIn)
+    pks = set(int(pk) for pk, _ in IMG.findall(value))
+    if not pks:
+        return value
+    images = dict(images or {})
+    missing = pks - set(images)
+    if missing:
+        images.update(Image.objects.select_related('author')
+                      .in_bulk(missing))
+    return IMG.sub(lambda match: imgHTML(match, images), value)
     
 @register.filter(is_safe=True)
 @stringfilter
+@timed('youtube')
 def youtube(value):
-    yt = r'\[youtube\]http://youtu\.be/(?P<uid>\S+)\[/youtube\]'
-    return re.sub(yt, ytHTML, value)
+    found = embeds.lookup(('youtube', uid) for uid in YOUTUBE.findall(value))
+    return YOUTUBE.sub(lambda match: ytHTML(match, found), value)
 
 @register.filter(is_safe=True)
 @stringfilter
+@timed('spotify')
 def spotify(value):
-    spt = r'\[spotify\](?P<sid>\S+)\[/spotify\]'
-    return re.sub(spt, spHTML, value)
+    found = embeds.lookup(('spotify', spotifyURI(sid))
+                          for sid in SPOTIFY.findall(value))
+    return SPOTIFY.sub(lambda match: spHTML(match, found), value)
 
 @register.filter(is_safe=True)
 @stringfilter
+@timed('linebreak')
 def linebreak(value):
-    ln = r'\[br\]'
-    return re.sub(ln, brHTML, value)
+    return LINEBREAK.sub(brHTML, value)
 
 def brHTML(match):
     return '''
         <br />
            ''' 
 
-def spHTML(match):
-    sid = match.group('sid')
-    return '''
-        <iframe src="https://embed.spotify.com/?uri=spotify:track:%s"
-            width="500" height="80" 
-            frameborder="0" 
-            allowtransparency="true">
-        </iframe>
-           ''' % sid
+def spotifyURI(sid):
+    return 'spotify:track:%s' % sid
+
+def spHTML(match, found):
+    uri = spotifyURI(match.group('sid'))
+    return embeds.facade('spotify', uri, found.get(('spotify', uri)), 500, 80)
 
-def imgHTML(match):
-    try:
-        image = Image.objects.get(pk=match.group('pk'))
-    except Image.DoesNotExist:
+def imgHTML(match, images):
+    image = images.get(int(match.group('pk')))
+    if image is None:
         return "" # IDEA: don't fail silently?
     given_display = match.group('display')
     # IDEA: check if given_display is in a list of valid dispaly options.
@@ -55,8 +71,9 @@ def imgHTML(match):
     # Would prevent users from assigning any css class they want.
     display = given_display if given_display is not None else "right"
     params = {'display': display,
-              'MEDIA_URL': MEDIA_URL,
-              'filename': image.image,
+              'attributes': imgAttributes(image.image.name, image.image_width,
+                                          image.image_height,
+                                          image.image_preview),
               'caption': image.caption
     }
     if image.author:
@@ -72,7 +89,7 @@ def imgHTML(match):
     return '''
            <figure class="%(display)s">
                <div class="image">
-                   <img src="%(MEDIA_URL)s%(filename)s"/>
+                   <img %(attributes)s/>
                    <div class="credit"><strong>%(author)s</strong>
                        %(organization)s</div>
                </div>
@@ -80,10 +97,23 @@ def imgHTML(match):
            </figure>
            ''' % params
 
-def ytHTML(match):
+def ytHTML(match, found):
     uid = match.group('uid')
-    return '''
-        <iframe width="500" height="281" 
-                src="//www.youtube.com/embed/%s" frameborder="0" 
-                allowfullscreen></iframe>
-           ''' % uid
+    return embeds.facade('youtube', uid, found.get(('youtube', uid)), 500, 281)
+
+def imagesIn(*texts):
+    """
+    {pk: Image} for every [imgN] shortcode in ``texts``, in one query, for
+    pages rendering several bodies (``{{ body|image:images }}``).
+    """
+    pks = set(int(pk) for text in texts for pk, _ in IMG.findall(text))
+    if not pks:
+        return {}
+    return Image.objects.select_related('author').in_bulk(pks)
+
+def embedsIn(text):
+    """
+    (provider, key) of every YouTube and Spotify shortcode in ``text``.
+    """
+    return [('youtube', uid) for uid in YOUTUBE.findall(text)] + \
+        [('spotify', spotifyURI(sid)) for sid in SPOTIFY.findall(text)]
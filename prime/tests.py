@@ -5,7 +5,38 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from distutils.spawn import find_executable
+from datetime import date
+from StringIO import StringIO
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from main.models import Author
+from main.synthetic import Generator
+from PIL import Image as PyImage
+
+from prime import archive, caching, feeds, pdfpages, related, search, suggest
+from prime.export import Exporter
+from prime.importer import Importer, IssueImportError
+from prime.models import Issue, Article, Recipe, Neighborhood, RecipeTag, \
+    FeedEntry, RelatedContent, PDF, Image, DIYarticle, DIYTag, \
+    CityGuideArticle, SuggestChange, ImageTooLarge, checkImageSize, \
+    openImage, resizeImage
+from prime.templatetags.shortcodes import image as imageFilter, imagesIn
 
 
 class SimpleTest(TestCase):
@@ -14,3 +45,1031 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class FeedEntryTest(TestCase):
+    def setUp(self):
+        self.issue = Issue.objects.create(name="Fall", slug="fall",
+                                          release_date=date(2014, 10, 1))
+
+    def test_feed_follows_content(self):
+        recipe = Recipe.objects.create(title="Soup", slug="soup",
+                                       issue=self.issue, position=2,
+                                       lead_photo="prime/recipe/lead/a.jpg")
+        article = Article.objects.create(title="Bikes", slug="bikes",
+                                         issue=self.issue, position=1,
+                                         teaser="Two wheels",
+                                         lead_photo="prime/fall/lead/b.jpg")
+        entries = FeedEntry.objects.filter(issue=self.issue)\
+                                   .order_by('position')
+        self.assertEqual([(e.kind, e.title) for e in entries],
+                         [('article', 'Bikes'), ('recipe', 'Soup')])
+        self.assertEqual(entries[0].get_absolute_url(), '/prime/fall/bikes/')
+
+        article.title = "Bicycles"
+        article.save()
+        self.assertEqual(FeedEntry.objects.get(kind='article').title,
+                         "Bicycles")
+
+        self.issue.release_date = date(2014, 11, 1)
+        self.issue.save()
+        self.assertEqual(FeedEntry.objects.get(kind='recipe').pub_date,
+                         date(2014, 11, 1))
+
+        recipe.delete()
+        self.assertEqual(FeedEntry.objects.count(), 1)
+
+
+class BylineTest(TestCase):
+    def test_byline_tracks_authors(self):
+        jo = Author.objects.create(first_name="Jo", last_name="Bruin")
+        al = Author.objects.create(first_name="Al", last_name="Smith")
+        article = Article.objects.create(title="Bikes", slug="bikes",
+                                         lead_photo="prime/x/lead/b.jpg")
+        article.author.add(jo, al)
+        self.assertEqual(Article.objects.get().byline,
+                         "Jo Bruin and Al Smith")
+
+        al.first_name = "Alice"
+        al.save()
+        self.assertEqual(Article.objects.get().getPrettyAuthors(),
+                         "Jo Bruin and Alice Smith")
+
+        jo.article_set.clear()
+        self.assertEqual(Article.objects.get().byline, "Alice Smith")
+
+        al.delete()
+        self.assertEqual(Article.objects.get().byline, "")
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        search.reindexAll()
+        issue = Issue.objects.create(name="Fall", slug="fall",
+                                     release_date=date(2014, 10, 1))
+        Article.objects.create(title="Bike lanes in Westwood", slug="bikes",
+                               issue=issue, teaser="Two wheels",
+                               body="Where to ride.",
+                               lead_photo="prime/fall/lead/b.jpg")
+        Recipe.objects.create(title="Soup", slug="soup",
+                              teaser="Warm soup after a bike ride",
+                              lead_photo="prime/recipe/lead/s.jpg")
+
+    def test_ranked_results(self):
+        results = search.search("bike")
+        self.assertEqual(results.count(), 2)
+        self.assertEqual([hit.kind for hit in results[0:2]],
+                         ['article', 'recipe'])
+        self.assertEqual(results[0].url, '/prime/fall/bikes/')
+
+    def test_index_follows_saves(self):
+        search.getIndex()
+        soup = Recipe.objects.get()
+        soup.title = "Lentil stew"
+        soup.save()
+        self.assertEqual(search.search("lentil").count(), 1)
+        soup.delete()
+        self.assertEqual(search.search("lentil").count(), 0)
+
+    def test_articles_outside_issues_left_out(self):
+        search.getIndex()
+        article = Article.objects.create(
+            title="Bike repair", slug="repair", teaser="Fixing flats",
+            lead_photo="prime/fall/lead/r.jpg")
+        self.assertEqual(search.search("repair").count(), 0)
+        article.issue = Issue.objects.get()
+        article.save()
+        self.assertEqual(search.search("repair")[0].url,
+                         '/prime/fall/repair/')
+        article.issue = None
+        article.save()
+        self.assertEqual(search.search("repair").count(), 0)
+        search.reindexAll()
+        self.assertEqual(search.search("repair").count(), 0)
+        self.assertTrue(all('/None/' not in hit.url
+                            for hit in search.search("bike")[0:10]))
+
+    def test_view(self):
+        response = self.client.get('/prime/search/', {'q': 'soup'},
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, '/prime/recipes/soup/')
+
+
+class SuggestTest(TestCase):
+    def setUp(self):
+        suggest.invalidate()
+        Neighborhood.objects.create(title="Westwood Village", slug="westwood",
+                                    lead_photo="prime/cityguides/lead/w.jpg")
+        RecipeTag.objects.create(name="weeknight")
+
+    def test_prefix_lookup(self):
+        self.assertEqual([label for label, _, _ in suggest.lookup("we")],
+                         ["weeknight", "Westwood Village"])
+        self.assertEqual(suggest.lookup("vill")[0][2],
+                         '/prime/cityguides/westwood/')
+        self.assertEqual(suggest.lookup("xyz"), [])
+
+    def test_index_follows_saves(self):
+        suggest.lookup("we")
+        recipe = Recipe.objects.create(title="Wet noodles", slug="noodles",
+                                       lead_photo="prime/recipe/lead/n.jpg")
+        self.assertEqual(suggest.lookup("noodle")[0][0], "Wet noodles")
+        recipe.delete()
+        self.assertEqual(suggest.lookup("noodle"), [])
+
+    def test_changes_applied_in_place(self):
+        suggest.lookup("we")
+        builds = []
+        build = suggest.PrefixIndex.build
+        suggest.PrefixIndex.build = classmethod(
+            lambda cls, items: builds.append(1) or build(items))
+        try:
+            recipe = Recipe.objects.create(
+                title="Wet noodles", slug="noodles",
+                lead_photo="prime/recipe/lead/n.jpg")
+            # as another worker would have written it
+            SuggestChange.objects.create(
+                entry_type='DIYTag', entry_pk=99, label="wetsuits",
+                kind='diy tag', url='/prime/diy/tagged/wetsuits/')
+            self.assertEqual([label for label, _, _ in suggest.lookup("wet")],
+                             ["Wet noodles", "wetsuits"])
+            self.assertEqual(builds, [])
+
+            # a change missing from the log: rebuilt from the tables
+            recipe.delete()
+            SuggestChange.objects.create(
+                pk=suggest.latestChange() + 2, entry_type='DIYTag',
+                entry_pk=100, label="wetlands", kind='diy tag',
+                url='/prime/diy/tagged/wetlands/')
+            self.assertEqual([label for label, _, _ in suggest.lookup("wet")],
+                             [])
+            self.assertEqual(builds, [1])
+        finally:
+            suggest.PrefixIndex.build = build
+
+    def test_view(self):
+        response = self.client.get('/prime/suggest/', {'q': 'west'},
+                                   HTTP_HOST='localhost')
+        self.assertEqual(json.loads(response.content)['results'][0]['kind'],
+                         'neighborhood')
+
+
+class RelatedTest(TestCase):
+    def setUp(self):
+        for slug, title in [('soup', "Tomato soup"),
+                            ('stew', "Tomato stew"),
+                            ('cake', "Chocolate cake")]:
+            Recipe.objects.create(title=title, slug=slug,
+                                  teaser=title + " for a cold night",
+                                  lead_photo="prime/recipe/lead/r.jpg")
+
+    def neighbours(self, slug):
+        entry = FeedEntry.objects.get(slug=slug)
+        return [item.target.slug for item in entry.related.all()]
+
+    def test_incremental_build(self):
+        self.assertEqual(related.build(top=1), (3, 3))
+        self.assertEqual(self.neighbours('soup'), ['stew'])
+        self.assertEqual(related.build(top=1), (0, 0))
+
+        cake = Recipe.objects.get(slug='cake')
+        cake.title = "Tomato soup cake"
+        cake.save()
+        changed, recomputed = related.build(top=1)
+        self.assertEqual(changed, 1)
+        self.assertEqual(self.neighbours('cake'), ['soup'])
+
+    def test_deleted_target(self):
+        related.build(top=1)
+        Recipe.objects.get(slug='stew').delete()
+        related.build(top=1)
+        self.assertEqual(self.neighbours('soup'), ['cake'])
+
+    def test_view(self):
+        related.build(top=1)
+        response = self.client.get('/prime/recipes/soup/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, '/prime/recipes/stew/')
+        self.assertEqual(RelatedContent.objects.count(), 3)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.target = tempfile.mkdtemp()
+        issue = Issue.objects.create(name="Fall", slug="fall",
+                                     release_date=date(2014, 10, 1))
+        PDF.objects.create(issue=issue, pdf="prime/fall/pdf/fall.pdf",
+                           image="prime/fall/pdf_image/fall.jpg")
+        for slug in ('soup', 'stew'):
+            Recipe.objects.create(title=slug.title(), slug=slug,
+                                  lead_photo="prime/recipe/lead/r.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(self.target)
+
+    def export(self):
+        return Exporter(self.target, processes=1).run()
+
+    def path(self, *parts):
+        return os.path.join(self.target, 'prime', *parts)
+
+    def test_incremental_export(self):
+        counts = self.export()
+        self.assertEqual(counts['errors'], 0)
+        self.assertTrue(os.path.exists(self.path('index.html')))
+        with open(self.path('recipes', 'soup', 'index.html')) as f:
+            self.assertIn('Soup', f.read())
+        self.assertEqual(self.export()['rendered'], 0)
+
+        soup = Recipe.objects.get(slug='soup')
+        soup.title = "Lentil soup"
+        soup.save()
+        counts = self.export()
+        self.assertTrue(0 < counts['rendered'] < counts['skipped'])
+        with open(self.path('recipes', 'soup', 'index.html')) as f:
+            self.assertIn('Lentil soup', f.read())
+
+        Recipe.objects.get(slug='stew').delete()
+        self.assertEqual(self.export()['removed'], 1)
+        self.assertFalse(os.path.exists(self.path('recipes', 'stew',
+                                                  'index.html')))
+
+    def test_paginated_listing(self):
+        for n in range(5):
+            Recipe.objects.create(title="Dish %d" % n, slug="dish-%d" % n,
+                                  lead_photo="prime/recipe/lead/r.jpg")
+        self.export()
+        self.assertTrue(os.path.exists(self.path('recipes',
+                                                 'index.page-2.html')))
+
+
+class CachingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.issue = Issue.objects.create(name="Fall", slug="fall",
+                                          release_date=date(2014, 10, 1))
+        PDF.objects.create(issue=self.issue, pdf="prime/fall/pdf/fall.pdf",
+                           image="prime/fall/pdf_image/fall.jpg")
+        Recipe.objects.create(title="Soup", slug="soup", issue=self.issue,
+                              body="Simmer *slowly*.",
+                              lead_photo="prime/recipe/lead/r.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(self.media)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_HOST='localhost')
+        return response, len(queries)
+
+    def test_page_cache_follows_saves(self):
+        response, _ = self.get('/prime/recipes/soup/')
+        self.assertContains(response, '<em>slowly</em>')
+        response, queries = self.get('/prime/recipes/soup/')
+        self.assertEqual(queries, 0)
+
+        soup = Recipe.objects.get()
+        soup.body = "Simmer *gently*."
+        soup.save()
+        response, queries = self.get('/prime/recipes/soup/')
+        self.assertContains(response, '<em>gently</em>')
+        self.assertTrue(queries > 0)
+
+    def test_generation_survives_eviction(self):
+        self.get('/prime/recipes/soup/')
+        first = caching.generation()
+        caching.bumpGeneration()
+        second = caching.generation()
+        self.assertTrue(second > first)
+        cache.delete(caching.GENERATION_KEY)
+        self.assertTrue(caching.generation() > second)
+        self.assertTrue(self.get('/prime/recipes/soup/')[1] > 0)
+
+    @override_settings(PRIME_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.get('/prime/recipes/soup/')
+        self.assertTrue(self.get('/prime/recipes/soup/')[1] > 0)
+
+    def test_warm_issue(self):
+        with override_settings(MEDIA_ROOT=self.media):
+            os.makedirs(os.path.join(self.media, 'prime', 'fall', 'article'))
+            PyImage.new('RGB', (2000, 1000)).save(
+                os.path.join(self.media, 'prime', 'fall', 'article', 'a.jpg'))
+            Image.objects.create(image='prime/fall/article/a.jpg',
+                                 issue=self.issue)
+            statuses = dict(caching.warmImages(self.issue))
+            self.assertEqual(statuses['prime/fall/article/a.jpg'], 'resized')
+            self.assertEqual(statuses['prime/fall/pdf_image/fall.jpg'],
+                             'missing')
+            size = PyImage.open(os.path.join(self.media, 'prime', 'fall',
+                                             'article', 'a.jpg')).size
+            self.assertEqual(size, (500, 250))
+
+        pages = caching.warmPages(self.issue)
+        self.assertIn(('/prime/recipes/soup/', 200, False),
+                      [page[:3] for page in pages])
+        self.assertEqual(self.get('/prime/recipes/soup/')[1], 0)
+        self.assertTrue(all(hit for _, _, hit, _, _ in
+                            caching.warmPages(self.issue)))
+
+        call_command('warmissue', 'fall', stdout=open(os.devnull, 'w'))
+
+    def test_warm_failing_page(self):
+        # the issue front page needs a PDF
+        PDF.objects.all().delete()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('prime.caching')
+        saved_handlers, logger.handlers = logger.handlers, [handler]
+        try:
+            pages = dict((url, (status, error)) for url, status, _, _, error
+                         in caching.warmPages(self.issue))
+            output = StringIO()
+            call_command('warmissue', 'fall', stdout=output)
+        finally:
+            logger.handlers = saved_handlers
+        self.assertEqual(len(records), 2)
+        status, error = pages['/prime/issue/fall/']
+        self.assertEqual(status, 500)
+        self.assertIn('DoesNotExist', error)
+        self.assertEqual(pages['/prime/recipes/soup/'], (200, None))
+        self.assertIn('DoesNotExist', output.getvalue())
+
+
+def jpeg(size):
+    buffer = StringIO()
+    PyImage.new('RGB', size, (200, 80, 40)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class ImagePreviewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def test_upload(self):
+        recipe = Recipe.objects.create(
+            title="Soup", slug="soup",
+            lead_photo=SimpleUploadedFile('soup.jpg', jpeg((800, 400))))
+        self.assertEqual((recipe.lead_photo_width, recipe.lead_photo_height),
+                         (800, 400))
+        self.assertTrue(recipe.lead_photo_preview.startswith(
+            'data:image/jpeg;base64,'))
+        self.assertTrue(len(recipe.lead_photo_preview) < 1000)
+        self.assertEqual(PyImage.open(recipe.lead_photo.path).size,
+                         (800, 400))
+        entry = FeedEntry.objects.get()
+        self.assertEqual(entry.lead_photo_preview, recipe.lead_photo_preview)
+
+        response = self.client.get('/prime/recipes/', HTTP_HOST='localhost')
+        self.assertContains(response, 'width="800" height="400" '
+                                      'loading="lazy"')
+        self.assertContains(response, recipe.lead_photo_preview)
+
+    def test_resized_shortcode(self):
+        issue = Issue.objects.create(name="Fall", slug="fall",
+                                     release_date=date(2014, 10, 1))
+        # as the admin does it
+        image = Image(issue=issue)
+        image.image = SimpleUploadedFile('big.jpg', jpeg((2000, 1000)))
+        image.save()
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual((image.image_width, image.image_height), (500, 250))
+        html = imageFilter('[img%d]' % image.pk)
+        self.assertIn('width="500" height="250" loading="lazy"', html)
+        self.assertIn(image.image_preview, html)
+
+    def test_backfill(self):
+        os.makedirs(os.path.join(self.media, 'prime', 'cityguides', 'lead'))
+        with open(os.path.join(self.media, 'prime', 'cityguides', 'lead',
+                               'w.jpg'), 'wb') as f:
+            f.write(jpeg((300, 200)))
+        Neighborhood.objects.create(title="Westwood", slug="westwood",
+                                    lead_photo='prime/cityguides/lead/w.jpg')
+        Neighborhood.objects.create(title="Venice", slug="venice",
+                                    lead_photo='prime/cityguides/lead/v.jpg')
+        self.assertEqual(Neighborhood.objects.get(slug='westwood')
+                         .lead_photo_preview, '')
+        call_command('buildpreviews', stdout=StringIO())
+        westwood = Neighborhood.objects.get(slug='westwood')
+        self.assertEqual(westwood.lead_photo_width, 300)
+        self.assertNotEqual(westwood.lead_photo_preview, '')
+        self.assertEqual(Neighborhood.objects.get(slug='venice')
+                         .lead_photo_preview, '')
+
+
+class LargeImageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media)
+
+    def test_pixel_limit(self):
+        with override_settings(IMAGE_MAX_PIXELS=100 * 100):
+            self.assertRaises(ImageTooLarge, openImage,
+                              StringIO(jpeg((200, 100))))
+            self.assertEqual(openImage(StringIO(jpeg((100, 100)))).size,
+                             (100, 100))
+            recipe = Recipe(lead_photo=SimpleUploadedFile(
+                'big.jpg', jpeg((200, 100))))
+            self.assertRaises(ValidationError, checkImageSize,
+                              recipe.lead_photo)
+            recipe = Recipe(lead_photo=SimpleUploadedFile(
+                'small.jpg', jpeg((50, 50))))
+            checkImageSize(recipe.lead_photo)
+            self.assertEqual(recipe.lead_photo.file.tell(), 0)
+
+    def test_oversized_image_not_stored(self):
+        with override_settings(IMAGE_MAX_PIXELS=100 * 100,
+                               MEDIA_ROOT=self.media):
+            issue = Issue.objects.create(name="Fall", slug="fall",
+                                         release_date=date(2014, 10, 1))
+            image = Image(issue=issue, image=SimpleUploadedFile(
+                'big.jpg', jpeg((200, 100))))
+            self.assertRaises(ImageTooLarge, image.save)
+            self.assertFalse(Image.objects.exists())
+            self.assertEqual([files for _, _, files in os.walk(self.media)
+                              if files], [])
+            image = Image(issue=issue, image=SimpleUploadedFile(
+                'small.jpg', jpeg((50, 50))))
+            image.save()
+            self.assertEqual((image.image.width, image.image.height),
+                             (50, 50))
+
+    def test_reduced_decoding(self):
+        path = os.path.join(self.media, 'large.jpg')
+        with open(path, 'wb') as f:
+            f.write(jpeg((4800, 3200)))
+        self.assertTrue(resizeImage(path))
+        image = PyImage.open(path)
+        self.assertEqual((image.format, image.size), ('JPEG', (500, 333)))
+        self.assertFalse(resizeImage(path))
+
+    def test_benchmark(self):
+        output = StringIO()
+        call_command('benchimages', megapixels='0.5', stdout=output)
+        self.assertIn('progressive jpeg 0.5MP', output.getvalue())
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.source = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+        self.write('issue.md', "---\nname: Winter\nslug: winter\n"
+                   "release_date: 2015-01-10\n---\n")
+        self.write('photos/lead.jpg', jpeg((800, 600)))
+        self.write('photos/big.jpg', jpeg((1600, 1200)))
+        self.write('photos/small.jpg', jpeg((300, 200)))
+        self.write('bruin-walk.md', u"""---
+title: Bruin Walk at dawn
+teaser: Before the flyers.
+authors: Alex Chen, Mary Jo Smith
+photographer: Sam Lee
+lead_photo: photos/lead.jpg
+---
+First light.
+
+![The walk](photos/big.jpg "full")
+
+![Again](photos/big.jpg)
+
+![Remote](http://example.com/x.jpg)
+""".encode('utf-8'))
+        self.write('kitchen/ramen.md', """---
+type: recipe
+title: Ramen
+authors: Alex Chen
+tags: dinner, quick
+lead_photo: ../photos/lead.jpg
+---
+![Broth](../photos/small.jpg "left")
+""")
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+        shutil.rmtree(self.source)
+
+    def write(self, name, data):
+        path = os.path.join(self.source, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_import(self):
+        Author.objects.create(first_name="Alex", last_name="Chen")
+        counts = Importer(self.source, processes=1).run()
+        self.assertEqual((counts['article'], counts['recipe'], counts['diy'],
+                          counts['images']), (1, 1, 0, 2))
+        issue = Issue.objects.get(slug='winter')
+        self.assertEqual(issue.release_date, date(2015, 1, 10))
+
+        article = Article.objects.get(slug='bruin-walk-at-dawn')
+        self.assertEqual(article.issue, issue)
+        self.assertEqual(article.byline, "Alex Chen and Mary Jo Smith")
+        self.assertEqual(Author.objects.filter(first_name="Alex").count(), 1)
+        self.assertEqual(article.lead_photo.name, 'prime/winter/lead/lead.jpg')
+        self.assertEqual((article.lead_photo_width,
+                          article.lead_photo_height), (800, 600))
+        self.assertTrue(article.lead_photo_preview.startswith('data:'))
+        big = Image.objects.get(caption="The walk")
+        self.assertEqual(big.author.last_name, "Lee")
+        self.assertEqual((big.image_width, big.image_height), (500, 375))
+        self.assertEqual(PyImage.open(big.image.path).size, (500, 375))
+        self.assertIn('[img%d full]' % big.pk, article.body)
+        self.assertIn('[img%d right]' % big.pk, article.body)
+        self.assertIn('](http://example.com/x.jpg)', article.body)
+
+        recipe = Recipe.objects.get(slug='ramen')
+        self.assertEqual(recipe.byline, "Alex Chen")
+        self.assertEqual(sorted(recipe.tag.values_list('name', flat=True)),
+                         ['dinner', 'quick'])
+        # the same file is stored once
+        self.assertEqual(recipe.lead_photo.name, article.lead_photo.name)
+        small = Image.objects.get(caption="Broth")
+        self.assertEqual(recipe.body.strip(), '[img%d left]' % small.pk)
+        self.assertEqual(FeedEntry.objects.filter(issue=issue).count(), 2)
+        self.assertEqual(search.search('flyers').count(), 1)
+
+        response = self.client.get('/prime/winter/bruin-walk-at-dawn/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, 'width="500" height="375"')
+
+    def test_concurrent_inserts(self):
+        fall = Issue.objects.create(name="Fall", slug="fall",
+                                    release_date=date(2014, 10, 1))
+        others = {
+            Author: lambda: Author.objects.create(first_name="Zed",
+                                                  last_name="Zero"),
+            Image: lambda: Image.objects.create(image='prime/fall/x.jpg',
+                                                issue=fall),
+        }
+        originals = {}
+        for model, other in others.items():
+            # another writer inserts a row just before the importer's
+            def bulkCreate(objects, batch_size=None, model=model,
+                           other=other):
+                other()
+                originals[model](objects, batch_size=batch_size)
+            originals[model] = model.objects.bulk_create
+            model.objects.bulk_create = bulkCreate
+        try:
+            Importer(self.source, processes=1).run()
+        finally:
+            for model, bulk_create in originals.items():
+                model.objects.bulk_create = bulk_create
+        self.assertEqual(Article.objects.get().byline,
+                         "Alex Chen and Mary Jo Smith")
+        self.assertFalse(Author.objects.get(first_name="Zed").article_set
+                         .exists())
+        small = Image.objects.get(caption="Broth")
+        self.assertEqual(Recipe.objects.get().body.strip(),
+                         '[img%d left]' % small.pk)
+        self.assertEqual(Image.objects.get(image='prime/fall/x.jpg').caption,
+                         '')
+
+    def test_zip(self):
+        archive = os.path.join(self.media, 'winter.zip')
+        with zipfile.ZipFile(archive, 'w') as f:
+            for root, _, files in os.walk(self.source):
+                for name in files:
+                    path = os.path.join(root, name)
+                    f.write(path, os.path.join(
+                        'winter', os.path.relpath(path, self.source)))
+        output = StringIO()
+        call_command('importissue', archive, processes=2, stdout=output)
+        self.assertIn('1 articles, 1 recipes, 0 DIY, 2 images',
+                      output.getvalue())
+        self.assertEqual(Image.objects.get(caption="The walk").image_width,
+                         500)
+
+    def test_errors_write_nothing(self):
+        self.write('broken.md', "---\ntitle: Broken\nteaser: x\n"
+                   "lead_photo: photos/missing.jpg\n---\n")
+        self.assertRaises(IssueImportError,
+                          Importer(self.source, processes=1).run)
+        os.remove(os.path.join(self.source, 'broken.md'))
+        self.write('photos/bad.jpg', 'not an image')
+        self.write('bad.md', "---\ntitle: Bad\nteaser: x\n"
+                   "lead_photo: photos/bad.jpg\n---\n")
+        self.assertRaises(IssueImportError,
+                          Importer(self.source, processes=1).run)
+        self.assertFalse(Issue.objects.exists())
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(self.media)
+                          if files], [])
+
+        Recipe.objects.create(title="Ramen", slug="ramen",
+                              lead_photo='prime/recipe/lead/x.jpg')
+        os.remove(os.path.join(self.source, 'bad.md'))
+        self.assertRaises(IssueImportError,
+                          Importer(self.source, processes=1).run)
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+        os.makedirs(os.path.join(self.media, 'prime', 'fall', 'pdf'))
+        with open(os.path.join(self.media, 'prime', 'fall', 'pdf',
+                               'fall.pdf'), 'wb') as f:
+            f.write('%PDF-1.4 fall')
+        self.issue = Issue.objects.create(name="Fall", slug="fall",
+                                          release_date=date(2014, 10, 1))
+        PDF.objects.create(issue=self.issue, pdf='prime/fall/pdf/fall.pdf')
+        image = Image(issue=self.issue, caption="Royce & the quad")
+        image.image = SimpleUploadedFile('royce.jpg', jpeg((300, 200)))
+        image.save()
+        self.article = Article.objects.create(
+            issue=self.issue, title="Quad", slug="quad", teaser="Grass",
+            lead_photo=SimpleUploadedFile('quad.jpg', jpeg((200, 100))),
+            body="Green *grass*.\n\n[img%d left]\n\n"
+                 "[youtube]http://youtu.be/abc[/youtube]" % image.pk)
+        Recipe.objects.create(issue=self.issue, title="Soup", slug="soup",
+                              lead_photo='prime/recipe/lead/missing.jpg')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def download(self, format):
+        response = self.client.get('/prime/issue/fall/download.%s' % format,
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        data = ''.join(response.streaming_content)
+        return response, zipfile.ZipFile(StringIO(data)), data
+
+    def test_zip(self):
+        response, archive, data = self.download('zip')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIsNone(archive.testzip())
+        names = archive.namelist()
+        self.assertIn('fall.pdf', names)
+        self.assertIn('recipe-soup.html', names)
+        self.assertEqual(archive.read('fall.pdf'), '%PDF-1.4 fall')
+        html = archive.read('article-quad.html').decode('utf-8')
+        self.assertIn('<em>grass</em>', html)
+        self.assertIn('src="images/prime-fall-article-royce.jpg"', html)
+        self.assertIn('Royce &amp; the quad', html)
+        self.assertIn('https://www.youtube.com/watch?v=abc', html)
+        self.assertIn('images/prime-fall-lead-quad.jpg', names)
+        self.assertIn('article-quad.html', archive.read('index.html'))
+
+        # kept on disk and streamed from there until content changes
+        response, _, cached = self.download('zip')
+        self.assertEqual(cached, data)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        directory = os.path.join(self.media, 'archives')
+        self.assertEqual(os.listdir(directory),
+                         ['fall-%d.zip' % caching.generation()])
+        self.article.title = "The quad"
+        self.article.save()
+        _, archive, _ = self.download('zip')
+        self.assertIn('The quad', archive.read('article-quad.html'))
+        self.assertEqual(os.listdir(directory),
+                         ['fall-%d.zip' % caching.generation()])
+
+    def test_epub(self):
+        from xml.dom import minidom
+        response, archive, _ = self.download('epub')
+        self.assertEqual(response['Content-Type'], 'application/epub+zip')
+        self.assertIsNone(archive.testzip())
+        first = archive.infolist()[0]
+        self.assertEqual((first.filename, first.compress_type),
+                         ('mimetype', zipfile.ZIP_STORED))
+        self.assertEqual(archive.read('mimetype'), 'application/epub+zip')
+        self.assertNotIn('OEBPS/fall.pdf', archive.namelist())
+        for name in ('META-INF/container.xml', 'OEBPS/content.opf',
+                     'OEBPS/nav.xhtml', 'OEBPS/article-quad.xhtml',
+                     'OEBPS/recipe-soup.xhtml'):
+            minidom.parseString(archive.read(name))
+        package = archive.read('OEBPS/content.opf')
+        self.assertIn('href="article-quad.xhtml"', package)
+        self.assertIn('href="images/prime-fall-article-royce.jpg" '
+                      'media-type="image/jpeg"', package)
+
+    def test_missing_issue(self):
+        response = self.client.get('/prime/issue/winter/download.zip',
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_first_builds(self):
+        # two requests in one worker's threads, interleaved chunk by chunk
+        path = archive.cachedPath(self.issue, 'zip', 1)
+        first = archive.saving(iter(['a1', 'a2']), path)
+        second = archive.saving(iter(['b1', 'b2']), path)
+        self.assertEqual(zip(first, second), [('a1', 'b1'), ('a2', 'b2')])
+        self.assertEqual(list(second), [])
+        with open(path) as f:
+            self.assertIn(f.read(), ('a1a2', 'b1b2'))
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+
+
+class FeedsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.issue = Issue.objects.create(name="Fall", slug="fall",
+                                          release_date=date(2014, 10, 1))
+        for n in xrange(3):
+            Article.objects.create(issue=self.issue, title="Piece %d" % n,
+                                   slug="piece-%d" % n, teaser="Rock & roll",
+                                   lead_photo='prime/fall/lead/%d.jpg' % n,
+                                   position=n)
+        recipe = Recipe.objects.create(title="Soup", slug="soup",
+                                       lead_photo='prime/recipe/lead/s.jpg')
+        recipe.tag.add(RecipeTag.objects.create(name="dinner"))
+        Neighborhood.objects.create(title="Westwood", slug="westwood",
+                                    lead_photo='prime/cityguides/lead/w.jpg')
+
+    def get(self, path):
+        response = self.client.get(path, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        content = ''.join(response.streaming_content) \
+            if response.streaming else response.content
+        return response, content
+
+    def locations(self, content):
+        from xml.dom import minidom
+        return [node.firstChild.data for node in
+                minidom.parseString(content).getElementsByTagName('loc')]
+
+    def test_sitemaps(self):
+        _, index = self.get('/prime/sitemap.xml')
+        urls = []
+        for sitemap in self.locations(index):
+            path = sitemap[len('http://localhost'):]
+            urls += self.locations(self.get(path)[1])
+        for path in ('/prime/', '/prime/issue/fall/', '/prime/fall/piece-2/',
+                     '/prime/recipes/soup/', '/prime/recipes/tagged/dinner/',
+                     '/prime/cityguides/westwood/'):
+            self.assertIn('http://localhost' + path, urls)
+        self.assertIn('<lastmod>2014-10-01</lastmod>',
+                      self.get('/prime/sitemap-articles-1.xml')[1])
+
+    def test_sitemap_pages(self):
+        limit, chunk = feeds.SITEMAP_LIMIT, feeds.CHUNK
+        feeds.SITEMAP_LIMIT, feeds.CHUNK = 2, 1
+        try:
+            index = self.locations(self.get('/prime/sitemap.xml')[1])
+            self.assertIn('http://localhost/prime/sitemap-articles-2.xml',
+                          index)
+            self.assertNotIn('http://localhost/prime/sitemap-articles-3.xml',
+                             index)
+            first = self.locations(
+                self.get('/prime/sitemap-articles-1.xml')[1])
+            second = self.locations(
+                self.get('/prime/sitemap-articles-2.xml')[1])
+            self.assertEqual(len(first), 2)
+            self.assertEqual(sorted(first + second), [
+                'http://localhost/prime/fall/piece-%d/' % n
+                for n in xrange(3)])
+            response = self.client.get('/prime/sitemap-articles-3.xml',
+                                       HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 404)
+        finally:
+            feeds.SITEMAP_LIMIT, feeds.CHUNK = limit, chunk
+        response = self.client.get('/prime/sitemap-bogus-1.xml',
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached_until_content_changes(self):
+        response, first = self.get('/prime/sitemap-articles-1.xml')
+        self.assertTrue(response.streaming)
+        response, second = self.get('/prime/sitemap-articles-1.xml')
+        self.assertFalse(response.streaming)
+        self.assertEqual(first, second)
+        Article.objects.create(issue=self.issue, title="New", slug="new",
+                               teaser="x", lead_photo='prime/fall/lead/n.jpg')
+        response, third = self.get('/prime/sitemap-articles-1.xml')
+        self.assertTrue(response.streaming)
+        self.assertIn('/prime/fall/new/', third)
+
+    def test_feeds(self):
+        from xml.dom import minidom
+        response, atom = self.get('/prime/feeds/all.atom')
+        self.assertTrue(response['Content-Type'].startswith(
+            'application/atom+xml'))
+        document = minidom.parseString(atom)
+        self.assertEqual(len(document.getElementsByTagName('entry')), 3)
+        self.assertIn('<summary>Rock &amp; roll</summary>', atom)
+        self.assertIn('<updated>2014-10-01T00:00:00Z</updated>', atom)
+        self.assertIn('href="http://localhost/prime/fall/piece-0/"', atom)
+
+        _, rss = self.get('/prime/feeds/article.rss')
+        document = minidom.parseString(rss)
+        self.assertEqual(len(document.getElementsByTagName('item')), 3)
+        self.assertIn('<pubDate>Wed, 01 Oct 2014 00:00:00 -0000</pubDate>',
+                      rss)
+        # no issue, so no date to list it under
+        _, recipes = self.get('/prime/feeds/recipe.atom')
+        self.assertNotIn('Soup', recipes)
+
+        _, issue = self.get('/prime/issue/fall/feed.rss')
+        titles = [node.firstChild.data for node in minidom.parseString(issue)
+                  .getElementsByTagName('title')]
+        self.assertEqual(titles, ['prime Fall', 'Piece 0', 'Piece 1',
+                                  'Piece 2'])
+        response = self.client.get('/prime/issue/winter/feed.atom',
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 404)
+
+
+class PrintPagesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+        issue = Issue.objects.create(name="Fall", slug="fall",
+                                     release_date=date(2014, 10, 1))
+        os.makedirs(os.path.join(self.media, 'prime', 'fall', 'pdf'))
+        self.pdf = PDF.objects.create(issue=issue,
+                                      pdf='prime/fall/pdf/fall.pdf')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def test_not_rasterized(self):
+        response = self.client.get('/prime/issue/fall/print/',
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(
+            '/media/prime/fall/pdf/fall.pdf'))
+
+    def test_viewer(self):
+        target = pdfpages.directory(self.pdf)
+        os.makedirs(os.path.join(self.media, target))
+        pages = [pdfpages.writePage(PyImage.new('RGB', (1600, 2070)),
+                                    number, target) for number in (1, 2)]
+        self.assertEqual(pages[0]['small'],
+                         {'src': 'prime/fall/pages/1-small.jpg',
+                          'width': 480, 'height': 621})
+        self.assertTrue(os.path.getsize(os.path.join(
+            self.media, pages[0]['medium']['src'])) < 100 * 1024)
+        with open(pdfpages.manifestPath(self.pdf), 'w') as f:
+            json.dump({'pdf': self.pdf.pdf.name, 'pages': pages}, f)
+
+        response = self.client.get('/prime/issue/fall/print/',
+                                   HTTP_HOST='localhost')
+        self.assertContains(response, 'srcset="/media/prime/fall/pages/'
+                                      '1-small.jpg 480w, ')
+        self.assertContains(response, 'width="960" height="1242" '
+                                      'decoding="async" alt="Page 1"')
+        self.assertContains(response, 'loading="lazy" decoding="async" '
+                                      'alt="Page 2"')
+
+    @unittest.skipUnless(find_executable(pdfpages.PDFTOPPM) and
+                         find_executable(pdfpages.PDFINFO),
+                         "poppler-utils is not installed")
+    def test_rasterize(self):
+        pages = [PyImage.new('RGB', (612, 792), color)
+                 for color in ('red', 'blue', 'green')]
+        pages[0].save(self.pdf.pdf.path, 'PDF', save_all=True,
+                      append_images=pages[1:])
+        call_command('rasterizepdfs', stdout=StringIO())
+        manifest = pdfpages.loadManifest(self.pdf)
+        self.assertEqual(len(manifest['pages']), 3)
+        self.assertEqual(manifest['pages'][2]['large']['width'], 1600)
+        pdf = PDF.objects.get()
+        self.assertEqual(pdf.image.name, 'prime/fall/pages/1-medium.jpg')
+        self.assertTrue(pdf.image_preview)
+        self.assertTrue(pdfpages.upToDate(pdf))
+
+
+# queries each page may run, however much content there is
+QUERY_BUDGETS = {
+    'root': 3,
+    'prime_issue': 5,
+    'prime_past_issues': 3,
+    'prime_article': 3,
+    'prime_recipe': 3,
+    'prime_recipes': 3,
+    'prime_recipe_tag': 3,
+    'prime_diy': 3,
+    'prime_diys': 3,
+    'prime_diy_tag': 3,
+    'cityguides_view': 1,
+    # the [imgN] images of the intro and every guide in one query
+    'cityguide_view': 3,
+}
+SMALL = dict(authors=5, issues=3, images=20, tags=3, articles=10, recipes=10,
+             diys=10, neighborhoods=2, guides=6, albums=0)
+LARGE = dict(authors=50, issues=30, images=300, tags=3, articles=990,
+             recipes=300, diys=300, neighborhoods=20, guides=200, albums=0)
+
+
+@override_settings(PRIME_CACHE_TIMEOUT=0)
+class QueryBudgetTest(TestCase):
+    """
+    A page's query count must stay within its budget and must not change
+    when the database grows: growth with data size is an N+1.
+    """
+    def setUp(self):
+        self.generator = Generator(seed=2)
+        self.generator.run(**SMALL)
+        issue = Issue.objects.order_by('pk')[0]
+        body = ' '.join('[img%d left]' % image.pk for image in
+                        Image.objects.order_by('pk')[:12])
+        self.article = Article.objects.create(
+            title="Probe", slug="probe", issue=issue, body=body,
+            lead_photo="prime/lead/probe.jpg")
+        self.recipe = Recipe.objects.create(
+            title="Probe", slug="probe", issue=issue, body=body,
+            lead_photo="prime/recipe/lead/probe.jpg")
+        self.diy = DIYarticle.objects.create(
+            title="Probe", slug="probe", issue=issue, body=body,
+            lead_photo="prime/diy/lead/probe.jpg")
+        self.neighborhood = Neighborhood.objects.create(
+            title="Probe", slug="probe", intro_body=body,
+            lead_photo="prime/cityguides/lead/probe.jpg")
+        for option in ('see', 'do', 'eat'):
+            CityGuideArticle.objects.create(
+                neighborhood=self.neighborhood, title="Probe", body=body,
+                option=option,
+                lead_photo="prime/cityguides/neighborhood/probe.jpg")
+
+    def pages(self):
+        issue = self.article.issue
+        return {
+            'root': reverse('root'),
+            'prime_issue': reverse('prime_issue', args=[issue.slug]),
+            'prime_past_issues': reverse('prime_past_issues'),
+            'prime_article': reverse('prime_article',
+                                     args=[issue.slug, 'probe']),
+            'prime_recipe': reverse('prime_recipe'),
+            'prime_recipes': reverse('prime_recipes', args=['probe']),
+            'prime_recipe_tag': reverse(
+                'prime_recipe_tag',
+                args=[RecipeTag.objects.order_by('pk')[0].name]),
+            'prime_diy': reverse('prime_diy'),
+            'prime_diys': reverse('prime_diys', args=['probe']),
+            'prime_diy_tag': reverse(
+                'prime_diy_tag', args=[DIYTag.objects.order_by('pk')[0].name]),
+            'cityguides_view': reverse('cityguides_view'),
+            'cityguide_view': reverse('cityguide_view', args=['probe']),
+        }
+
+    def counts(self):
+        counts = {}
+        for name, url in self.pages().iteritems():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_HOST='localhost')
+            self.assertEqual(response.status_code, 200, url)
+            counts[name] = len(queries)
+        return counts
+
+    def test_views(self):
+        small = self.counts()
+        self.generator.run(**LARGE)
+        # the probe district grows too, with images of its own
+        images = list(Image.objects.order_by('-pk')[:30])
+        for n, image in enumerate(images):
+            CityGuideArticle.objects.create(
+                neighborhood=self.neighborhood, title="Guide %d" % n,
+                body='[img%d left] [img%d]' % (image.pk, images[0].pk),
+                option=('see', 'do', 'eat')[n % 3],
+                lead_photo="prime/cityguides/neighborhood/%d.jpg" % n)
+        large = self.counts()
+        for name, budget in QUERY_BUDGETS.iteritems():
+            self.assertEqual(small[name], large[name],
+                             "%s: %d queries with %d articles, %d with %d" % (
+                                 name, small[name], SMALL['articles'],
+                                 large[name], Article.objects.count()))
+            self.assertTrue(large[name] <= budget, "%s: %d queries, budget "
+                            "%d" % (name, large[name], budget))
+
+    def test_image_shortcodes(self):
+        images = list(Image.objects.order_by('pk'))
+        for count in (2, len(images)):
+            body = ' '.join('[img%d]' % image.pk for image in images[:count])
+            with self.assertNumQueries(1):
+                html = imageFilter(body)
+            self.assertEqual(html.count('<figure'), count)
+        with self.assertNumQueries(0):
+            imageFilter('[youtube]http://youtu.be/x[/youtube]')
+        # loaded by the view for several bodies at once
+        loaded = imagesIn(body)
+        with self.assertNumQueries(0):
+            self.assertEqual(imageFilter(body, loaded).count('<figure'),
+                             len(images))
+        response = self.client.get(reverse('cityguide_view', args=['probe']),
+                                   HTTP_HOST='localhost')
+        self.assertEqual(response.content.count('<figure'), 4 * 12)
@@ -1,19 +1,28 @@
 from django.conf.urls import patterns, url
-from prime.views import CGView, DistrictView, DIYView, RecipeView, IssueView, ArticleView, RecipeFrontView, DIYFrontView, LandingView, RecipeTagsView, DIYTagsView, PastIssuesView
+from prime.caching import cachedPage
+from prime.views import CGView, DistrictView, DIYView, RecipeView, IssueView, PrintView, ArchiveView, ArticleView, RecipeFrontView, DIYFrontView, LandingView, RecipeTagsView, DIYTagsView, PastIssuesView, SearchView, SuggestView, SitemapIndexView, SitemapView, FeedView, IssueFeedView
 
 urlpatterns = patterns('',
-    url(r'^$', LandingView.as_view(), name='root'),
-    url(r'^recipes/$', RecipeFrontView.as_view(), name='prime_recipe'),
-    url(r'^recipes/(?P<recipe_slug>[-_\w]+)/$', RecipeView.as_view(), name='prime_recipes'),
-    url(r'^recipes/tagged/(?P<tag_name>[\w|\W]+)/$', RecipeTagsView.as_view(), name='prime_recipe_tag'),
-    url(r'^diy/$', DIYFrontView.as_view(), name='prime_diy'),
-    url(r'^diy/(?P<diy_slug>[-_\w]+)/$', DIYView.as_view(), name='prime_diys'),
-    url(r'^diy/tagged/(?P<tag_name>[\w|\W]+)/$', DIYTagsView.as_view(), name='prime_diy_tag'),
-    url(r'^cityguides/$', CGView.as_view(), name='cityguides_view'),
-    url(r'^cityguides/(?P<district_name>[\w|\W]+)/$', DistrictView.as_view(), name='cityguide_view'),
-    url(r'^issue/(?P<slug>[-_\w]+)/$', IssueView.as_view(), name='prime_issue'),
-    url(r'^(?P<issue_slug>[-_\w]+)/(?P<article_slug>[-_\w]+)/$', ArticleView.as_view(), name='prime_article'),
-    url(r'^past_issues/$', PastIssuesView.as_view(), name='prime_past_issues'),
+    url(r'^$', cachedPage(LandingView.as_view()), name='root'),
+    url(r'^recipes/$', cachedPage(RecipeFrontView.as_view()), name='prime_recipe'),
+    url(r'^recipes/(?P<recipe_slug>[-_\w]+)/$', cachedPage(RecipeView.as_view()), name='prime_recipes'),
+    url(r'^recipes/tagged/(?P<tag_name>[\w|\W]+)/$', cachedPage(RecipeTagsView.as_view()), name='prime_recipe_tag'),
+    url(r'^diy/$', cachedPage(DIYFrontView.as_view()), name='prime_diy'),
+    url(r'^diy/(?P<diy_slug>[-_\w]+)/$', cachedPage(DIYView.as_view()), name='prime_diys'),
+    url(r'^diy/tagged/(?P<tag_name>[\w|\W]+)/$', cachedPage(DIYTagsView.as_view()), name='prime_diy_tag'),
+    url(r'^cityguides/$', cachedPage(CGView.as_view()), name='cityguides_view'),
+    url(r'^cityguides/(?P<district_name>[\w|\W]+)/$', cachedPage(DistrictView.as_view()), name='cityguide_view'),
+    url(r'^issue/(?P<slug>[-_\w]+)/$', cachedPage(IssueView.as_view()), name='prime_issue'),
+    url(r'^issue/(?P<slug>[-_\w]+)/print/$', cachedPage(PrintView.as_view()), name='prime_issue_print'),
+    url(r'^issue/(?P<slug>[-_\w]+)/download\.(?P<format>zip|epub)$', ArchiveView.as_view(), name='prime_issue_archive'),
+    url(r'^issue/(?P<slug>[-_\w]+)/feed\.(?P<format>atom|rss)$', IssueFeedView.as_view(), name='prime_issue_feed'),
+    url(r'^feeds/(?P<kind>all|article|recipe|diy)\.(?P<format>atom|rss)$', FeedView.as_view(), name='prime_feed'),
+    url(r'^sitemap\.xml$', SitemapIndexView.as_view(), name='prime_sitemap'),
+    url(r'^sitemap-(?P<section>[-a-z]+)-(?P<page>\d+)\.xml$', SitemapView.as_view(), name='prime_sitemap_section'),
+    url(r'^(?P<issue_slug>[-_\w]+)/(?P<article_slug>[-_\w]+)/$', cachedPage(ArticleView.as_view()), name='prime_article'),
+    url(r'^past_issues/$', cachedPage(PastIssuesView.as_view()), name='prime_past_issues'),
+    url(r'^search/$', SearchView.as_view(), name='prime_search'),
+    url(r'^suggest/$', SuggestView.as_view(), name='prime_suggest'),
 
     # url(r'^cityguide/$', CityGuideFrontView.as_view(), name='prime_city'),
 )
@@ -1,12 +1,18 @@
-from prime.models import Issue, Article, PDF, Recipe, RecipeTag, DIYarticle, DIYTag, Neighborhood, CityGuideArticle
+import json
+import os
+
+from prime.models import Issue, Article, PDF, Recipe, RecipeTag, DIYarticle, DIYTag, Neighborhood, CityGuideArticle, FeedEntry, RelatedContent
 from django.views.generic import View
 from django.views.generic.detail import DetailView
 from django.shortcuts import render_to_response, get_object_or_404, redirect
 from django.http import Http404
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import HttpResponse
-from itertools import chain
+from django.http import HttpResponse, StreamingHttpResponse
+from prime.search import search
+from prime import archive, caching, feeds, pdfpages, suggest
+from prime.templatetags.shortcodes import imagesIn
 
 # utility functions
 
@@ -22,6 +28,13 @@ def get_recent_issues(issue_slug=None):
             recent_issues = Issue.objects.order_by('-release_date')[0:3]
     return issue, recent_issues
 
+def get_related(kind, object_id):
+    return RelatedContent.objects.filter(entry__kind=kind,
+                                         entry__object_id=object_id,
+                                         target__isnull=False)\
+                                 .select_related('target', 'target__issue')\
+                                 .order_by('rank')
+
 
 # pages
 
@@ -29,31 +42,85 @@ class IssueView(View):
     def get(self, context, slug):
         issue, recent_issues = get_recent_issues(slug)
 
-        diys = DIYarticle.objects.filter(issue=issue).order_by('position')
-        recipes = Recipe.objects.filter(issue=issue).order_by('position')
-        articles = Article.objects.filter(issue=issue).order_by('position')
-        # result_list = list(chain(articles, recipes, diys))
+        entries = FeedEntry.objects.filter(issue=issue)\
+                                   .select_related('issue')\
+                                   .order_by('position', 'id')
 
         pdf = PDF.objects.get(issue=issue)
         context = {
             'issue': issue,
             'recent_issues': recent_issues,
-            'articles': articles,
-            'diys': diys,
-            'recipes': recipes,
+            'entries': entries,
             'pdf': pdf,
             'MEDIA_URL': settings.MEDIA_URL,
             'STATIC_URL': settings.STATIC_URL
         }
         return render_to_response('prime/front.html', context)
 
+class PrintView(View):
+    """
+    The issue's print magazine as page images (see ``prime.pdfpages``), or
+    the PDF itself until it has been rasterized.
+    """
+    def get(self, context, slug):
+        issue, recent_issues = get_recent_issues(slug)
+        pdf = get_object_or_404(PDF, issue=issue)
+        manifest = pdfpages.loadManifest(pdf)
+        if manifest is None:
+            return redirect(settings.MEDIA_URL + pdf.pdf.name)
+        pages = []
+        for number, page in enumerate(manifest['pages'], 1):
+            default = page[pdfpages.COVER_SIZE]
+            pages.append({
+                'number': number,
+                'src': settings.MEDIA_URL + default['src'],
+                'srcset': pdfpages.srcset(page),
+                'width': default['width'],
+                'height': default['height'],
+            })
+        context = {
+            'issue': issue,
+            'recent_issues': recent_issues,
+            'pdf': pdf,
+            'pages': pages,
+            'hide_footer': True,
+            'MEDIA_URL': settings.MEDIA_URL,
+            'STATIC_URL': settings.STATIC_URL
+        }
+        return render_to_response('prime/print.html', context)
+
+class ArchiveView(View):
+    """
+    The whole issue as a zip or EPUB (see ``prime.archive``), streamed as
+    it is built the first time and from disk after that.
+    """
+    def get(self, context, slug, format):
+        issue = get_object_or_404(Issue, slug=slug)
+        content_type = archive.FORMATS[format]['content_type']
+        generation = caching.generation()
+        path = archive.cached(issue, format, generation)
+        if path is not None:
+            response = StreamingHttpResponse(archive.readFile(path),
+                                             content_type=content_type)
+            response['Content-Length'] = str(os.path.getsize(path))
+        else:
+            chunks = archive.saving(
+                archive.Archive(issue, format).chunks(),
+                archive.cachedPath(issue, format, generation),
+                archive.stored(issue, format))
+            response = StreamingHttpResponse(chunks,
+                                             content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="prime-%s.%s"' % (issue.slug, format)
+        return response
+
 class PastIssuesView(View):
     def get(self, context):
         current_issue, recent_issues = get_recent_issues()
         recent_issues = Issue.objects.order_by('-release_date')[1:]
-        pdfs = []
-        for issue in recent_issues:
-            pdfs.append(PDF.objects.get(issue=issue))
+        pdfs = PDF.objects.exclude(issue=current_issue)\
+                          .select_related('issue')\
+                          .order_by('-issue__release_date')
         context = {
             'issue': current_issue,
             'recent_issues': recent_issues,
@@ -67,7 +134,8 @@ class PastIssuesView(View):
 class ArticleView(View):
     def get(self, context, issue_slug, article_slug):
         try:
-            article = Article.objects.get(issue__slug=issue_slug,
+            article = Article.objects.select_related('issue')\
+                                     .get(issue__slug=issue_slug,
                                           slug=article_slug, )
         except Article.DoesNotExist:
             raise Http404
@@ -77,6 +145,7 @@ class ArticleView(View):
         context = {
             'article': article,
             'articles': articles,
+            'related': get_related('article', article.pk),
             'MEDIA_URL': settings.MEDIA_URL,
             'STATIC_URL': settings.STATIC_URL
         }
@@ -87,8 +156,8 @@ class ArticleView(View):
 class LandingView(View):
     def get(self, context):
         current_issue, _ = get_recent_issues()
-        article_list = Article.objects.order_by('issue', '-position').reverse().distinct()
-        paginator = Paginator(article_list, 4)
+        entry_list = FeedEntry.objects.select_related('issue')
+        paginator = Paginator(entry_list, 4)
         page = self.request.GET.get('page')
         try:
             articles = paginator.page(page)
@@ -116,19 +185,20 @@ class CGView(View):
 
 class DistrictView(View):
     def get(self, context, district_name):
-        article_list = CityGuideArticle.objects.all();
-        articles = article_list.filter(neighborhood__slug=district_name)
-        see = articles.filter(option="see")
-        do = articles.filter(option="do")
-        eat = articles.filter(option="eat")
         neighborhood = Neighborhood.objects.get(slug=district_name)
+        articles = list(CityGuideArticle.objects.filter(
+            neighborhood=neighborhood))
         neighborhoods = Neighborhood.objects.all()[0:8]
+        # every [imgN] on the page in one query, however many guides
+        images = imagesIn(neighborhood.intro_body,
+                          *[article.body for article in articles])
         context = {
             'latest' : neighborhoods,
             'neighborhood': neighborhood,
-            'see': see,
-            'do': do,
-            'eat': eat,
+            'see': [a for a in articles if a.option == "see"],
+            'do': [a for a in articles if a.option == "do"],
+            'eat': [a for a in articles if a.option == "eat"],
+            'images': images,
             'STATIC_URL': settings.STATIC_URL,
             'MEDIA_URL': settings.MEDIA_URL
         }
@@ -159,21 +229,23 @@ class RecipeFrontView(View):
 
 class RecipeView(View):
     def get(self, context, issue_slug, recipe_slug):
-        recipe = Recipe.objects.get(slug=recipe_slug)
+        recipe = Recipe.objects.select_related('issue').get(slug=recipe_slug)
         context = {
             'article': recipe,
             'typeTitle': 'Recipes',
             'typeRoot': 'prime_recipe',
+            'related': get_related('recipe', recipe.pk),
             'STATIC_URL': settings.STATIC_URL,
             'MEDIA_URL': settings.MEDIA_URL
         }
         return render_to_response('prime/diy-or-recipe/article.html', context)
     def get(self, context, recipe_slug):
-        recipe = Recipe.objects.get(slug=recipe_slug)
+        recipe = Recipe.objects.select_related('issue').get(slug=recipe_slug)
         context = {
             'article': recipe,
             'typeTitle': 'Recipes',
             'typeRoot': 'prime_recipe',
+            'related': get_related('recipe', recipe.pk),
             'STATIC_URL': settings.STATIC_URL,
             'MEDIA_URL': settings.MEDIA_URL
         }
@@ -181,21 +253,23 @@ class RecipeView(View):
 
 class DIYView(View):
     def get(self, context, issue_slug, diy_slug):
-        article = DIYarticle.objects.get(slug=diy_slug)
+        article = DIYarticle.objects.select_related('issue').get(slug=diy_slug)
         context = {
             'article': article,
             'typeTitle': 'DIY',
             'typeRoot': 'prime_diy',
+            'related': get_related('diy', article.pk),
             'STATIC_URL': settings.STATIC_URL,
             'MEDIA_URL': settings.MEDIA_URL
         }
         return render_to_response('prime/diy-or-recipe/article.html', context)
     def get(self, context, diy_slug):
-        article = DIYarticle.objects.get(slug=diy_slug)
+        article = DIYarticle.objects.select_related('issue').get(slug=diy_slug)
         context = {
             'article': article,
             'typeTitle': 'DIY',
             'typeRoot': 'prime_diy',
+            'related': get_related('diy', article.pk),
             'STATIC_URL': settings.STATIC_URL,
             'MEDIA_URL': settings.MEDIA_URL
         }
@@ -270,6 +344,73 @@ class DIYTagsView(View):
         }
         return render_to_response('prime/diy-or-recipe/diy-or-recipe-front.html', context)
 
+class SearchView(View):
+    def get(self, context):
+        query = self.request.GET.get('q', '')
+        paginator = Paginator(search(query), 10)
+        page = self.request.GET.get('page')
+        try:
+            results = paginator.page(page)
+        except PageNotAnInteger:
+            results = paginator.page(1)
+        except EmptyPage:
+            results = paginator.page(paginator.num_pages)
+        context = {
+            'query': query,
+            'results': results,
+            'typeTitle': 'Search',
+            'STATIC_URL': settings.STATIC_URL,
+            'MEDIA_URL': settings.MEDIA_URL
+        }
+        return render_to_response('prime/search.html', context)
+
+class SuggestView(View):
+    def get(self, context):
+        query = self.request.GET.get('q', '')
+        results = [{'label': label, 'kind': kind, 'url': url}
+                   for label, kind, url in suggest.lookup(query)]
+        return HttpResponse(json.dumps({'query': query, 'results': results}),
+                            content_type='application/json')
+
+class SitemapIndexView(View):
+    def get(self, context):
+        base = self.request.build_absolute_uri('/')[:-1]
+        return feeds.cachedStream(self.request, feeds.SITEMAP_TYPE,
+                                  lambda: feeds.sitemapIndex(base))
+
+class SitemapView(View):
+    def get(self, context, section, page):
+        page = int(page)
+        if section != 'pages' and feeds.section(section) is None or \
+                not 1 <= page <= feeds.pageCount(section):
+            raise Http404
+        base = self.request.build_absolute_uri('/')[:-1]
+        return feeds.cachedStream(self.request, feeds.SITEMAP_TYPE,
+                                  lambda: feeds.sitemap(base, section, page))
+
+class FeedView(View):
+    """
+    The latest pieces of one kind, or of every kind, as Atom or RSS.
+    """
+    def get(self, context, kind, format):
+        base = self.request.build_absolute_uri('/')[:-1]
+        return feeds.cachedStream(
+            self.request, feeds.FEED_TYPES[format],
+            lambda: feeds.FEED_WRITERS[format](
+                base, feeds.FEED_TITLES[kind], reverse('root'),
+                self.request.path, feeds.feedEntries(kind)))
+
+class IssueFeedView(View):
+    def get(self, context, slug, format):
+        issue = get_object_or_404(Issue, slug=slug)
+        base = self.request.build_absolute_uri('/')[:-1]
+        return feeds.cachedStream(
+            self.request, feeds.FEED_TYPES[format],
+            lambda: feeds.FEED_WRITERS[format](
+                base, 'prime %s' % issue.name,
+                reverse('prime_issue', args=[slug]), self.request.path,
+                feeds.feedEntries(issue=issue)))
+
 # special handlers
 
 def error404(request): # not currently implemented
@@ -47,15 +47,97 @@ LOCAL_APPS = (
 
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
+# Session, CSRF, auth and messages are skipped for LEAN_PATH_PREFIXES so
+# anonymous pages never touch the session store or set cookies. The admin
+# (and anything else) still gets the full stack.
 MIDDLEWARE_CLASSES = (
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'main.middleware.MetricsMiddleware',
+    'main.middleware.CompressionMiddleware',
+    'main.middleware.PreloadMiddleware',
+    'main.middleware.ProfilingMiddleware',
+    'main.middleware.QueryLogMiddleware',
+    'main.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'main.middleware.CsrfViewMiddleware',
+    'main.middleware.AuthenticationMiddleware',
+    'main.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+LEAN_PATH_PREFIXES = (
+    '/prime/',
+    '/music/',
+    '/metrics',
+)
+
+# Per-worker metrics files, summed by /metrics (None disables collection).
+# The endpoint only answers direct requests from METRICS_ALLOWED_IPS, never
+# proxied ones.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+# Brotli (with the brotli package installed) or gzip for text responses of
+# LEAN_PATH_PREFIXES, which carry no CSRF tokens; cached prime pages keep a
+# copy per encoding. False unloads the middleware.
+RESPONSE_COMPRESSION = True
+
+# Fraction of requests (0 to 1) timed by ProfilingMiddleware; 0 unloads it.
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+
+# Fraction of requests whose queries are fingerprinted into the slow query
+# log (Main > Query fingerprints in the admin); 0 unloads the middleware.
+# Queries faster than QUERY_LOG_MIN_DURATION milliseconds are ignored.
+QUERY_LOG_SAMPLE_RATE = float(os.environ.get('QUERY_LOG_SAMPLE_RATE', 0))
+QUERY_LOG_MIN_DURATION = 0
+
+# oEmbed endpoints for the thumbnails and titles of YouTube and Spotify
+# facades (main.embeds), fetched with this timeout in seconds by the
+# fetchembeds command (run it from cron). EMBED_FETCH_ON_SAVE = True also
+# fetches them while saving, which makes saves wait on the providers.
+OEMBED_ENDPOINTS = {
+    'youtube': 'https://www.youtube.com/oembed',
+    'spotify': 'https://open.spotify.com/oembed',
+}
+EMBED_FETCH_TIMEOUT = 5
+EMBED_FETCH_ON_SAVE = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'main.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'main.embeds': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'main.querylog': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'prime.caching': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# Whole-page and fragment caching of prime pages, in seconds (0 disables).
+# Entries are keyed by a content generation, so saves invalidate them.
+PRIME_CACHE_TIMEOUT = 60 * 60 * 24
+
 ROOT_URLCONF = 'project.urls'
 
 WSGI_APPLICATION = 'project.wsgi.application'
@@ -90,8 +172,52 @@ RECIPE_MEDIA_URL = '/uploads/'
 # Example: "/var/www/example.com/static/"
 
 STATIC_ROOT = BASE_DIR + "/../static"
+
+# Static files served together, as {% bundle "<name>" %} in templates.
+# "manage.py buildassets" (after collectstatic) writes them minified with
+# content-hashed names under STATIC_ROOT/bundles/, which the web server can
+# send with "Cache-Control: public, max-age=31536000, immutable". Until they
+# are built, or with DEBUG on, the source files are linked one by one.
+ASSET_BUNDLES = {
+    'prime.css': ('prime/css/main.css', 'prime/css/minishare.css'),
+    'prime.js': ('prime/js/jquery.stalactite.min.js', 'prime/js/minishare.js',
+                 'main/js/embeds.js'),
+    # bundles keep each page's cascade: the ones ending in -late.css and
+    # embeds.css are linked after Bootstrap
+    'prime-article.css': ('prime/css/diy-or-recipe/style.css',),
+    'prime-article-late.css': ('prime/css/minishare.css',
+                               'main/css/embeds.css'),
+    'prime-recipe.css': ('prime/css/minishare.css',
+                         'prime/css/diy-or-recipe/style.css'),
+    'embeds.css': ('main/css/embeds.css',),
+    'prime-landing.css': ('prime/css/landing/style.css',),
+    'prime-cityguide.css': ('prime/css/cityguide/style.css',
+                            'prime/css/diy-or-recipe/style.css'),
+    'prime-cityguide.js': ('prime/js/cityguide/jquery.tmpl.min.js',
+                           'prime/js/cityguide/jquery.kinetic.js',
+                           'prime/js/cityguide/jquery.easing.1.3.js'),
+    'prime-district.css': ('prime/css/cityguide/district/normalize.css',
+                           'prime/css/cityguide/district/demo.css',
+                           'prime/css/cityguide/district/component.css',
+                           'prime/css/diy-or-recipe/style.css'),
+    'prime-district.js': ('prime/js/cityguide/classie.js',
+                          'main/js/embeds.js'),
+    'prime-suggest.js': ('prime/js/suggest.js',),
+    'music.css': ('music/css/reset.css', 'music/css/fontello-stars.css',
+                  'music/css/main.css', 'main/css/embeds.css'),
+    'music.js': ('music/js/lib/images-loaded.js', 'music/js/lib/color-thief.js',
+                 'music/js/main.js', 'main/js/embeds.js'),
+}
 MEDIA_ROOT = BASE_DIR + "/../uploads"
 
+# Uploads are streamed to a temporary file in chunks whatever their size,
+# then moved into MEDIA_ROOT, so a large photo never sits in a worker's
+# memory. Images with more pixels than IMAGE_MAX_PIXELS are refused.
+FILE_UPLOAD_HANDLERS = (
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+)
+IMAGE_MAX_PIXELS = 80 * 1000 * 1000
+
 
 TEMPLATE_DIRS = (
     BASE_DIR+'/templates',
@@ -17,3 +17,24 @@ DATABASES = {
         'PORT': '',
     }
 }
+
+# Shared by all workers, so cache warm-ups and content generation bumps
+# are seen everywhere.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR + '/../cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
+METRICS_DIR = BASE_DIR + '/../metrics'
+
+# Compiled templates are kept per process, and shared by every worker when
+# they are preloaded (WSGI_PRELOAD=1 with gunicorn --preload).
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', (
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    )),
+)
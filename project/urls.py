@@ -16,6 +16,9 @@ urlpatterns = patterns('',
     # mainsite
     url(r'^prime/', include('prime.urls')),
     # other apps
-    url(r'^music/', include('music.urls'))
+    url(r'^music/', include('music.urls')),
+
+    # Prometheus scrape target
+    url(r'^metrics$', 'main.views.metrics_endpoint', name='metrics'),
     
 ) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -27,6 +27,12 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings.prod")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Warm URL resolvers, templates and lazily imported modules once, before a
+# pre-forking server (gunicorn --preload) forks its workers; see main.startup.
+if os.environ.get('WSGI_PRELOAD'):
+    from main.startup import preload
+    preload(application)
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)